@@ -0,0 +1,146 @@
+# bom.py - вложенные изделия (узлы) и развернутый состав изделия
+#
+# Изделие может включать другие изделия (product_products): типовая площадка
+# или секция лестницы описывается один раз и входит в изделия и этапы
+# узлом. Дерево разворачивается рекурсивным CTE; ребро, возвращающее в уже
+# пройденное изделие, считается циклом и дальше не разворачивается.
+# Себестоимость узла входит в себестоимость родителя, поэтому при изменении
+# узла пересчитывается только он и его предки - снизу вверх.
+import sqlite3
+
+# Дерево узлов от корней: множитель - сколько экземпляров узла входит в корень,
+# путь /id/id/ - для обнаружения циклов
+BOM_TREE_CTE = """
+    tree(root, product_id, multiplier, path) AS (
+        SELECT id, id, 1, '/' || id || '/' FROM products WHERE id IN ({roots})
+        UNION ALL
+        SELECT t.root, pp.child_product_id, t.multiplier * pp.quantity,
+               t.path || pp.child_product_id || '/'
+        FROM tree t
+        JOIN product_products pp ON pp.parent_product_id = t.product_id
+        WHERE instr(t.path, '/' || pp.child_product_id || '/') = 0
+    )"""
+
+# Предки изделий с наибольшим расстоянием до изменившегося: в этом порядке
+# каждый узел пересчитывается после всех своих детей
+ANCESTORS_SQL = """
+    WITH RECURSIVE up(product_id, depth, path) AS (
+        SELECT id, 0, '/' || id || '/' FROM products WHERE id IN ({seeds})
+        UNION ALL
+        SELECT pp.parent_product_id, up.depth + 1, up.path || pp.parent_product_id || '/'
+        FROM up
+        JOIN product_products pp ON pp.child_product_id = up.product_id
+        WHERE instr(up.path, '/' || pp.parent_product_id || '/') = 0
+    )
+    SELECT product_id FROM up GROUP BY product_id ORDER BY MAX(depth), product_id"""
+
+# Себестоимость изделия: свои материалы + узлы по их текущей себестоимости
+ROLLUP_SQL = """
+    UPDATE products SET cost =
+        (SELECT COALESCE(SUM(m.price * pc.quantity * COALESCE(NULLIF(pc.length_mm, 0) / 1000.0, 1)), 0)
+         FROM product_composition pc
+         JOIN materials m ON pc.material_id = m.id
+         WHERE pc.product_id = products.id)
+      + (SELECT COALESCE(SUM(pp.quantity * child.cost), 0)
+         FROM product_products pp
+         JOIN products child ON child.id = pp.child_product_id
+         WHERE pp.parent_product_id = products.id)
+    WHERE id = ?"""
+
+
+def _marks(values):
+    return ", ".join("?" * len(values)) or "NULL"
+
+
+def would_create_cycle(cursor, parent_id, child_id):
+    """Замкнет ли узел child_id в изделии parent_id цикл (parent достижим из child)"""
+    if parent_id == child_id:
+        return True
+    cursor.execute(f"""WITH RECURSIVE {BOM_TREE_CTE.format(roots='?')}
+                       SELECT 1 FROM tree WHERE product_id = ? LIMIT 1""", (child_id, parent_id))
+    return cursor.fetchone() is not None
+
+
+def rollup_costs(cursor, product_ids):
+    """
+    Пересчитывает себестоимость изделий и всех их предков снизу вверх.
+
+    :return: id пересчитанных изделий в порядке пересчета
+    """
+    product_ids = list(product_ids)
+    if not product_ids:
+        return []
+    cursor.execute(ANCESTORS_SQL.format(seeds=_marks(product_ids)), product_ids)
+    order = [row[0] for row in cursor.fetchall()]
+    cursor.executemany(ROLLUP_SQL, [(product_id,) for product_id in order])
+    return order
+
+
+class BomResolver:
+    """
+    Развернутый до материалов состав изделий с запоминанием.
+
+    Состав каждого изделия разворачивается одним запросом на все недостающие
+    изделия и хранится до изменения любого узла его дерева.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._flat = {}  # {id изделия: (узлы дерева, [(материал, тип, количество, длина в мм), ...])}
+
+    def invalidate(self, product_id=None):
+        """Сбрасывает составы, в дерево которых входит product_id (None - все)"""
+        if product_id is None:
+            self._flat.clear()
+            return
+        for root in [root for root, (nodes, _) in self._flat.items() if product_id in nodes]:
+            del self._flat[root]
+
+    def flatten(self, product_ids):
+        """
+        Развернутый состав изделий.
+
+        Одна позиция состава, входящая в изделие несколькими путями, дает одну
+        строку с суммарным количеством.
+
+        :return: {id изделия: [(материал, тип, количество, длина в мм), ...]}
+        """
+        missing = sorted({product_id for product_id in product_ids if product_id not in self._flat})
+        if missing:
+            self._load(missing)
+        return {product_id: self._flat[product_id][1] for product_id in product_ids if product_id in self._flat}
+
+    def _load(self, roots):
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            WITH RECURSIVE {BOM_TREE_CTE.format(roots=_marks(roots))}
+            SELECT root, 'node', product_id, NULL, NULL, NULL, NULL FROM tree
+            UNION ALL
+            SELECT t.root, 'material', pc.id, m.name, m.type, SUM(t.multiplier * pc.quantity), pc.length_mm
+            FROM tree t
+            JOIN product_composition pc ON pc.product_id = t.product_id
+            JOIN materials m ON pc.material_id = m.id
+            GROUP BY t.root, pc.id
+            ORDER BY 1, 2 DESC, 3""", roots)
+        rows = cursor.fetchall()
+
+        # Ребра, замыкающие цикл: дерево по ним не разворачивается
+        cursor.execute(f"""
+            WITH RECURSIVE {BOM_TREE_CTE.format(roots=_marks(roots))}
+            SELECT DISTINCT t.product_id, pp.child_product_id
+            FROM tree t
+            JOIN product_products pp ON pp.parent_product_id = t.product_id
+            WHERE instr(t.path, '/' || pp.child_product_id || '/') > 0""", roots)
+        for parent_id, child_id in cursor.fetchall():
+            print(f"Цикл в составе изделий: изделие {parent_id} включает {child_id}, узел пропущен")
+        conn.close()
+
+        flat = {root: (set(), []) for root in roots}
+        for root, kind, row_id, name, mtype, quantity, length_mm in rows:
+            nodes, materials = flat[root]
+            if kind == 'node':
+                nodes.add(row_id)
+            else:
+                materials.append((name, mtype, quantity, length_mm))
+        self._flat.update(flat)
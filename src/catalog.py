@@ -0,0 +1,180 @@
+# catalog.py - справочники в памяти с уведомлениями об изменениях
+#
+# Материалы, изделия, этапы и их составы загружаются из SQLite один раз и
+# живут в памяти. Вкладки читают списки отсюда, а не из БД, и подписываются
+# на сигналы *_changed(ids): после записи в БД вкладка вызывает refresh_*
+# с id измененных строк, каталог перечитывает только их и сообщает всем
+# подписчикам, какие строки обновить.
+import sqlite3
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from cost_cache import CostCache
+
+
+class Catalog(QObject):
+    """
+    Снимок справочников.
+
+    :ivar materials: {id: (название, тип, цена, ед. изм.)}
+    :ivar products: {id: (название, себестоимость)}
+    :ivar stages: {id: (название, категория, себестоимость, длина по умолчанию в м)}
+    :ivar product_composition: {id изделия: [(id материала, количество, длина в мм), ...]}
+    :ivar product_children: {id изделия: [(id узла, количество), ...]}
+    :ivar stage_products: {id этапа: [(id изделия, количество, часть), ...]}
+    :ivar stage_materials: {id этапа: [(id материала, количество, длина в мм, часть), ...]}
+    :ivar version: Растет при каждой перезагрузке или обновлении строк
+    :ivar costs: Общий кэш себестоимостей, действительный до следующего изменения версии
+    """
+    # Списки id измененных строк (добавленных, измененных или удаленных)
+    materials_changed = pyqtSignal(list)
+    products_changed = pyqtSignal(list)
+    stages_changed = pyqtSignal(list)
+
+    def __init__(self, db_path, parent=None):
+        super().__init__(parent)
+        self.db_path = db_path
+        self.version = 0
+        self.costs = CostCache(lambda: self.version)
+        self.materials = {}
+        self.products = {}
+        self.stages = {}
+        self.product_composition = {}
+        self.product_children = {}
+        self.stage_products = {}
+        self.stage_materials = {}
+        self.load()
+
+    def load(self):
+        """Перечитывает все справочники и сообщает об изменении всех строк (и исчезнувших)"""
+        old_ids = (list(self.materials), list(self.products), list(self.stages))
+        self.materials.clear()
+        self.products.clear()
+        self.stages.clear()
+        self.product_composition.clear()
+        self.product_children.clear()
+        self.stage_products.clear()
+        self.stage_materials.clear()
+
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        self._read_materials(cursor, None)
+        self._read_products(cursor, None)
+        self._read_stages(cursor, None)
+        conn.close()
+        self.version += 1
+
+        for signal, rows, ids in zip((self.materials_changed, self.products_changed, self.stages_changed),
+                                     (self.materials, self.products, self.stages), old_ids):
+            signal.emit(list(dict.fromkeys(ids + list(rows))))
+
+    def refresh_materials(self, material_ids):
+        self._refresh(self._read_materials, self.materials, material_ids, self.materials_changed)
+
+    def refresh_products(self, product_ids):
+        self._refresh(self._read_products, self.products, product_ids, self.products_changed)
+
+    def refresh_stages(self, stage_ids):
+        self._refresh(self._read_stages, self.stages, stage_ids, self.stages_changed)
+
+    def _refresh(self, read, rows, ids, signal):
+        """Перечитывает строки ids (удаленные из БД пропадают и из каталога) и шлет сигнал"""
+        ids = list(dict.fromkeys(ids))
+        if not ids:
+            return
+        for row_id in ids:
+            rows.pop(row_id, None)
+        conn = sqlite3.connect(self.db_path)
+        read(conn.cursor(), ids)
+        conn.close()
+        self.version += 1
+        signal.emit(ids)
+
+    @staticmethod
+    def _where(column, ids):
+        """Условие отбора по ids и параметры; None - все строки"""
+        if ids is None:
+            return "", []
+        return f"WHERE {column} IN ({', '.join('?' * len(ids))})", list(ids)
+
+    def _read_materials(self, cursor, ids):
+        where, params = self._where("id", ids)
+        cursor.execute(f"SELECT id, name, type, price, unit FROM materials {where}", params)
+        for material_id, *row in cursor.fetchall():
+            self.materials[material_id] = tuple(row)
+
+    def _read_products(self, cursor, ids):
+        where, params = self._where("id", ids)
+        cursor.execute(f"SELECT id, name, cost FROM products {where}", params)
+        for product_id, *row in cursor.fetchall():
+            self.products[product_id] = tuple(row)
+
+        where, params = self._where("product_id", ids)
+        composition = {product_id: [] for product_id in (ids or self.products)}
+        cursor.execute(f"SELECT product_id, material_id, quantity, length_mm FROM product_composition {where}",
+                       params)
+        for product_id, *row in cursor.fetchall():
+            composition.setdefault(product_id, []).append(tuple(row))
+        self._replace(self.product_composition, composition, self.products)
+
+        where, params = self._where("parent_product_id", ids)
+        children = {product_id: [] for product_id in (ids or self.products)}
+        cursor.execute(f"SELECT parent_product_id, child_product_id, quantity FROM product_products {where}", params)
+        for product_id, *row in cursor.fetchall():
+            children.setdefault(product_id, []).append(tuple(row))
+        self._replace(self.product_children, children, self.products)
+
+    def _read_stages(self, cursor, ids):
+        where, params = self._where("id", ids)
+        cursor.execute(f"SELECT id, name, category, cost, default_length_m FROM stages {where}", params)
+        for stage_id, name, category, cost, default_length in cursor.fetchall():
+            self.stages[stage_id] = (name, category or "Статика", cost, default_length)
+
+        where, params = self._where("stage_id", ids)
+        products = {stage_id: [] for stage_id in (ids or self.stages)}
+        cursor.execute(f"SELECT stage_id, product_id, quantity, part FROM stage_products {where}", params)
+        for stage_id, *row in cursor.fetchall():
+            products.setdefault(stage_id, []).append(tuple(row))
+        self._replace(self.stage_products, products, self.stages)
+
+        materials = {stage_id: [] for stage_id in (ids or self.stages)}
+        cursor.execute(f"SELECT stage_id, material_id, quantity, length_mm, part FROM stage_materials {where}",
+                       params)
+        for stage_id, *row in cursor.fetchall():
+            materials.setdefault(stage_id, []).append(tuple(row))
+        self._replace(self.stage_materials, materials, self.stages)
+
+    @staticmethod
+    def _replace(target, fresh, owners):
+        """Подменяет составы прочитанных владельцев; составы удаленных владельцев убираются"""
+        for owner_id, rows in fresh.items():
+            if owner_id in owners:
+                target[owner_id] = rows
+            else:
+                target.pop(owner_id, None)
+
+    # Списки для выпадающих списков - по названию, как ORDER BY name
+    def material_list(self):
+        """[(id, название, тип), ...]"""
+        return sorted(((material_id, name, mtype) for material_id, (name, mtype, _, _) in self.materials.items()),
+                      key=lambda row: row[1])
+
+    def product_list(self):
+        """[(id, название), ...]"""
+        return sorted(((product_id, name) for product_id, (name, _) in self.products.items()),
+                      key=lambda row: row[1])
+
+    def stage_list(self):
+        """[(id, название), ...]"""
+        return sorted(((stage_id, row[0]) for stage_id, row in self.stages.items()), key=lambda row: row[1])
+
+    # Данные для RopeService
+    def stage_categories(self, stage_ids):
+        """{id этапа: категория} для известных этапов"""
+        return {stage_id: self.stages[stage_id][1] for stage_id in stage_ids if stage_id in self.stages}
+
+    def materials_by_name(self, names):
+        """{название: (id, цена)} для найденных материалов"""
+        names = set(names)
+        return {name: (material_id, price)
+                for material_id, (name, _, price, _) in self.materials.items() if name in names}
@@ -0,0 +1,90 @@
+# cost_cache.py - кэш себестоимостей с версией каталога
+#
+# Значение запоминается вместе с версией каталога, при которой посчитано.
+# Каталог увеличивает версию при каждой записи в материалы, изделия, этапы и
+# их составы, поэтому после любой правки все старые значения становятся
+# промахами без ручного удаления. Размер ограничен: давно не читанные записи
+# вытесняются (LRU).
+from collections import OrderedDict
+
+DEFAULT_MAXSIZE = 4096
+
+
+class CostCache:
+    """
+    LRU-кэш себестоимостей по ключу (вид, id, ...).
+
+    :param version: Функция текущей версии каталога (по умолчанию версия не меняется)
+    :param maxsize: Наибольшее число записей
+    """
+
+    def __init__(self, version=None, maxsize=DEFAULT_MAXSIZE):
+        self._version = version if version is not None else (lambda: 0)
+        self.maxsize = maxsize
+        self._entries = OrderedDict()  # {ключ: (версия, значение)}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, compute):
+        """Значение по ключу; при промахе или смене версии считается compute()"""
+        version = self._version()
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == version:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        value = compute()
+        self._store(key, version, value)
+        return value
+
+    def put(self, key, value):
+        """Запоминает готовое значение при текущей версии"""
+        self._store(key, self._version(), value)
+
+    def _store(self, key, version, value):
+        self._entries[key] = (version, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key=None):
+        """Сбрасывает одну запись (None - все)"""
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self._entries),
+            'hit_rate': self.hits / total if total else 0.0
+        }
+
+
+if __name__ == "__main__":
+    # Повторные расчеты заказа между правками справочников
+    import random
+    import time
+
+    random.seed(3)
+    catalog_version = [0]
+    cache = CostCache(lambda: catalog_version[0], maxsize=500)
+
+    def compute():
+        time.sleep(0.0001)  # чтение себестоимости из БД
+        return random.uniform(100, 5000)
+
+    started = time.perf_counter()
+    for step in range(20000):
+        if step % 2000 == 0:
+            catalog_version[0] += 1  # правка материала или изделия
+        cache.get(('product', random.randint(1, 600)), compute)
+    print(f"20000 запросов: {(time.perf_counter() - started) * 1000:.0f} мс, {cache.stats()}")
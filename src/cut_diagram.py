@@ -0,0 +1,107 @@
+# cut_diagram.py - схемы распила досок для PDF-отчета
+#
+# Схема - полоса в масштабе длины доски: отпиленные куски по порядку,
+# затем остаток (серый - полезный, красный - меньше MIN_LENGTH_MM). Рисунок
+# зависит только от длин, поэтому одинаковые схемы в заказе рисуются один
+# раз: Drawing кэшируется по длинам, а в PDF схема выводится как Form XObject
+# - в файл попадает один экземпляр, остальные доски ссылаются на него.
+import hashlib
+
+from reportlab.graphics import renderPDF
+from reportlab.graphics.shapes import Drawing, Rect, String
+from reportlab.lib import colors
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.platypus import Flowable
+
+from cutting_optimizer import CuttingOptimizer
+
+DIAGRAM_HEIGHT = 16
+LABEL_SIZE = 7
+CUT_COLORS = (colors.HexColor("#f3d9a4"), colors.HexColor("#e0b872"))
+REMAINDER_COLOR = colors.HexColor("#dddddd")
+WASTE_COLOR = colors.HexColor("#f2b8b5")
+
+
+def pattern_key(original_length, cut_lengths, remainder):
+    """Ключ схемы: длина доски, длины кусков по порядку и остаток (мм)"""
+    return original_length, tuple(cut_lengths), remainder
+
+
+def pattern_drawing(key, width, font_name="Helvetica"):
+    """
+    Схема распила шириной width пунктов.
+
+    Подпись куска - длина в метрах; если она не помещается - номер куска
+    (как в списке распила), если не помещается и он - без подписи.
+    """
+    original_length, cut_lengths, remainder = key
+    drawing = Drawing(width, DIAGRAM_HEIGHT)
+    scale = width / original_length if original_length else 0
+
+    x = 0
+    segments = [(length, CUT_COLORS[i % 2], i + 1) for i, length in enumerate(cut_lengths)]
+    if remainder > 0:
+        color = REMAINDER_COLOR if remainder >= CuttingOptimizer.MIN_LENGTH_MM else WASTE_COLOR
+        segments.append((remainder, color, None))
+
+    for length, color, number in segments:
+        segment_width = length * scale
+        drawing.add(Rect(x, 0, segment_width, DIAGRAM_HEIGHT, fillColor=color,
+                         strokeColor=colors.black, strokeWidth=0.5))
+        for label in (CuttingOptimizer.format_m(length), str(number) if number else None):
+            if label and stringWidth(label, font_name, LABEL_SIZE) + 2 <= segment_width:
+                drawing.add(String(x + segment_width / 2, (DIAGRAM_HEIGHT - LABEL_SIZE) / 2 + 1, label,
+                                   fontName=font_name, fontSize=LABEL_SIZE, textAnchor='middle'))
+                break
+        x += segment_width
+    return drawing
+
+
+class DiagramCache:
+    """
+    Схемы распила одного отчета: Drawing строится один раз на схему.
+
+    :param width: Ширина схем в пунктах
+    :param font_name: Шрифт подписей
+    """
+
+    def __init__(self, width, font_name="Helvetica"):
+        self.width = width
+        self.font_name = font_name
+        self._drawings = {}
+        self.hits = 0
+        self.misses = 0
+
+    def flowable(self, original_length, cut_lengths, remainder):
+        """Элемент PDF со схемой доски"""
+        key = pattern_key(original_length, cut_lengths, remainder)
+        drawing = self._drawings.get(key)
+        if drawing is None:
+            self.misses += 1
+            drawing = self._drawings[key] = pattern_drawing(key, self.width, self.font_name)
+        else:
+            self.hits += 1
+        return PatternFlowable(key, drawing)
+
+
+class PatternFlowable(Flowable):
+    """Схема в PDF: при первом выводе рисуется в Form XObject, дальше - ссылка на него"""
+
+    def __init__(self, key, drawing):
+        super().__init__()
+        self.drawing = drawing
+        self.width = drawing.width
+        self.height = drawing.height
+        digest = hashlib.sha1(repr((key, self.width)).encode('ascii')).hexdigest()[:16]
+        self.form_name = f"cut{digest}"
+
+    def wrap(self, available_width, available_height):
+        return self.width, self.height
+
+    def draw(self):
+        canvas = self.canv
+        if not canvas.hasForm(self.form_name):
+            canvas.beginForm(self.form_name, 0, 0, self.width, self.height)
+            renderPDF.draw(self.drawing, canvas, 0, 0)
+            canvas.endForm()
+        canvas.doForm(self.form_name)
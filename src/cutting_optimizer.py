@@ -1,39 +1,68 @@
 # cutting_optimizer.py
 import json
+import math
 import sqlite3
-from collections import defaultdict
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+
+from domain import BatchProduct, Board, Cut, Plan, PurchaseBoard, Requirement, StockLot
+
+try:
+    import numpy as np
+except ImportError:  # NumPy не обязателен: без него недоступен только векторный движок
+    np = None
 
 class CuttingOptimizer:
-    MIN_LENGTH = 0.3  # Минимальный полезный остаток
+    # Все длины пиломатериалов - целые миллиметры (как в БД: столбцы length_mm)
+    MIN_LENGTH_MM = 300  # Минимальный полезный остаток
+
+    # Стратегии раскроя пиломатериалов
+    STRATEGY_GREEDY = 'greedy'  # по одному куску в доску с минимальным остатком
+    STRATEGY_EXACT = 'exact'  # лучшая комбинация кусков на каждую доску (DP)
+    STRATEGY_VECTOR = 'vector'  # жадный, но на массивах NumPy (большие склады)
+    STRATEGIES = {
+        STRATEGY_GREEDY: "Быстрый (жадный)",
+        STRATEGY_EXACT: "Точный (минимум отходов)",
+    }
+    if np is not None:
+        STRATEGIES[STRATEGY_VECTOR] = "Векторный (большие склады)"
 
     @staticmethod
-    def optimize_cutting(requirements, stock_items, db_path):
+    def optimize_cutting(requirements, stock_items, db_path, previous_result=None, purchase_options=None,
+                         strategy=STRATEGY_GREEDY):
         """
         Оптимизирует раскрой материалов для заданных требований.
 
-        :param requirements: Список требований по материалам
-        :param stock_items: Доступные материалы на складе
+        :param requirements: Список требований по материалам: (длина в мм, изделие)
+            для пиломатериалов, (количество, изделие) для метизов
+        :param stock_items: Доступные материалы на складе: (материал, длина в мм, количество)
         :param db_path: Путь к базе данных
+        :param previous_result: Результат предыдущего расчета (тёплый старт).
+            Если передан, пиломатериалы, у которых не изменился склад, не
+            пересчитываются с нуля: из прежнего плана убираются изменившиеся
+            куски, а освободившееся место заполняется новыми.
+        :param purchase_options: Стандартные длины для закупки
+            {материал: [(длина в мм, цена за доску), ...]}. Если переданы, для кусков,
+            не поместившихся в склад, подбирается самый дешевый набор новых досок.
+        :param strategy: Стратегия раскроя пиломатериалов (см. STRATEGIES)
         :return: Результат проверки и оптимизации
         """
         print(f"[DEBUG] Требования: {dict(requirements)}")
         print(f"[DEBUG] Склад: {stock_items}")
 
-        # Создаем копию склада для работы
+        # Раскладываем склад по материалам
+        stock_items = [StockLot._make(item) for item in stock_items]
         warehouse = defaultdict(list)
         for item in stock_items:
-            material_name = item[0]
             # Пропускаем материалы с нулевым количеством
-            if item[2] <= 0:
+            if item.quantity <= 0:
                 continue
-            warehouse[material_name].append({
-                'length': item[1],
-                'quantity': item[2],
-                'original_length': item[1]
-            })
+            warehouse[item.material].append(item)
 
         # Словари для результатов
         cutting_instructions = defaultdict(list)
+        cutting_plan = {}
+        previous_plan = (previous_result or {}).get('plan') or {}
         updated_warehouse = []
         missing_materials = []
         can_produce = True
@@ -46,13 +75,17 @@ class CuttingOptimizer:
             # Если материала нет на складе или его количество равно 0
             if material not in warehouse or not warehouse[material]:
                 # Получаем общее количество этого материала на складе (включая нулевые)
-                total_available = sum(item[2] for item in stock_items if item[0] == material)
+                total_available = sum(item.quantity for item in stock_items if item.material == material)
 
                 # Рассчитываем общее требуемое количество
                 total_required = sum(req[0] for req in requirements[material])
 
                 if total_available < total_required:
-                    missing_materials.append(f"{material}: требуется {total_required}, доступно {total_available}")
+                    if material_types.get(material) == "Метиз":
+                        required_text = f"{total_required}"
+                    else:
+                        required_text = f"{CuttingOptimizer.format_m(total_required)}м"
+                    missing_materials.append(f"{material}: требуется {required_text}, доступно {total_available}")
                     can_produce = False
                 # Если материал есть, но количество равно 0
                 elif total_available == 0:
@@ -78,35 +111,348 @@ class CuttingOptimizer:
                 updated_warehouse.extend(result['updated'])
             else:
                 # Обработка пиломатериалов
-                result = CuttingOptimizer._process_lumber(
-                    material, req_list, warehouse[material])
-                print(f"[DEBUG] Результат обработки пиломатериала {material}: {result}")
+                previous = previous_plan.get(material)
+                if (previous and previous.strategy == strategy
+                        and previous.stock == CuttingOptimizer._stock_snapshot(warehouse[material])):
+                    result = CuttingOptimizer._repair_lumber(
+                        material, req_list, warehouse[material], previous)
+                else:
+                    result = CuttingOptimizer._process_lumber(
+                        material, req_list, warehouse[material], strategy)
+                print(f"[DEBUG] Результат обработки пиломатериала {material}: "
+                      f"досок в работе {len(result['instructions'])}, недостача {result['missing']}")
 
                 if not result['success']:
                     can_produce = False
                     missing_materials.extend(result['missing'])
                 cutting_instructions[material] = result['instructions']
+                cutting_plan[material] = result['plan']
                 updated_warehouse.extend(result['updated'])
 
+        # Подбор закупки под то, что не поместилось в складские остатки
+        purchase = []
+        purchase_plan = {}
+        for material, options in (purchase_options or {}).items():
+            if material not in requirements or material_types.get(material) == "Метиз":
+                continue
+            if material in cutting_plan:
+                pieces = cutting_plan[material].unplaced
+            else:
+                # Материала нет на складе - закупается всё
+                pieces = [req for req in requirements[material] if req[0] > 0]
+            if not pieces:
+                continue
+            purchase_plan[material] = CuttingOptimizer._plan_purchase(material, pieces, options)
+            purchase.extend(purchase_plan[material]['purchase'])
+
         # Добавляем материалы, не участвовавшие в заказе
         processed_materials = set(requirements.keys())
-        for mat, length, qty in stock_items:
-            if mat not in processed_materials and qty > 0:
-                updated_warehouse.append([mat, length, qty])
-
-        # Округление всех длин до 2 знаков
-        updated_warehouse = [[mat, round(len_val, 2), qty] for mat, len_val, qty in updated_warehouse]
+        for item in stock_items:
+            if item.material not in processed_materials and item.quantity > 0:
+                updated_warehouse.append(item)
 
         # Сортировка по названию материала и длине (от большего к меньшему)
-        updated_warehouse.sort(key=lambda x: (x[0], -x[1]))
+        updated_warehouse.sort(key=lambda x: (x.material, -x.length))
 
         return {
             'can_produce': can_produce,
             'missing': missing_materials,
             'updated_warehouse': updated_warehouse,
-            'cutting_instructions': dict(cutting_instructions)
+            'cutting_instructions': dict(cutting_instructions),
+            'plan': cutting_plan,
+            'purchase': purchase,
+            'purchase_plan': purchase_plan
         }
 
+    @staticmethod
+    def optimize_batch(orders, stock_items, db_path, strategy=STRATEGY_GREEDY):
+        """
+        Совместный раскрой нескольких заказов (производственный пакет).
+
+        Требования всех заказов объединяются и раскладываются по складу за один
+        проход, поэтому остатки от кусков одного заказа идут на куски другого.
+        Каждый кусок помечается заказом, из которого он пришел.
+
+        :param orders: Словарь {заказ: требования}, требования в формате optimize_cutting
+        :param stock_items: Доступные материалы на складе
+        :param db_path: Путь к базе данных
+        :param strategy: Стратегия раскроя пиломатериалов (см. STRATEGIES)
+        :return: Результат optimize_cutting плюс 'by_order' -
+            {заказ: {материал: [{'length', 'product', 'board'} или {'quantity', 'product'}, ...]}},
+            'board' - номер доски в инструкциях по материалу (с 1)
+        """
+        combined = defaultdict(list)
+        for order, requirements in orders.items():
+            for material, req_list in requirements.items():
+                for value, product in req_list:
+                    combined[material].append(Requirement(value, BatchProduct(order, product)))
+
+        result = CuttingOptimizer.optimize_cutting(combined, stock_items, db_path, strategy=strategy)
+
+        # Разносим раскрой обратно по заказам
+        by_order = {order: defaultdict(list) for order in orders}
+        for material, plan in result['plan'].items():
+            # Нумерация как в инструкциях: только распиленные доски
+            for board_number, board in enumerate((board for board in plan.boards if board.cuts), 1):
+                for cut in board.cuts:
+                    by_order[cut.product.order][material].append({
+                        'length': cut.length,
+                        'product': cut.product.product,
+                        'board': board_number
+                    })
+        for material, req_list in combined.items():
+            if material in result['plan']:
+                continue
+            for value, product in req_list:
+                by_order[product.order][material].append({
+                    'quantity': value,
+                    'product': product.product
+                })
+
+        result['by_order'] = {order: dict(materials) for order, materials in by_order.items()}
+        return result
+
+    @staticmethod
+    def _board_instruction(board):
+        """Текст инструкции распила одной доски"""
+        format_m = CuttingOptimizer.format_m
+        instruction = f"Взять отрезок {format_m(board.original_length)}м:\n"
+        for i, cut in enumerate(board.cuts, 1):
+            instruction += f"  {i}. Отпилить {format_m(cut.length)}м для '{cut.product}'\n"
+
+        if board.current_length >= CuttingOptimizer.MIN_LENGTH_MM:
+            instruction += f"  Остаток: {format_m(board.current_length)}м\n"
+        else:
+            instruction += f"  Остаток: {format_m(board.current_length)}м (не используется)\n"
+        return instruction
+
+    @staticmethod
+    def _missing_messages(material, unplaced):
+        """Сообщения о недостающей длине по не размещенным кускам"""
+        # Собираем общую недостающую длину по изделиям
+        missing_dict = defaultdict(int)
+        for req_length, product in unplaced:
+            missing_dict[product] += req_length
+
+        # Формируем сообщения о недостающих материалах с общей длиной
+        missing = []
+        if missing_dict:
+            total_missing = sum(missing_dict.values())
+            products_list = ", ".join([f"'{prod}'" for prod in missing_dict.keys()])
+            missing.append(f"{material}: не хватает {CuttingOptimizer.format_m(total_missing)}м "
+                           f"для изделий {products_list}")
+        return missing
+
+    @staticmethod
+    def _process_lumber_vector(material, requirements, stock):
+        """
+        Векторный вариант _process_lumber: укладка идет на массивах NumPy
+        (_pack_vector), объекты Board создаются уже после нее и только для
+        распиленных досок (_vector_boards), нераспиленные попадают в план
+        сводкой spare. Массивы освобождаются до _build_lumber_result, который
+        собирает инструкции, остатки и план так же, как у жадного раскроя.
+        """
+        requirements = [req for req in requirements if req[0] > 0]
+        requirements.sort(key=lambda x: x[0], reverse=True)
+
+        # Доски в том же порядке, что и в _process_lumber: по убыванию длины
+        stock_mm = np.array([item.length for item in stock], dtype=np.int32)
+        stock_qty = np.array([item.quantity for item in stock], dtype=np.int64)
+        original = np.repeat(stock_mm, stock_qty)
+        original = original[np.argsort(-original, kind='stable')]
+        piece_board, remaining = CuttingOptimizer._pack_vector(original, requirements)
+        boards, unplaced, spare = CuttingOptimizer._vector_boards(original, remaining, piece_board, requirements)
+        return CuttingOptimizer._build_lumber_result(material, requirements, stock, boards, unplaced,
+                                                     CuttingOptimizer.STRATEGY_VECTOR, spare)
+
+    @staticmethod
+    def _vector_boards(original, remaining, piece_board, requirements):
+        """
+        Доски плана по результату _pack_vector: Board только для распиленных
+        досок, нераспиленные - сводкой.
+
+        :return: (boards, unplaced, spare)
+        """
+        # Номера кусков по доскам в порядке размещения: сначала не поместившиеся (-1)
+        order = np.argsort(piece_board, kind='stable')
+        first_placed = int(np.searchsorted(piece_board[order], 0))
+        unplaced = [requirements[i] for i in order[:first_placed].tolist()]
+        order = order[first_placed:]
+        placed_boards = piece_board[order]
+        bounds = np.r_[0, np.flatnonzero(np.diff(placed_boards)) + 1, order.size].tolist()
+
+        boards = []
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            if start == end:
+                continue
+            board_index = placed_boards[start]
+            boards.append(Board(int(original[board_index]), int(remaining[board_index]),
+                                [Cut._make(requirements[i]) for i in order[start:end].tolist()]))
+
+        uncut = np.ones(len(original), dtype=bool)
+        uncut[placed_boards] = False
+        values, counts = np.unique(original[uncut], return_counts=True)
+        spare = [(int(value), int(count)) for value, count in zip(values[::-1], counts[::-1])]
+        return boards, unplaced, spare
+
+    @staticmethod
+    def _pack_vector(original, requirements):
+        """
+        Жадная укладка на массивах: правило то же, что у _pack_pieces (кусок в
+        подходящую доску с минимальным остатком), но куски одинаковой длины
+        раскладываются разом - заполняют самую "тесную" подходящую доску, пока в
+        нее помещается еще один, затем следующую. На каждую различную длину
+        хватает одной сортировки кандидатов и накопленной суммы вместимостей.
+
+        :param original: Длины досок (мм), по убыванию
+        :param requirements: Куски по убыванию длины
+        :return: (номер доски каждого куска или -1, остатки досок)
+        """
+        remaining = original.copy()
+        piece_mm = np.array([length for length, _ in requirements], dtype=np.int32)
+        piece_board = np.full(len(requirements), -1, dtype=np.int32)
+
+        # Серии одинаковых длин (куски уже отсортированы по убыванию)
+        run_starts = np.flatnonzero(np.r_[True, piece_mm[1:] != piece_mm[:-1]]) if len(piece_mm) else []
+        run_ends = np.r_[run_starts[1:], len(piece_mm)] if len(piece_mm) else []
+        for start, end in zip(run_starts, run_ends):
+            length_mm = int(piece_mm[start])
+            count = int(end - start)
+
+            candidates = np.flatnonzero(remaining >= length_mm)
+            if not candidates.size:
+                continue
+            # Самые "тесные" доски первыми, при равенстве - меньший индекс
+            candidates = candidates[np.argsort(remaining[candidates], kind='stable')]
+            capacity = remaining[candidates] // length_mm
+            filled = np.cumsum(capacity)
+
+            used = min(int(np.searchsorted(filled, count)) + 1, len(candidates))
+            take = capacity[:used].copy()
+            take[-1] -= max(0, int(filled[used - 1]) - count)
+
+            placed = int(take.sum())
+            piece_board[start:start + placed] = np.repeat(candidates[:used], take)
+            remaining[candidates[:used]] -= (take * length_mm).astype(np.int32)
+        return piece_board, remaining
+
+    @staticmethod
+    def _plan_purchase(material, pieces, options):
+        """
+        Подбирает самый дешевый набор новых досок стандартной длины для кусков,
+        которые не поместились в складские остатки.
+
+        Жадная схема для раскроя с заготовками разной длины: на каждом шаге для
+        каждой стандартной длины собирается укладка (по убыванию длины кусков),
+        и берется вариант с наименьшей ценой за метр полезной длины. После этого
+        каждая доска заменяется самой дешевой длиной, в которую помещается её
+        раскрой. Работа идет по группам одинаковых кусков, поэтому время
+        зависит от числа разных длин, а не от числа кусков.
+
+        :param pieces: Куски (длина в мм, изделие)
+        :param options: Стандартные длины [(длина в мм, цена за доску), ...]
+        :return: {'purchase': [[материал, длина, кол-во, стоимость], ...],
+                  'boards': [PurchaseBoard, ...], 'instructions': [...], 'unsolvable': [Requirement, ...]}
+        """
+        options = sorted({(length, price) for length, price in options if length > 0})
+        max_option = options[-1][0] if options else 0
+
+        # Куски группируем по длине: {мм: [изделие, ...]}
+        groups = defaultdict(list)
+        unsolvable = []
+        for length_mm, product in pieces:
+            if length_mm > max_option:
+                # Кусок длиннее любой стандартной доски - закупкой не решить
+                unsolvable.append(Requirement(length_mm, product))
+            else:
+                groups[length_mm].append(product)
+
+        lengths_desc = sorted(groups, reverse=True)
+        counts = {length_mm: len(products) for length_mm, products in groups.items()}
+        left = sum(counts.values())
+
+        patterns = []
+        while left:
+            best = None
+            for option_mm, price in options:
+                remaining = option_mm
+                take = []
+                for length_mm in lengths_desc:
+                    count = counts[length_mm]
+                    if count and length_mm <= remaining:
+                        k = min(count, remaining // length_mm)
+                        take.append((length_mm, k))
+                        remaining -= k * length_mm
+                used = option_mm - remaining
+                if not used:
+                    continue
+                key = (price / used, remaining)
+                if best is None or key < best[0]:
+                    best = (key, used, take)
+
+            _, used, take = best
+            for length_mm, k in take:
+                counts[length_mm] -= k
+                left -= k
+            patterns.append((used, take))
+
+        boards = []
+        totals = Counter()
+        for used, take in patterns:
+            # Самая дешевая стандартная длина, в которую помещается раскрой
+            option_mm, price = min((opt for opt in options if opt[0] >= used),
+                                   key=lambda opt: (opt[1], opt[0]))
+            cuts = []
+            for length_mm, k in take:
+                for _ in range(k):
+                    cuts.append(Cut(length_mm, groups[length_mm].pop()))
+            boards.append(PurchaseBoard(option_mm, option_mm - used, cuts, price))
+            totals[(option_mm, price)] += 1
+
+        format_m = CuttingOptimizer.format_m
+        instructions = []
+        for board in boards:
+            instruction = f"Купить новый отрезок {format_m(board.original_length)}м ({board.price:.2f} руб):\n"
+            for i, cut in enumerate(board.cuts, 1):
+                instruction += f"  {i}. Отпилить {format_m(cut.length)}м для '{cut.product}'\n"
+            instruction += f"  Остаток: {format_m(board.current_length)}м\n"
+            instructions.append(instruction)
+
+        purchase = [[material, option_mm, qty, round(price * qty, 2)]
+                    for (option_mm, price), qty in sorted(totals.items())]
+
+        return {
+            'purchase': purchase,
+            'boards': boards,
+            'instructions': instructions,
+            'unsolvable': unsolvable
+        }
+
+    @staticmethod
+    def to_mm(length_m):
+        """Длина в метрах (ввод пользователя) -> целые миллиметры"""
+        return int(round(float(length_m) * 1000))
+
+    @staticmethod
+    def format_m(length_mm):
+        """Длина в миллиметрах -> текст в метрах для инструкций и таблиц"""
+        return f"{length_mm / 1000:.2f}"
+
+    @staticmethod
+    def get_purchase_options(db_path):
+        """Стандартные длины для закупки из БД: {материал: [(длина в мм, цена), ...]}"""
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+        cursor.execute("""SELECT m.name, s.length_mm, s.price
+                          FROM standard_lengths s
+                          JOIN materials m ON s.material_id = m.id
+                          ORDER BY m.name, s.length_mm""")
+        options = defaultdict(list)
+        for name, length, price in cursor.fetchall():
+            options[name].append((length, price))
+        conn.close()
+        return dict(options)
+
     @staticmethod
     def _get_material_types(db_path):
         """Возвращает типы материалов из БД"""
@@ -120,108 +466,222 @@ class CuttingOptimizer:
         return material_types
 
     @staticmethod
-    def _process_lumber(material, requirements, stock):
-        """Обработка пиломатериалов с оптимизацией раскроя и повторным использованием остатков"""
-        # Фильтруем требования: теперь храним (длина, изделие)
-        requirements = [req for req in requirements if req[0] > 0]
+    def _stock_snapshot(stock):
+        """Снимок склада по материалу для проверки применимости тёплого старта"""
+        return sorted((item.length, item.quantity) for item in stock)
 
-        if not requirements:
-            return {
-                'success': True,
-                'instructions': [],
-                'updated': [],
-                'missing': []
-            }
+    @staticmethod
+    def _process_lumber(material, requirements, stock, strategy=STRATEGY_GREEDY):
+        """Обработка пиломатериалов с оптимизацией раскроя и повторным использованием остатков"""
+        if strategy == CuttingOptimizer.STRATEGY_VECTOR and np is not None:
+            return CuttingOptimizer._process_lumber_vector(material, requirements, stock)
 
-        # Сортируем требования по убыванию длины
-        requirements.sort(key=lambda x: x[0], reverse=True)
-        instructions = []
-        updated = []
-        missing_dict = defaultdict(float)  # Для сбора общей недостающей длины по изделиям
+        # Фильтруем требования: (длина, изделие)
+        requirements = [req for req in requirements if req[0] > 0]
 
         # Создаем список доступных досок
         boards = []
         for item in stock:
-            for _ in range(item['quantity']):
-                boards.append({
-                    'original_length': item['length'],
-                    'current_length': item['length'],
-                    'cuts': []  # История распилов для этой доски
-                })
+            for _ in range(item.quantity):
+                boards.append(Board(item.length))
 
         # Сортируем доски по убыванию длины (для минимизации отходов)
-        boards.sort(key=lambda x: x['current_length'], reverse=True)
+        boards.sort(key=lambda x: x.current_length, reverse=True)
 
-        # Обрабатываем каждое требование
-        for req_length, product in requirements:
-            board_found = False
+        unplaced = CuttingOptimizer._packer(strategy)(boards, requirements)
+        return CuttingOptimizer._build_lumber_result(material, requirements, stock, boards, unplaced, strategy)
+
+    @staticmethod
+    def _repair_lumber(material, requirements, stock, previous):
+        """
+        Тёплый старт для пиломатериала: правит прежний план вместо полного пересчета.
+
+        Куски, которых больше нет в требованиях, снимаются с досок (место
+        возвращается доске), после чего новые куски и ранее не поместившиеся
+        раскладываются по освободившемуся месту той же стратегией, что и прежний план.
+        Доски, которых изменение не коснулось, остаются как были.
+        """
+        requirements = [req for req in requirements if req[0] > 0]
+
+        old_counts = Counter(previous.requirements)
+        new_counts = Counter(requirements)
+        removed = old_counts - new_counts
+        added = new_counts - old_counts
+
+        boards = [board.copy() for board in previous.boards]
+        # Нераспиленные доски векторного движка хранятся сводкой
+        for length, quantity in previous.spare:
+            boards.extend(Board(length) for _ in range(quantity))
+
+        if removed:
+            for board in boards:
+                kept = []
+                for cut in board.cuts:
+                    # Cut и Requirement - кортежи (длина, изделие), поэтому ключи совпадают
+                    if removed[cut] > 0:
+                        removed[cut] -= 1
+                        board.current_length += cut.length
+                    else:
+                        kept.append(cut)
+                board.cuts = kept
+
+        # Оставшиеся "снятые" куски были среди не поместившихся
+        pending = []
+        for piece in previous.unplaced:
+            if removed[piece] > 0:
+                removed[piece] -= 1
+            else:
+                pending.append(piece)
+        pending.extend(added.elements())
+        pending.sort(key=lambda x: x[0], reverse=True)
+
+        strategy = previous.strategy
+        unplaced = CuttingOptimizer._packer(strategy)(boards, pending)
+        return CuttingOptimizer._build_lumber_result(material, requirements, stock, boards, unplaced, strategy)
+
+    @staticmethod
+    def _packer(strategy):
+        """Функция укладки кусков по доскам для выбранной стратегии"""
+        if strategy == CuttingOptimizer.STRATEGY_EXACT:
+            return CuttingOptimizer._pack_exact
+        # Векторный движок использует то же правило, что и жадный
+        return CuttingOptimizer._pack_pieces
+
+    @staticmethod
+    def _pack_pieces(boards, pieces):
+        """
+        Раскладывает куски по доскам (лучшее совпадение по остатку).
 
-            # Ищем доску с минимальным подходящим остатком
-            best_index = -1
-            best_remaining = float('inf')
+        :return: Список кусков, для которых не нашлось доски
+        """
+        # Сортируем требования по убыванию длины
+        pieces = sorted(pieces, key=lambda x: x[0], reverse=True)
+        unplaced = []
 
-            for i, board in enumerate(boards):
-                if board['current_length'] >= req_length:
-                    remaining = board['current_length'] - req_length
-                    if remaining < best_remaining:
-                        best_remaining = remaining
-                        best_index = i
+        # Отсортированный список (остаток, индекс доски): поиск доски с минимальным
+        # подходящим остатком - бинарный, а не перебор всех досок
+        free = sorted((board.current_length, i) for i, board in enumerate(boards))
 
-            if best_index != -1:
+        # Обрабатываем каждое требование
+        for req_length, product in pieces:
+            pos = bisect_left(free, (req_length, -1))
+
+            if pos < len(free):
+                _, best_index = free.pop(pos)
                 board = boards[best_index]
-                board['current_length'] = round(board['current_length'] - req_length, 2)
-                board['cuts'].append({
-                    'length': req_length,
-                    'product': product
-                })
-                board_found = True
+                board.cut(req_length, product)
+                insort(free, (board.current_length, best_index))
+            else:
+                unplaced.append(Requirement(req_length, product))
 
-            if not board_found:
-                # Собираем общую недостающую длину по изделиям
-                missing_dict[product] += req_length
+        return unplaced
+
+    @staticmethod
+    def _pack_exact(boards, pieces):
+        """
+        Точная укладка: каждая доска по очереди заполняется лучшей комбинацией кусков.
+
+        Для доски решается ограниченная задача о сумме подмножеств (длины в
+        целых миллиметрах): битовая маска достижимых сумм (бит i - сумма i мм) строится
+        сдвигами по различным длинам кусков, количества раскладываются по
+        степеням двойки. Берется максимальная достижимая сумма не больше
+        остатка доски, набор кусков восстанавливается по сохраненным маскам.
+        Любая сумма кратна НОД длин кусков, поэтому маска строится в этих
+        единицах: для бухты троса в сотни метров это в разы меньше бит.
+
+        :return: Список кусков, для которых не нашлось доски
+        """
+        groups = defaultdict(list)
+        for length, product in pieces:
+            groups[length].append(Requirement(length, product))
+        unit = math.gcd(*groups) if groups else 1
 
-        # Формируем инструкции и остатки
         for board in boards:
-            if board['cuts']:
-                instruction = f"Взять отрезок {board['original_length']:.2f}м:\n"
-                for i, cut in enumerate(board['cuts'], 1):
-                    instruction += f"  {i}. Отпилить {cut['length']:.2f}м для '{cut['product']}'\n"
+            if not groups:
+                break
+            capacity = board.current_length // unit
+
+            # Предметы DP: (длина, сколько штук), количества разбиты на 1, 2, 4, ...
+            items = []
+            for length_mm, group in groups.items():
+                if length_mm > board.current_length:
+                    continue
+                count = min(len(group), capacity // (length_mm // unit))
+                chunk = 1
+                while count > 0:
+                    take = min(chunk, count)
+                    items.append((length_mm, take))
+                    count -= take
+                    chunk <<= 1
+            if not items:
+                continue
 
-                if board['current_length'] >= CuttingOptimizer.MIN_LENGTH:
-                    instruction += f"  Остаток: {round(board['current_length'], 2):.2f}м\n"
-                else:
-                    instruction += f"  Остаток: {round(board['current_length'], 2):.2f}м (не используется)\n"
+            mask = (1 << (capacity + 1)) - 1
+            reach = 1
+            history = []
+            for length_mm, take in items:
+                history.append(reach)
+                reach = (reach | (reach << (length_mm // unit * take))) & mask
 
-                instructions.append(instruction)
+            target = reach.bit_length() - 1
+            if target <= 0:
+                continue
 
-            if board['current_length'] >= CuttingOptimizer.MIN_LENGTH:
-                current_length_rounded = round(board['current_length'], 2)
-                # Группируем одинаковые остатки
-                found = False
-                for item in updated:
-                    if item[0] == material and abs(item[1] - current_length_rounded) < 0.01:
-                        item[2] += 1
-                        found = True
-                        break
+            # Восстанавливаем набор кусков для найденной суммы
+            chosen = Counter()
+            for (length_mm, take), before in zip(reversed(items), reversed(history)):
+                if not (before >> target) & 1:
+                    target -= length_mm // unit * take
+                    chosen[length_mm] += take
+
+            for length_mm in sorted(chosen, reverse=True):
+                group = groups[length_mm]
+                for _ in range(chosen[length_mm]):
+                    req_length, product = group.pop()
+                    board.cut(req_length, product)
+                if not group:
+                    del groups[length_mm]
+
+        unplaced = []
+        for group in groups.values():
+            unplaced.extend(group)
+        return unplaced
 
-                if not found:
-                    updated.append([material, current_length_rounded, 1])
+    @staticmethod
+    def _build_lumber_result(material, requirements, stock, boards, unplaced, strategy, spare=None):
+        """
+        Формирует инструкции, остатки и план по разложенным доскам.
 
-        # Формируем сообщения о недостающих материалах с общей длиной
-        missing = []
-        if missing_dict:
-            total_missing = sum(missing_dict.values())
-            products_list = ", ".join([f"'{prod}'" for prod in missing_dict.keys()])
-            missing.append(f"{material}: не хватает {total_missing:.2f}м для изделий {products_list}")
+        :param spare: Нераспиленные доски сводкой [(длина, количество), ...], которых нет в boards
+        """
+        instructions = []
+        offcuts = Counter()  # {длина остатка в мм: количество}
+
+        # Формируем инструкции и остатки
+        for board in boards:
+            if board.cuts:
+                instructions.append(CuttingOptimizer._board_instruction(board))
+
+            if board.current_length >= CuttingOptimizer.MIN_LENGTH_MM:
+                # Длины целые, поэтому одинаковые остатки группируются точным совпадением
+                offcuts[board.current_length] += 1
+        for length, quantity in spare or ():
+            if length >= CuttingOptimizer.MIN_LENGTH_MM:
+                offcuts[length] += quantity
+
+        updated = [StockLot(material, length, quantity) for length, quantity in offcuts.items()]
+
+        missing = CuttingOptimizer._missing_messages(material, unplaced)
 
         return {
             'success': len(missing) == 0,
             'instructions': instructions,
             'updated': updated,
-            'missing': missing
+            'missing': missing,
+            'plan': Plan(strategy, CuttingOptimizer._stock_snapshot(stock), list(requirements), boards, unplaced,
+                         spare)
         }
 
-
     @staticmethod
     def _process_fastener(material, requirements, stock):
         """Обработка метизов с улучшенными инструкциями"""
@@ -229,7 +689,7 @@ class CuttingOptimizer:
         quantities = [req[0] for req in requirements]
         total_required = sum(quantities)
 
-        total_available = sum(item['quantity'] for item in stock)
+        total_available = sum(item.quantity for item in stock)
 
         if total_available < total_required:
             return {
@@ -252,11 +712,68 @@ class CuttingOptimizer:
         # Обновляем складские остатки
         if total_available - total_required > 0:
             # Для метизов используем длину 0
-            updated.append([material, 0.0, total_available - total_required])  # Изменено на list
+            updated.append(StockLot(material, 0, total_available - total_required))
 
         return {
             'success': True,
             'updated': updated,
             'message': "",
             'instructions': instructions
-        }
\ No newline at end of file
+        }
+
+
+if __name__ == "__main__":
+    # Сравнение стратегий раскроя по скорости и отходам на случайном заказе
+    import random
+    import time
+    import tracemalloc
+
+    random.seed(42)
+    stock = [StockLot("Брус", 6000, 300), StockLot("Брус", 4500, 100)]
+    stock += [StockLot("Брус", random.randrange(500, 3000, 10), 1) for _ in range(200)]
+    piece_lengths = [450, 750, 900, 1200, 1350, 2050, 2700]
+    requirements = [Requirement(random.choice(piece_lengths), f"Изделие {i % 10}") for i in range(1500)]
+
+    def run_benchmark(stock, requirements, strategies):
+        print(f"Кусков: {len(requirements)}, досок на складе: {sum(item.quantity for item in stock)}")
+        for strategy in strategies:
+            title = CuttingOptimizer.STRATEGIES[strategy]
+            started = time.perf_counter()
+            result = CuttingOptimizer._process_lumber("Брус", list(requirements), stock, strategy)
+            elapsed = time.perf_counter() - started
+
+            # Память меряем отдельным прогоном: tracemalloc заметно замедляет работу
+            tracemalloc.start()
+            CuttingOptimizer._process_lumber("Брус", list(requirements), stock, strategy)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            used_boards = [board for board in result['plan'].boards if board.cuts]
+            scrap = sum(board.current_length for board in used_boards
+                        if board.current_length < CuttingOptimizer.MIN_LENGTH_MM)
+            print(f"{title}: {elapsed * 1000:.1f} мс, пик памяти {peak / 1e6:.1f} МБ, "
+                  f"досок распилено {len(used_boards)}, обрезков в отход {CuttingOptimizer.format_m(scrap)}м, "
+                  f"не размещено {len(result['plan'].unplaced)}")
+        print()
+
+    run_benchmark(stock, requirements, list(CuttingOptimizer.STRATEGIES))
+
+    # Большой склад: 10k+ досок, сравнение жадного и векторного движков
+    stock = [StockLot("Брус", 6000, 8000), StockLot("Брус", 4500, 3000)]
+    stock += [StockLot("Брус", random.randrange(500, 3000, 10), 1) for _ in range(2000)]
+    requirements = [Requirement(random.choice(piece_lengths), f"Изделие {i % 10}") for i in range(20000)]
+    run_benchmark(stock, requirements, [strategy for strategy in CuttingOptimizer.STRATEGIES
+                                        if strategy != CuttingOptimizer.STRATEGY_EXACT])
+
+    # Память на доску: прежний словарь со списком кусков-словарей против Board со __slots__
+    def measure(make):
+        tracemalloc.start()
+        boards = [make(i) for i in range(100000)]
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return size / len(boards)
+
+    dict_size = measure(lambda i: {'original_length': 6000, 'current_length': 4800 + i,
+                                   'cuts': [{'length': 1200, 'product': "Изделие"}]})
+    slots_size = measure(lambda i: Board(6000, 4800 + i, [Cut(1200, "Изделие")]))
+    print(f"Доска с одним распилом: словари {dict_size:.0f} Б, Board/Cut {slots_size:.0f} Б")
@@ -1,7 +1,16 @@
 # database.py - ВЕРСИЯ С ПОДДЕРЖКОЙ АВТОЗАПОЛНЕНИЯ
 
+import re
 import sqlite3
 import os
+from urllib.request import pathname2url
+
+from order_plan import index_plans
+
+
+def connect_read_only(db_path):
+    """Соединение с БД только на чтение"""
+    return sqlite3.connect(f"file:{pathname2url(os.path.abspath(db_path))}?mode=ro", uri=True)
 
 
 def check_table_structure(cursor, table_name, expected_columns):
@@ -18,14 +27,217 @@ def check_table_structure(cursor, table_name, expected_columns):
                 print(f"❌ Ошибка при добавлении колонки {column}: {e}")
 
 
+# Таблицы, где длины хранятся в целых миллиметрах (length_mm) вместо метров (length REAL)
+LENGTH_MM_TABLES = ("warehouse", "product_composition", "stage_materials", "standard_lengths")
+
+
+def detach_legacy_length_tables(cursor):
+    """
+    Откладывает таблицы со старым столбцом length (REAL, метры), переименовывая
+    их в <таблица>_legacy. SQLite не умеет менять тип столбца, поэтому таблицы
+    создаются заново, а данные переносятся migrate_legacy_lengths.
+
+    Уже отложенная таблица (перенос прервался в старой версии, где каждое
+    переименование фиксировалось отдельно) тоже возвращается - перенос
+    продолжается с нее.
+    """
+    legacy_tables = []
+    for table_name in LENGTH_MM_TABLES:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (f"{table_name}_legacy",))
+        if cursor.fetchone() is not None:
+            legacy_tables.append(table_name)
+            continue
+        cursor.execute(f"PRAGMA table_info({table_name})")
+        columns = {col[1] for col in cursor.fetchall()}
+        if "length" in columns and "length_mm" not in columns:
+            cursor.execute(f"ALTER TABLE {table_name} RENAME TO {table_name}_legacy")
+            legacy_tables.append(table_name)
+    return legacy_tables
+
+
+def migrate_legacy_lengths(cursor, legacy_tables):
+    """
+    Переносит данные отложенных таблиц, переводя метры в целые миллиметры.
+    Строки, которые уже есть в новой таблице (по первичному ключу), пропускаются.
+    """
+    length_mm = "CAST(ROUND(length * 1000) AS INTEGER)"
+    for table_name in legacy_tables:
+        legacy_name = f"{table_name}_legacy"
+        cursor.execute(f"PRAGMA table_info({table_name})")
+        new_columns = {col[1] for col in cursor.fetchall()}
+        cursor.execute(f"PRAGMA table_info({legacy_name})")
+        columns = [col[1] for col in cursor.fetchall() if col[1] in new_columns]
+
+        if table_name == "warehouse":
+            # Строки, которые различались только погрешностью float, сливаются в одну
+            cursor.execute(f"""INSERT OR IGNORE INTO warehouse (id, material_id, length_mm, quantity)
+                SELECT MIN(id), material_id, {length_mm}, SUM(quantity)
+                FROM warehouse_legacy
+                GROUP BY material_id, {length_mm}""")
+        else:
+            column_list = ", ".join(columns)
+            cursor.execute(f"""INSERT OR IGNORE INTO {table_name} ({column_list}, length_mm)
+                SELECT {column_list}, {length_mm} FROM {legacy_name}""")
+
+        cursor.execute(f"DROP TABLE {legacy_name}")
+        print(f"✅ Длины в таблице {table_name} переведены в миллиметры")
+
+
+def migrate_stage_default_length(cursor):
+    """
+    Добавляет этапам столбец default_length_m - длину, по которой считается
+    себестоимость этапа. Раньше длина бралась из текста описания ("Длина: 5"),
+    поэтому при добавлении столбца она один раз переносится оттуда.
+    """
+    cursor.execute("PRAGMA table_info(stages)")
+    if "default_length_m" in {col[1] for col in cursor.fetchall()}:
+        return
+
+    cursor.execute("ALTER TABLE stages ADD COLUMN default_length_m REAL NOT NULL DEFAULT 1.0")
+    cursor.execute("SELECT id, description FROM stages WHERE description LIKE '%Длина%'")
+    lengths = []
+    for stage_id, description in cursor.fetchall():
+        match = re.search(r"Длина\s*:\s*([\d.]+)", description)
+        try:
+            if match and float(match.group(1)) > 0:
+                lengths.append((float(match.group(1)), stage_id))
+        except ValueError:
+            pass
+    cursor.executemany("UPDATE stages SET default_length_m = ? WHERE id = ?", lengths)
+    print(f"✅ Добавлена колонка default_length_m в таблицу stages (длина из описания: {len(lengths)})")
+
+
+# Число позиций заказа хранится в orders.items_count и поддерживается триггерами:
+# список истории читается постранично без группировки по order_items
+ORDER_SUMMARY_TRIGGERS = """
+    CREATE TRIGGER IF NOT EXISTS order_summary_item_insert AFTER INSERT ON order_items BEGIN
+        UPDATE orders SET items_count = items_count + new.quantity WHERE id = new.order_id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS order_summary_item_update AFTER UPDATE OF quantity, order_id ON order_items BEGIN
+        UPDATE orders SET items_count = items_count - old.quantity WHERE id = old.order_id;
+        UPDATE orders SET items_count = items_count + new.quantity WHERE id = new.order_id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS order_summary_item_delete AFTER DELETE ON order_items BEGIN
+        UPDATE orders SET items_count = items_count - old.quantity WHERE id = old.order_id;
+    END;"""
+
+
+def create_triggers(cursor, script):
+    """Создает триггеры из script по одному: executescript зафиксировал бы открытую транзакцию"""
+    for statement in script.split("END;")[:-1]:
+        cursor.execute(statement + "END;")
+
+
+def fill_order_summary(cursor):
+    """Пересчитывает orders.items_count по order_items"""
+    cursor.execute("""UPDATE orders SET items_count =
+        (SELECT COALESCE(SUM(quantity), 0) FROM order_items WHERE order_id = orders.id)""")
+
+
+def migrate_order_summary(cursor):
+    """
+    Добавляет заказам столбец items_count (сумма количеств позиций), один раз
+    заполняет его из order_items, и триггеры, которые его поддерживают.
+    """
+    cursor.execute("PRAGMA table_info(orders)")
+    if "items_count" not in {col[1] for col in cursor.fetchall()}:
+        cursor.execute("ALTER TABLE orders ADD COLUMN items_count INTEGER NOT NULL DEFAULT 0")
+        fill_order_summary(cursor)
+        print("✅ Добавлена колонка items_count в таблицу orders")
+    create_triggers(cursor, ORDER_SUMMARY_TRIGGERS)
+
+    # Страницы истории: новые заказы сверху, продолжение - после последнего показанного
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_date ON orders(order_date DESC, id DESC)")
+
+
+# Полнотекстовый индекс истории заказов: строка индекса = заказ (rowid = orders.id).
+# Названия позиций хранятся одной строкой через пробел и поддерживаются триггерами.
+# Столбец instructions у заказов с планом раскроя - только названия материалов и
+# изделий плана (order_plan.plan_terms), у старых заказов - их текст инструкций.
+ORDER_SEARCH_TRIGGERS = """
+    CREATE TRIGGER IF NOT EXISTS order_search_order_insert AFTER INSERT ON orders BEGIN
+        INSERT INTO order_search(rowid, order_date, items, instructions)
+        VALUES (new.id, new.order_date, '', COALESCE(new.instructions, ''));
+    END;
+    CREATE TRIGGER IF NOT EXISTS order_search_order_update AFTER UPDATE OF order_date, instructions ON orders BEGIN
+        UPDATE order_search SET order_date = new.order_date, instructions = COALESCE(new.instructions, '')
+        WHERE rowid = new.id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS order_search_order_delete AFTER DELETE ON orders BEGIN
+        DELETE FROM order_search WHERE rowid = old.id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS order_search_item_insert AFTER INSERT ON order_items BEGIN
+        UPDATE order_search SET items = ltrim(items || ' ' || new.product_name) WHERE rowid = new.order_id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS order_search_item_update AFTER UPDATE OF product_name, order_id ON order_items BEGIN
+        UPDATE order_search SET items = COALESCE((SELECT group_concat(product_name, ' ') FROM order_items
+                                                  WHERE order_id = order_search.rowid), '')
+        WHERE rowid IN (old.order_id, new.order_id);
+    END;
+    CREATE TRIGGER IF NOT EXISTS order_search_item_delete AFTER DELETE ON order_items BEGIN
+        UPDATE order_search SET items = COALESCE((SELECT group_concat(product_name, ' ') FROM order_items
+                                                  WHERE order_id = old.order_id), '')
+        WHERE rowid = old.order_id;
+    END;"""
+
+
+def fill_order_search(cursor):
+    """Заполняет пустой order_search из истории заказов; возвращает число заказов"""
+    cursor.execute("""INSERT INTO order_search(rowid, order_date, items, instructions)
+        SELECT o.id, o.order_date,
+               COALESCE((SELECT group_concat(product_name, ' ') FROM order_items WHERE order_id = o.id), ''),
+               COALESCE(o.instructions, '')
+        FROM orders o""")
+    return cursor.rowcount
+
+
+def migrate_plan_search_terms(cursor):
+    """
+    Индекс, куда заказы с планом клали весь текст инструкций ("Материал: ..."),
+    переводится на названия материалов и изделий плана. Текст инструкций
+    хранился в индексе копией и занимал больше самих планов.
+    """
+    cursor.execute("""SELECT 1 FROM order_search s JOIN order_plans p ON p.order_id = s.rowid
+                      WHERE s.instructions LIKE 'Материал:%' LIMIT 1""")
+    if cursor.fetchone() is None:
+        return
+    count = index_plans(cursor)
+    cursor.execute("INSERT INTO order_search(order_search) VALUES ('optimize')")
+    print(f"✅ Поисковый индекс заказов с планом раскроя переведен на названия материалов и изделий ({count})")
+
+
+def create_order_search_index(cursor):
+    """
+    Создает FTS5-индекс order_search по дате, названиям позиций и словам
+    инструкций заказов и триггеры, которые держат его в соответствии с
+    orders и order_items. Новый индекс один раз заполняется из истории.
+    """
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'order_search'")
+    exists = cursor.fetchone() is not None
+    if not exists:
+        cursor.execute("""CREATE VIRTUAL TABLE order_search USING fts5(
+            order_date, items, instructions, tokenize = 'unicode61 remove_diacritics 2')""")
+        count = fill_order_search(cursor)
+        index_plans(cursor)
+        print(f"✅ Создан поисковый индекс истории заказов ({count} заказов)")
+    create_triggers(cursor, ORDER_SEARCH_TRIGGERS)
+
+
 def create_database(db_path):
     """Создает базу данных и таблицы с поддержкой этапов и их частей"""
     data_dir = os.path.dirname(db_path)
     if not os.path.exists(data_dir):
         os.makedirs(data_dir)
 
-    conn = sqlite3.connect(db_path)
+    # Схема и перевод длин в миллиметры идут одной явной транзакцией: в режиме
+    # sqlite3 по умолчанию каждый DDL фиксируется сразу, и прерванный перенос
+    # оставил бы переименованные таблицы рядом с пустыми новыми
+    conn = sqlite3.connect(db_path, isolation_level=None)
     cursor = conn.cursor()
+    cursor.execute("BEGIN")
+
+    # Старые таблицы с длинами в метрах пересоздаются с length_mm
+    legacy_tables = detach_legacy_length_tables(cursor)
 
     # Существующие таблицы
     cursor.execute("""CREATE TABLE IF NOT EXISTS materials (
@@ -38,7 +250,7 @@ def create_database(db_path):
     cursor.execute("""CREATE TABLE IF NOT EXISTS warehouse (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         material_id INTEGER NOT NULL,
-        length REAL NOT NULL,
+        length_mm INTEGER NOT NULL,
         quantity INTEGER NOT NULL DEFAULT 1,
         FOREIGN KEY (material_id) REFERENCES materials(id))""")
 
@@ -52,17 +264,30 @@ def create_database(db_path):
         product_id INTEGER NOT NULL,
         material_id INTEGER NOT NULL,
         quantity INTEGER NOT NULL,
-        length REAL,
+        length_mm INTEGER,
         FOREIGN KEY (product_id) REFERENCES products(id),
         FOREIGN KEY (material_id) REFERENCES materials(id))""")
 
+    # Вложенные изделия (узлы): изделие может включать другие изделия
+    cursor.execute("""CREATE TABLE IF NOT EXISTS product_products (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        parent_product_id INTEGER NOT NULL,
+        child_product_id INTEGER NOT NULL,
+        quantity INTEGER NOT NULL DEFAULT 1,
+        FOREIGN KEY (parent_product_id) REFERENCES products(id),
+        FOREIGN KEY (child_product_id) REFERENCES products(id),
+        CHECK (parent_product_id != child_product_id),
+        UNIQUE(parent_product_id, child_product_id))""")
+
     # Таблицы этапов
     cursor.execute("""CREATE TABLE IF NOT EXISTS stages (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         name TEXT NOT NULL UNIQUE,
         cost REAL NOT NULL DEFAULT 0.0,
         description TEXT,
-        category TEXT DEFAULT 'Статика' CHECK(category IN ('Статика', 'Динамика', 'Зип')))""")
+        category TEXT DEFAULT 'Статика' CHECK(category IN ('Статика', 'Динамика', 'Зип')),
+        default_length_m REAL NOT NULL DEFAULT 1.0)""")
+    migrate_stage_default_length(cursor)
 
     # В составе этапа указываем часть (start/meter/end)
     cursor.execute("""CREATE TABLE IF NOT EXISTS stage_products (
@@ -79,26 +304,43 @@ def create_database(db_path):
         stage_id INTEGER NOT NULL,
         material_id INTEGER NOT NULL,
         quantity INTEGER NOT NULL,
-        length REAL,
+        length_mm INTEGER,
         part TEXT NOT NULL DEFAULT 'meter' CHECK(part IN ('start','meter','end')),
         FOREIGN KEY (stage_id) REFERENCES stages(id),
         FOREIGN KEY (material_id) REFERENCES materials(id))""")
 
+    # Стандартные длины, которые можно докупить (цена за одну доску)
+    cursor.execute("""CREATE TABLE IF NOT EXISTS standard_lengths (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        material_id INTEGER NOT NULL,
+        length_mm INTEGER NOT NULL,
+        price REAL NOT NULL,
+        FOREIGN KEY (material_id) REFERENCES materials(id),
+        UNIQUE(material_id, length_mm))""")
+
+    migrate_legacy_lengths(cursor, legacy_tables)
+    cursor.execute("COMMIT")
+    conn.isolation_level = ""
+
+    # Поиск остатка на складе по материалу и точной длине
+    cursor.execute("""CREATE UNIQUE INDEX IF NOT EXISTS idx_warehouse_material_length
+        ON warehouse(material_id, length_mm)""")
+
     cursor.execute("""CREATE TABLE IF NOT EXISTS orders (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         order_date TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
         total_cost REAL NOT NULL DEFAULT 0.0,
         instructions TEXT,
-        pdf_filename TEXT)""")
+        pdf_filename TEXT,
+        items_count INTEGER NOT NULL DEFAULT 0)""")
 
-    # Пересоздание order_items с правильной схемой, если старая версия
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='order_items'")
-    table_exists = cursor.fetchone()
+    # Пересоздание order_items с правильной схемой, если старая версия (без item_type);
+    # таблица текущей схемы не трогается, иначе при каждом запуске терялись бы этапы заказов
+    cursor.execute("PRAGMA table_info(order_items)")
+    old_columns = [col[1] for col in cursor.fetchall()]
     existing_data = []
 
-    if table_exists:
-        cursor.execute("PRAGMA table_info(order_items)")
-        old_columns = [col[1] for col in cursor.fetchall()]
+    if old_columns and "item_type" not in old_columns:
         cursor.execute("SELECT * FROM order_items")
         existing_data = cursor.fetchall()
         cursor.execute("DROP TABLE order_items")
@@ -129,6 +371,19 @@ def create_database(db_path):
             except Exception:
                 pass
 
+    # План раскроя подтвержденного заказа: JSON, сжатый zlib (см. order_plan.py)
+    cursor.execute("""CREATE TABLE IF NOT EXISTS order_plans (
+        order_id INTEGER PRIMARY KEY,
+        format INTEGER NOT NULL,
+        plan BLOB NOT NULL,
+        FOREIGN KEY (order_id) REFERENCES orders(id))""")
+
+    # Позиции заказа по заказу: детали, сумма позиций в истории, триггеры поиска
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items(order_id)")
+
+    migrate_order_summary(cursor)
+    create_order_search_index(cursor)
+    migrate_plan_search_terms(cursor)
     conn.commit()
 
     # Миграция недостающих столбцов на существующих БД
@@ -0,0 +1,273 @@
+# db_dump.py - текстовый снимок базы данных для синхронизации через Git
+#
+# Каждая таблица пишется в <таблица>.jsonl: первая строка - {"columns": [...]},
+# дальше по строке JSON на запись в порядке первичного ключа. Снимок
+# детерминирован: те же данные дают те же байты, а правка записи меняет одну
+# строку файла - Git хранит небольшие изменения и сливает правки разных
+# записей из двух мастерских.
+#
+# Таблицы вне схемы приложения (create_database), например оставшиеся в
+# старых базах stage_components и stage_section_*, пишутся с определением:
+# в первой строке есть "create" (CREATE TABLE и CREATE INDEX), и загрузка
+# создает их заново, а не теряет.
+#
+# В снимок не попадает то, что восстанавливается из данных: поисковый индекс
+# order_search, orders.items_count и счетчики sqlite_sequence. План раскроя
+# пишется разобранным JSON (order_plan.unpack_plan), прочие BLOB - base64.
+#
+# Загрузка собирает новую БД рядом с рабочей: схема - create_database, все
+# таблицы - executemany в одной транзакции при снятых триггерах, затем
+# пересчет производных данных, возврат триггеров и замена файла БД.
+import base64
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+from functools import lru_cache
+
+from database import connect_read_only, create_database, fill_order_search, fill_order_summary
+from order_plan import index_plans, pack_plan, unpack_plan
+
+DERIVED_COLUMNS = {'orders': {'items_count'}}
+BLOB_CODECS = {('order_plans', 'plan'): (unpack_plan, pack_plan)}
+
+
+def default_dump_dir(db_path):
+    """Папка снимка рядом с БД: data/dump"""
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), 'dump')
+
+
+@lru_cache(maxsize=None)
+def schema_tables():
+    """Таблицы, которые создает create_database (по пустой БД во временной папке)"""
+    work_dir = tempfile.mkdtemp()
+    try:
+        db_path = os.path.join(work_dir, 'schema.db')
+        create_database(db_path)
+        conn = sqlite3.connect(db_path)
+        try:
+            return frozenset(name for name, in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'"))
+        finally:
+            conn.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def table_definition(cursor, table):
+    """CREATE TABLE и CREATE INDEX таблицы (индексы по имени) - для таблиц вне схемы приложения"""
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+    statements = [cursor.fetchone()[0]]
+    cursor.execute("""SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL
+                      ORDER BY name""", (table,))
+    return statements + [sql for sql, in cursor.fetchall()]
+
+
+def dumped_tables(cursor):
+    """Таблицы данных БД по алфавиту - без служебных, виртуальных и их теневых таблиц"""
+    cursor.execute("SELECT name, sql FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")
+    tables = dict(cursor.fetchall())
+    virtual = [name for name, sql in tables.items() if sql.upper().startswith("CREATE VIRTUAL TABLE")]
+    return sorted(name for name in tables
+                  if not any(name == vt or name.startswith(f"{vt}_") for vt in virtual))
+
+
+def _encode(table, column, value):
+    if not isinstance(value, bytes):
+        return value
+    codec = BLOB_CODECS.get((table, column))
+    if codec is not None:
+        return codec[0](value)
+    return {'base64': base64.b64encode(value).decode('ascii')}
+
+
+def _decode(table, column, value):
+    codec = BLOB_CODECS.get((table, column))
+    if codec is not None and value is not None:
+        return codec[1](value)
+    if isinstance(value, dict):
+        return base64.b64decode(value['base64'])
+    return value
+
+
+def _dump_line(value):
+    return json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(',', ':')) + "\n"
+
+
+def dump_table(cursor, table, path):
+    """Пишет таблицу в path; возвращает число записей"""
+    cursor.execute(f'PRAGMA table_info("{table}")')
+    info = cursor.fetchall()
+    derived = DERIVED_COLUMNS.get(table, set())
+    columns = [col[1] for col in info if col[1] not in derived]
+    # Порядок записей - первичный ключ, для таблиц без него - все столбцы
+    key = [col[1] for col in sorted(info, key=lambda col: col[5]) if col[5]] or columns
+    select = ", ".join(f'"{col}"' for col in columns)
+    order = ", ".join(f'"{col}"' for col in key)
+
+    header = {'columns': columns}
+    if table not in schema_tables():
+        header['create'] = table_definition(cursor, table)
+
+    count = 0
+    with open(path, 'w', encoding='utf-8', newline='\n') as output:
+        output.write(_dump_line(header))
+        for row in cursor.execute(f'SELECT {select} FROM "{table}" ORDER BY {order}'):
+            output.write(_dump_line([_encode(table, col, value) for col, value in zip(columns, row)]))
+            count += 1
+    return count
+
+
+def dump_database(db_path, dump_dir):
+    """
+    Снимок БД в dump_dir; файлы таблиц, которых больше нет, удаляются.
+
+    :return: {таблица: число записей}
+    """
+    os.makedirs(dump_dir, exist_ok=True)
+    conn = connect_read_only(db_path)
+    try:
+        cursor = conn.cursor()
+        counts = {table: dump_table(cursor, table, os.path.join(dump_dir, f"{table}.jsonl"))
+                  for table in dumped_tables(cursor)}
+    finally:
+        conn.close()
+
+    for name in os.listdir(dump_dir):
+        if name.endswith(".jsonl") and name[:-len(".jsonl")] not in counts:
+            os.remove(os.path.join(dump_dir, name))
+    return counts
+
+
+def load_table(cursor, table, path):
+    """
+    Записи из файла снимка в пустую таблицу; возвращает их число. Таблица вне
+    схемы приложения создается по определению из снимка.
+    """
+    with open(path, encoding='utf-8') as source:
+        header = json.loads(source.readline())
+        cursor.execute(f'PRAGMA table_info("{table}")')
+        existing = {col[1] for col in cursor.fetchall()}
+        if not existing:
+            if 'create' not in header:
+                raise ValueError(f"Таблицы {table} нет в схеме, а в снимке нет ее определения")
+            for statement in header['create']:
+                cursor.execute(statement)
+            cursor.execute(f'PRAGMA table_info("{table}")')
+            existing = {col[1] for col in cursor.fetchall()}
+
+        columns = header['columns']
+        # Столбцы, которых нет в текущей схеме, не загружаются
+        kept = [i for i, col in enumerate(columns) if col in existing]
+        names = [columns[i] for i in kept]
+        rows = ([_decode(table, names[j], row[i]) for j, i in enumerate(kept)]
+                for row in map(json.loads, source))
+        insert_columns = ", ".join(f'"{col}"' for col in names)
+        placeholders = ", ".join("?" * len(names))
+        try:
+            cursor.executemany(f'INSERT INTO "{table}" ({insert_columns}) VALUES ({placeholders})', rows)
+        except sqlite3.IntegrityError as e:
+            duplicates = duplicate_keys(cursor, table, path)
+            if duplicates:
+                raise ValueError(f"В снимке таблицы {table} повторяются ключи {duplicates}: "
+                                 "одни и те же записи добавлены в обеих мастерских") from e
+            raise ValueError(f"Снимок таблицы {table} не загружается: {e}") from e
+    return cursor.rowcount
+
+
+def duplicate_keys(cursor, table, path, limit=10):
+    """Значения первичного ключа, которые встречаются в файле снимка больше одного раза (до limit)"""
+    cursor.execute(f'PRAGMA table_info("{table}")')
+    key = [col[1] for col in sorted(cursor.fetchall(), key=lambda col: col[5]) if col[5]]
+    with open(path, encoding='utf-8') as source:
+        columns = json.loads(source.readline())['columns']
+        if not key or not set(key) <= set(columns):
+            return []
+        positions = [columns.index(col) for col in key]
+        seen, duplicates = set(), []
+        for row in map(json.loads, source):
+            value = tuple(row[i] for i in positions)
+            value = value[0] if len(value) == 1 else value
+            if value in seen and value not in duplicates:
+                duplicates.append(value)
+                if len(duplicates) >= limit:
+                    break
+            seen.add(value)
+    return duplicates
+
+
+def _rebuild_derived(cursor):
+    """Производные данные по загруженным таблицам"""
+    fill_order_summary(cursor)
+    cursor.execute("DELETE FROM order_search")
+    fill_order_search(cursor)
+    index_plans(cursor)
+
+
+def load_dump(dump_dir, db_path):
+    """
+    Заменяет БД собранной из снимка dump_dir. При ошибке рабочая БД не меняется.
+
+    :return: {таблица: число записей}
+    """
+    partial = f"{db_path}.{os.getpid()}.tmp"
+    if os.path.exists(partial):
+        os.remove(partial)
+    create_database(partial)
+
+    conn = sqlite3.connect(partial)
+    try:
+        cursor = conn.cursor()
+        # Триггеры поддерживают производные данные по одной записи - при загрузке
+        # они снимаются, а данные пересчитываются целиком
+        cursor.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' ORDER BY name")
+        triggers = cursor.fetchall()
+        for name, _ in triggers:
+            cursor.execute(f'DROP TRIGGER "{name}"')
+
+        counts = {}
+        for name in sorted(os.listdir(dump_dir)):
+            if name.endswith(".jsonl"):
+                table = name[:-len(".jsonl")]
+                counts[table] = load_table(cursor, table, os.path.join(dump_dir, name))
+        _rebuild_derived(cursor)
+        for _, sql in triggers:
+            cursor.execute(sql)
+        conn.commit()
+    except Exception:
+        conn.close()
+        os.remove(partial)
+        raise
+    conn.close()
+
+    os.replace(partial, db_path)
+    return counts
+
+
+if __name__ == "__main__":
+    # Снимок БД и обратная загрузка: время и совпадение повторного снимка
+    import filecmp
+    import sys
+    import time
+
+    source = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(__file__), '..', 'data', 'database.db')
+    work_dir = tempfile.mkdtemp()
+    db_path = os.path.join(work_dir, 'database.db')
+    first, second = os.path.join(work_dir, 'dump1'), os.path.join(work_dir, 'dump2')
+    restored = os.path.join(work_dir, 'restored.db')
+    # Снимок делается с БД текущей схемы - копия проходит миграции, как при запуске приложения
+    shutil.copyfile(source, db_path)
+    create_database(db_path)
+
+    started = time.perf_counter()
+    counts = dump_database(db_path, first)
+    size = sum(os.path.getsize(os.path.join(first, name)) for name in os.listdir(first))
+    print(f"Снимок: {sum(counts.values())} записей, {size // 1024} КБ за {time.perf_counter() - started:.2f} с")
+
+    started = time.perf_counter()
+    load_dump(first, restored)
+    print(f"Загрузка: {time.perf_counter() - started:.2f} с")
+
+    dump_database(restored, second)
+    _, mismatch, errors = filecmp.cmpfiles(first, second, sorted(os.listdir(second)), shallow=False)
+    print("Повторный снимок совпадает" if not mismatch and not errors else f"Различия: {mismatch + errors}")
@@ -0,0 +1,84 @@
+# domain.py - типы предметной области раскроя
+#
+# Все длины пиломатериалов - целые миллиметры. Неизменяемые записи сделаны на
+# namedtuple: они компактны, хешируются (нужно тёплому старту) и по-прежнему
+# распаковываются как кортежи. Изменяемые доски и план - классы со __slots__.
+from collections import namedtuple
+
+
+class Requirement(namedtuple('Requirement', ['value', 'product'])):
+    """
+    Требование заказа по материалу: для пиломатериала value - длина куска в мм,
+    для метиза - количество штук.
+    """
+    __slots__ = ()
+
+
+class StockLot(namedtuple('StockLot', ['material', 'length', 'quantity'])):
+    """Партия на складе: материал, длина в мм (0 для метизов) и количество"""
+    __slots__ = ()
+
+
+class Cut(namedtuple('Cut', ['length', 'product'])):
+    """Отпиленный кусок: длина в мм и изделие, для которого он отпилен"""
+    __slots__ = ()
+
+
+class BatchProduct(namedtuple('BatchProduct', ['order', 'product'])):
+    """Изделие в пакетном раскрое: помнит, к какому заказу относится кусок"""
+    __slots__ = ()
+
+    def __str__(self):
+        return f"{self.product} (заказ {self.order})"
+
+
+class Board:
+    """Доска в раскрое: исходная длина, текущий остаток (мм) и отпиленные куски"""
+    __slots__ = ('original_length', 'current_length', 'cuts')
+
+    def __init__(self, original_length, current_length=None, cuts=None):
+        self.original_length = original_length
+        self.current_length = original_length if current_length is None else current_length
+        self.cuts = [] if cuts is None else cuts
+
+    def cut(self, length, product):
+        """Отпиливает кусок от остатка доски"""
+        self.current_length -= length
+        self.cuts.append(Cut(length, product))
+
+    def copy(self):
+        return Board(self.original_length, self.current_length, list(self.cuts))
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.original_length}, {self.current_length}, {self.cuts!r})"
+
+
+class PurchaseBoard(Board):
+    """Новая доска стандартной длины из плана закупки"""
+    __slots__ = ('price',)
+
+    def __init__(self, original_length, current_length, cuts, price):
+        super().__init__(original_length, current_length, cuts)
+        self.price = price
+
+
+class Plan:
+    """
+    План раскроя одного пиломатериала - то, что нужно тёплому старту.
+
+    :ivar strategy: Стратегия, которой построен план
+    :ivar stock: Снимок склада [(длина, количество), ...]
+    :ivar requirements: Размещаемые куски [Requirement, ...]
+    :ivar boards: Доски в работе [Board, ...]
+    :ivar unplaced: Куски, не поместившиеся в склад
+    :ivar spare: Нераспиленные доски сводкой [(длина, количество), ...]
+    """
+    __slots__ = ('strategy', 'stock', 'requirements', 'boards', 'unplaced', 'spare')
+
+    def __init__(self, strategy, stock, requirements, boards, unplaced, spare=None):
+        self.strategy = strategy
+        self.stock = stock
+        self.requirements = requirements
+        self.boards = boards
+        self.unplaced = unplaced
+        self.spare = [] if spare is None else spare
@@ -2,54 +2,58 @@
 
 import sys
 import os
-import math
 import subprocess
 import sqlite3
 import platform
-from functools import partial
-from reportlab.lib import colors
-from reportlab.platypus import Table, TableStyle
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet
 from datetime import datetime
 from cutting_optimizer import CuttingOptimizer
+from domain import Requirement, StockLot
+from safety_rope import CLAMP_MATERIAL, ROPE_MATERIAL, RopeService, route_breakdown, rope_requirements
+from route_planner import plan_routes
+from stage_pricing import StagePriceCache
+from order_requirements import expand_order_python, expand_order_sql
+from bom import BomResolver, rollup_costs, would_create_cycle
+from catalog import Catalog
+from db_dump import default_dump_dir, dump_database, load_dump
+from order_model import OrderDelegate, OrderModel
+from order_export import export_orders
+from order_history import HISTORY_PAGE, load_history_page, orders_in_range, search_orders
+from order_plan import build_plan, load_plan, order_instructions, render_instructions, save_plan, stock_before_plans
+from order_report import load_order_report, render_order_pdf, report_key
+from pdf_cache import PdfCache
 from collections import defaultdict
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QTabWidget, QTableWidget,
                              QTableWidgetItem, QPushButton, QVBoxLayout, QWidget,
                              QHeaderView, QMessageBox, QLabel, QLineEdit, QComboBox,
                              QHBoxLayout, QFormLayout, QGroupBox, QSpinBox, QDoubleSpinBox, QTextEdit,
-                             QDialog, QSplitter)
-from PyQt5.QtCore import Qt
-
-# ИСПРАВЛЕНИЕ 1: Улучшенная регистрация шрифта Arial
-ARIAL_FONT_REGISTERED = False
-
-
-def setup_arial_font():
-    global ARIAL_FONT_REGISTERED
-    try:
-        if getattr(sys, 'frozen', False):
-            font_path = os.path.join(os.path.dirname(sys.executable), 'fonts', 'arial.ttf')
-        else:
-            font_path = os.path.join(os.path.dirname(__file__), 'fonts', 'arial.ttf')
-        print(f"Попытка загрузить шрифт: {font_path}")
-        if os.path.exists(font_path):
-            pdfmetrics.registerFont(TTFont('Arial', font_path))
-            ARIAL_FONT_REGISTERED = True
-            print("✓ Шрифт Arial успешно зарегистрирован")
-        else:
-            print(f"✗ Файл шрифта не найден: {font_path}")
-            ARIAL_FONT_REGISTERED = False
-    except Exception as e:
-        print(f"✗ Ошибка регистрации шрифта Arial: {e}")
-        ARIAL_FONT_REGISTERED = False
-
-
-# Вызываем функцию регистрации
-setup_arial_font()
+                             QDialog, QSplitter, QTableView, QAbstractItemView, QDateEdit, QDialogButtonBox,
+                             QFileDialog, QProgressDialog)
+from PyQt5.QtCore import QDate, Qt
+
+def sync_combo(combo, rows, changed_ids=None):
+    """
+    Приводит выпадающий список к rows [(id, подпись), ...] (по порядку).
+
+    Если известны id изменившихся строк, трогаются только они: старые
+    пункты убираются, новые вставляются на свое место. Иначе список
+    пересобирается целиком с сохранением выбора.
+    """
+    if changed_ids is None or combo.count() == 0:
+        current_id = combo.currentData()
+        combo.clear()
+        for row_id, label in rows:
+            combo.addItem(label, row_id)
+        if current_id is not None and combo.findData(current_id) >= 0:
+            combo.setCurrentIndex(combo.findData(current_id))
+        return
+
+    changed = set(changed_ids)
+    for index in reversed(range(combo.count())):
+        if combo.itemData(index) in changed:
+            combo.removeItem(index)
+    for position, (row_id, label) in enumerate(rows):
+        if row_id in changed:
+            combo.insertItem(position, label, row_id)
 
 
 class RoutesPlanningDialog(QDialog):
@@ -89,6 +93,10 @@ class RoutesPlanningDialog(QDialog):
         self.planning_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
         self.planning_table.setRowCount(len(self.stages))
 
+        # Трасс и позиций не может быть больше, чем этапов (но не меньше прежних 10/20)
+        max_routes = max(10, len(self.stages))
+        max_positions = max(20, len(self.stages))
+
         for row, stage in enumerate(self.stages):
             # Название этапа
             name_item = QTableWidgetItem(stage['name'])
@@ -114,7 +122,7 @@ class RoutesPlanningDialog(QDialog):
             # № трассы
             route_spin = QSpinBox()
             route_spin.setMinimum(1)
-            route_spin.setMaximum(10)
+            route_spin.setMaximum(max_routes)
             route_spin.setValue(1)
             route_spin.setToolTip("Номер трассы для страховочного троса")
             route_spin.valueChanged.connect(self.validate_positions)
@@ -123,7 +131,7 @@ class RoutesPlanningDialog(QDialog):
             # № в трассе
             position_spin = QSpinBox()
             position_spin.setMinimum(1)
-            position_spin.setMaximum(20)
+            position_spin.setMaximum(max_positions)
             position_spin.setValue(row + 1)
             position_spin.setToolTip("Позиция этапа внутри трассы троса")
             position_spin.valueChanged.connect(self.validate_positions)
@@ -137,11 +145,27 @@ class RoutesPlanningDialog(QDialog):
         self.validation_label.setWordWrap(True)
         layout.addWidget(self.validation_label)
 
+        # Ограничения для автоматического планирования (0 - без ограничения)
+        limits_layout = QHBoxLayout()
+        limits_layout.addWidget(QLabel("Макс. длина трассы (м):"))
+        self.max_route_length_spin = QDoubleSpinBox()
+        self.max_route_length_spin.setDecimals(2)
+        self.max_route_length_spin.setRange(0.0, 99999.0)
+        self.max_route_length_spin.setSpecialValueText("без ограничения")
+        limits_layout.addWidget(self.max_route_length_spin)
+        limits_layout.addWidget(QLabel("Макс. этапов в трассе:"))
+        self.max_route_stages_spin = QSpinBox()
+        self.max_route_stages_spin.setRange(0, max(20, len(self.stages)))
+        self.max_route_stages_spin.setSpecialValueText("без ограничения")
+        limits_layout.addWidget(self.max_route_stages_spin)
+        limits_layout.addStretch()
+        layout.addLayout(limits_layout)
+
         # Кнопки
         btn_layout = QHBoxLayout()
         auto_btn = QPushButton("Автоматическое планирование")
         auto_btn.clicked.connect(self.auto_planning)
-        auto_btn.setToolTip("Автоматически расставить этапы по трассам без конфликтов")
+        auto_btn.setToolTip("Разбить этапы на трассы с минимальным расходом троса и зажимов")
         btn_layout.addWidget(auto_btn)
 
         preview_btn = QPushButton("Предварительный просмотр")
@@ -200,24 +224,26 @@ class RoutesPlanningDialog(QDialog):
                                 "на одной позиции в одной трассе.")
 
     def auto_planning(self):
-        """Автоматическое планирование без конфликтов"""
-        # Получаем только статические этапы
-        static_stages = []
-        for row in range(len(self.stages)):
-            if self.stages[row]['category'] == 'Статика':
-                static_stages.append(row)
-
-        if not static_stages:
+        """
+        Автоматическое планирование: этапы в порядке таблицы разбиваются на трассы
+        с минимальным расходом троса и зажимов (см. route_planner.plan_routes).
+        """
+        if not any(stage['category'] == 'Статика' for stage in self.stages):
             QMessageBox.information(self, "Информация", "Нет статических этапов для планирования")
             return
 
-        # Размещаем статические этапы в одну трассу по порядку
-        for i, row in enumerate(static_stages):
-            route_widget = self.planning_table.cellWidget(row, 3)
-            position_widget = self.planning_table.cellWidget(row, 4)
+        routes = plan_routes(self.stages,
+                             max_route_length=self.max_route_length_spin.value() or None,
+                             max_stages=self.max_route_stages_spin.value() or None)
 
-            route_widget.setValue(1)  # Все в первую трассу
-            position_widget.setValue(i + 1)  # По порядку без конфликтов
+        # Без сигналов: иначе валидация запускалась бы на каждое изменение значения
+        for route_num, route in enumerate(routes, 1):
+            for position, row in enumerate(route, 1):
+                for column, value in ((3, route_num), (4, position)):
+                    widget = self.planning_table.cellWidget(row, column)
+                    widget.blockSignals(True)
+                    widget.setValue(value)
+                    widget.blockSignals(False)
 
         # Запускаем валидацию
         self.validate_positions()
@@ -242,59 +268,23 @@ class RoutesPlanningDialog(QDialog):
         preview += f"Всего этапов: {total_stages} (Статика: {static_count}, Динамика/Зип: {dynamic_count})\n"
         preview += f"Трасс страховочного троса: {len(routes)}\n\n"
 
-        total_rope = 0.0
-        total_clamps = 0
-
-        for idx, route in enumerate(routes, 1):
+        breakdown = route_breakdown(routes)
+        for idx, route in enumerate(breakdown, 1):
+            static_in_route = sum(1 for stage in route['stages'] if stage['category'] == 'Статика')
             preview += f"=== Трасса {idx} ===\n"
-            preview += f"Статических этапов: {len(route)}\n"
-
-            # Восстанавливаем полную трассу с динамическими этапами
-            full_route = []
-            for row in range(len(self.stages)):
-                route_widget = self.planning_table.cellWidget(row, 3)
-                position_widget = self.planning_table.cellWidget(row, 4)
-                stage = self.stages[row]
-
-                if route_widget and position_widget:
-                    if route_widget.value() == idx:
-                        full_route.append((position_widget.value(), stage))
-
-            # Сортируем по позиции и разбиваем на сегменты
-            full_route.sort(key=lambda x: x[0])
-            segments = []
-            current_segment = None
-
-            for pos, stage in full_route:
-                stage_type = 'static' if stage['category'] == 'Статика' else 'dynamic'
-
-                if current_segment is None or current_segment['type'] != stage_type:
-                    current_segment = {'type': stage_type, 'stages': [stage]}
-                    segments.append(current_segment)
-                else:
-                    current_segment['stages'].append(stage)
+            preview += f"Статических этапов: {static_in_route}\n"
 
-            # Расчет для этой трассы - только статические сегменты
-            route_rope = 0.0
-            route_clamps = 0
-
-            for segment in segments:
+            for segment in route['segments']:
                 if segment['type'] == 'static':
-                    N = len(segment['stages'])
-                    L = sum(s['length'] for s in segment['stages'])
-                    rope = 5 + 5 * N + L
-                    clamps = 6 + 6 * N
-                    route_rope += rope
-                    route_clamps += clamps
-                    preview += f" Статический сегмент: {N} этапов, {L:.2f}м → "
-                    preview += f"Трос: {rope:.2f}м, Зажимы: {clamps}шт\n"
-                elif segment['type'] == 'dynamic':
+                    preview += f" Статический сегмент: {len(segment['stages'])} этапов, {segment['length']:.2f}м → "
+                    preview += f"Трос: {segment['rope']:.2f}м, Зажимы: {segment['clamps']}шт\n"
+                else:
                     preview += f" Динамический сегмент: игнорируется (разрывает трассу)\n"
 
-            total_rope += route_rope
-            total_clamps += route_clamps
-            preview += f"Итого по трассе {idx}: {route_rope:.2f}м троса, {route_clamps} зажимов\n\n"
+            preview += f"Итого по трассе {idx}: {route['rope']:.2f}м троса, {route['clamps']} зажимов\n\n"
 
+        total_rope = sum(route['rope'] for route in breakdown)
+        total_clamps = sum(route['clamps'] for route in breakdown)
         preview += f"📊 ОБЩИЙ ИТОГ: {total_rope:.2f}м троса М12, {total_clamps} зажимов М12"
 
         QMessageBox.information(self, "Предварительный расчет", preview)
@@ -330,15 +320,38 @@ class RoutesPlanningDialog(QDialog):
 
 # КЛАСС ЭТАПОВ С АВТОЗАПОЛНЕНИЕМ
 class StagesTab(QWidget):
-    def __init__(self, db_path, main_window=None):
+    def __init__(self, db_path, main_window=None, catalog=None):
         super().__init__()
         self.db_path = db_path
         self.main_window = main_window
+        self.catalog = catalog if catalog is not None else Catalog(db_path)
         self.selected_stage_id = None
         self.selected_stage_name = None
         self.init_ui()
         self.load_stages()
 
+        self.catalog.products_changed.connect(self.load_products)
+        self.catalog.materials_changed.connect(self.load_materials)
+        # Себестоимость этапа складывается из цен материалов и изделий - после их правки пересчитывается
+        self.catalog.materials_changed.connect(self.on_material_costs_changed)
+        self.catalog.products_changed.connect(self.on_product_costs_changed)
+
+    def on_material_costs_changed(self, material_ids):
+        self._update_stage_costs(self.catalog.stage_materials, material_ids)
+
+    def on_product_costs_changed(self, product_ids):
+        self._update_stage_costs(self.catalog.stage_products, product_ids)
+
+    def _update_stage_costs(self, compositions, changed_ids):
+        """Пересчитывает stages.cost этапов, в состав которых входят changed_ids, и обновляет таблицу"""
+        changed_ids = set(changed_ids)
+        stage_ids = [stage_id for stage_id, rows in compositions.items()
+                     if any(row[0] in changed_ids for row in rows)]
+        if not stage_ids:
+            return
+        self.store_stage_costs(stage_ids)
+        self.load_stages()
+
     def init_ui(self):
         main_splitter = QSplitter(Qt.Horizontal)
 
@@ -357,8 +370,9 @@ class StagesTab(QWidget):
 
         # Таблица этапов
         self.stages_table = QTableWidget()
-        self.stages_table.setColumnCount(5)
-        self.stages_table.setHorizontalHeaderLabels(["ID", "Название", "Категория", "Себестоимость", "Описание"])
+        self.stages_table.setColumnCount(6)
+        self.stages_table.setHorizontalHeaderLabels(["ID", "Название", "Категория", "Себестоимость", "Описание",
+                                                     "Длина (м)"])
         self.stages_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
         self.stages_table.cellClicked.connect(self.on_stage_selected)
         self.stages_table.cellChanged.connect(self.on_stage_cell_edited)
@@ -376,6 +390,13 @@ class StagesTab(QWidget):
         self.stage_category_combo.addItems(["Статика", "Динамика", "Зип"])
         form_layout.addRow(QLabel("Категория:"), self.stage_category_combo)
 
+        # Длина, по которой считается себестоимость этапа
+        self.stage_length_spin = QDoubleSpinBox()
+        self.stage_length_spin.setRange(0.01, 1000.0)
+        self.stage_length_spin.setDecimals(2)
+        self.stage_length_spin.setValue(1.0)
+        form_layout.addRow(QLabel("Длина по умолчанию (м):"), self.stage_length_spin)
+
         self.stage_description_input = QTextEdit()
         self.stage_description_input.setPlaceholderText("Описание этапа работ...")
         self.stage_description_input.setMaximumHeight(60)
@@ -602,6 +623,7 @@ class StagesTab(QWidget):
             cursor.execute("UPDATE stages SET category = ? WHERE id = ?", (new_category, stage_id))
             conn.commit()
             conn.close()
+            self.catalog.refresh_stages([stage_id])
         except Exception as e:
             QMessageBox.critical(self, "Ошибка", f"Не удалось обновить категорию: {str(e)}")
             self.load_stages()
@@ -645,16 +667,16 @@ class StagesTab(QWidget):
 
             elif column == 5:  # Длина
                 new_length_text = self.stage_materials_table.item(row, column).text().strip()
-                new_length = float(new_length_text) if new_length_text else None
+                new_length_mm = CuttingOptimizer.to_mm(new_length_text) if new_length_text else None
 
-                if new_length is not None and new_length < 0:
+                if new_length_mm is not None and new_length_mm < 0:
                     QMessageBox.warning(self, "Ошибка", "Длина не может быть отрицательной")
                     self.load_stage_materials()
                     return
 
                 conn = sqlite3.connect(self.db_path)
                 cursor = conn.cursor()
-                cursor.execute("UPDATE stage_materials SET length = ? WHERE id = ?", (new_length, sm_id))
+                cursor.execute("UPDATE stage_materials SET length_mm = ? WHERE id = ?", (new_length_mm, sm_id))
                 conn.commit()
                 conn.close()
 
@@ -685,6 +707,7 @@ class StagesTab(QWidget):
                 cursor.execute("UPDATE stages SET name = ? WHERE id = ?", (new_name, stage_id))
                 conn.commit()
                 conn.close()
+                self.catalog.refresh_stages([stage_id])
 
             elif column == 4:  # Описание этапа
                 new_description = self.stages_table.item(row, column).text()
@@ -694,6 +717,25 @@ class StagesTab(QWidget):
                 conn.commit()
                 conn.close()
 
+            elif column == 5:  # Длина по умолчанию
+                new_length = float(self.stages_table.item(row, column).text().replace(',', '.'))
+                if new_length <= 0:
+                    QMessageBox.warning(self, "Ошибка", "Длина этапа должна быть больше 0")
+                    self.load_stages()
+                    return
+
+                conn = sqlite3.connect(self.db_path)
+                cursor = conn.cursor()
+                cursor.execute("UPDATE stages SET default_length_m = ? WHERE id = ?", (new_length, stage_id))
+                conn.commit()
+                conn.close()
+
+                if stage_id == self.selected_stage_id:
+                    self.calculate_stage_cost()
+                else:
+                    self.store_stage_costs([stage_id])
+                    self.load_stages()
+
         except Exception as e:
             QMessageBox.critical(self, "Ошибка", f"Ошибка при обновлении: {str(e)}")
             self.load_stages()
@@ -702,14 +744,14 @@ class StagesTab(QWidget):
         """Загружает список этапов с категориями"""
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
-        cursor.execute("SELECT id, name, category, cost, description FROM stages ORDER BY name")
+        cursor.execute("SELECT id, name, category, cost, description, default_length_m FROM stages ORDER BY name")
         stages = cursor.fetchall()
         conn.close()
 
         self.stages_table.setRowCount(len(stages))
         self.stages_table.cellChanged.disconnect()
 
-        for row_idx, (stage_id, stage_name, category, cost, description) in enumerate(stages):
+        for row_idx, (stage_id, stage_name, category, cost, description, default_length) in enumerate(stages):
             # ID (только для чтения)
             id_item = QTableWidgetItem(str(stage_id))
             id_item.setFlags(id_item.flags() ^ Qt.ItemIsEditable)
@@ -735,6 +777,9 @@ class StagesTab(QWidget):
             # Описание (редактируемое)
             self.stages_table.setItem(row_idx, 4, QTableWidgetItem(description or ""))
 
+            # Длина по умолчанию (редактируемое)
+            self.stages_table.setItem(row_idx, 5, QTableWidgetItem(f"{default_length:.2f}"))
+
         self.stages_table.cellChanged.connect(self.on_stage_cell_edited)
 
     def load_stage_products(self):
@@ -782,10 +827,10 @@ class StagesTab(QWidget):
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         cursor.execute("""
-            SELECT sm.id, m.name, m.type, sm.part, sm.quantity, sm.length, m.price,
+            SELECT sm.id, m.name, m.type, sm.part, sm.quantity, sm.length_mm, m.price,
                    CASE 
-                       WHEN m.type = 'Пиломатериал' AND sm.length IS NOT NULL 
-                       THEN (m.price * sm.quantity * sm.length)
+                       WHEN m.type = 'Пиломатериал' AND sm.length_mm IS NOT NULL 
+                       THEN (m.price * sm.quantity * sm.length_mm / 1000.0)
                        ELSE (m.price * sm.quantity)
                    END as total_cost
             FROM stage_materials sm
@@ -798,7 +843,7 @@ class StagesTab(QWidget):
         self.stage_materials_table.cellChanged.disconnect()
         self.stage_materials_table.setRowCount(len(stage_materials))
 
-        for row_idx, (sm_id, mat_name, mat_type, part, quantity, length, price, total_cost) in enumerate(
+        for row_idx, (sm_id, mat_name, mat_type, part, quantity, length_mm, price, total_cost) in enumerate(
                 stage_materials):
             id_item = QTableWidgetItem(str(sm_id))
             id_item.setFlags(id_item.flags() ^ Qt.ItemIsEditable)
@@ -815,7 +860,7 @@ class StagesTab(QWidget):
             self.stage_materials_table.setItem(row_idx, 3, QTableWidgetItem(part))
             self.stage_materials_table.setItem(row_idx, 4, QTableWidgetItem(str(quantity)))
 
-            length_item = QTableWidgetItem(str(length) if length else "")
+            length_item = QTableWidgetItem(CuttingOptimizer.format_m(length_mm) if length_mm else "")
             if mat_type == "Метиз":
                 length_item.setFlags(length_item.flags() ^ Qt.ItemIsEditable)
             self.stage_materials_table.setItem(row_idx, 5, length_item)
@@ -827,65 +872,35 @@ class StagesTab(QWidget):
         self.stage_materials_table.cellChanged.connect(self.on_stage_material_cell_edited)
 
     def calculate_stage_cost(self):
-        """Расчет себестоимости этапа произвольной длины с округлением позиций"""
+        """Расчет себестоимости этапа по его длине по умолчанию с округлением позиций"""
         if not self.selected_stage_id:
             return
 
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
         try:
-            # Получаем длину этапа, если есть
-            cursor.execute("SELECT description FROM stages WHERE id = ?", (self.selected_stage_id,))
-            row = cursor.fetchone()
-            length = 1
-            if row and row[0]:
-                try:
-                    # В описании может быть указана длина, например: "Длина: 5"
-                    import re
-                    m = re.search(r"Длина\s*:\s*([\d.]+)", row[0])
-                    if m:
-                        length = float(m.group(1))
-                except Exception:
-                    length = 1
-
-            # Считаем изделия
-            cursor.execute("""
-                SELECT sp.part, p.cost, sp.quantity
-                FROM stage_products sp
-                JOIN products p ON sp.product_id = p.id
-                WHERE sp.stage_id = ?
-            """, (self.selected_stage_id,))
-            total_cost = 0.0
-            for part, pcost, qty in cursor.fetchall():
-                multiplier = length if part == 'meter' else 1
-                qty_total = math.ceil(qty * multiplier)
-                total_cost += pcost * qty_total
-
-            # Считаем материалы
-            cursor.execute("""
-                SELECT sm.part, m.type, m.price, sm.quantity, sm.length
-                FROM stage_materials sm
-                JOIN materials m ON sm.material_id = m.id
-                WHERE sm.stage_id = ?
-            """, (self.selected_stage_id,))
-            for part, mtype, price, qty, length_val in cursor.fetchall():
-                multiplier = length if part == 'meter' else 1
-                qty_total = math.ceil(qty * multiplier)
-                if mtype == "Пиломатериал" and length_val:
-                    total_cost += price * qty_total * length_val
-                else:
-                    total_cost += price * qty_total
-
-            # Отображение и запись в stages.cost
-            self.cost_label.setText(f"Себестоимость этапа (1м): {total_cost:.2f} руб")
-            cursor.execute("UPDATE stages SET cost = ? WHERE id = ?", (total_cost, self.selected_stage_id))
-            conn.commit()
+            length, total_cost = self.store_stage_costs([self.selected_stage_id])[self.selected_stage_id]
+            self.cost_label.setText(f"Себестоимость этапа ({length:.2f} м): {total_cost:.2f} руб")
             self.load_stages()
         except Exception as e:
             QMessageBox.critical(self, "Ошибка расчета", f"Произошла ошибка: {str(e)}")
+
+    def store_stage_costs(self, stage_ids=None):
+        """
+        Пересчитывает себестоимость этапов по длине по умолчанию, записывает ее
+        в stages.cost и сообщает вкладкам. Единый путь для всех пересчетов этапов.
+
+        :param stage_ids: Этапы; None - все
+        :return: {id этапа: (длина в м, себестоимость)}
+        """
+        costs = StagePriceCache(self.db_path, self.catalog.costs).default_costs(stage_ids)
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.executemany("UPDATE stages SET cost = ? WHERE id = ?",
+                             [(cost, stage_id) for stage_id, (_, cost) in costs.items()])
+            conn.commit()
         finally:
             conn.close()
+        self.catalog.refresh_stages(list(costs))
+        return costs
 
     # Остальные методы без изменений
     def on_stage_selected(self, row, col):
@@ -914,33 +929,20 @@ class StagesTab(QWidget):
         except Exception as e:
             QMessageBox.critical(self, "Ошибка выбора", f"Произошла ошибка: {str(e)}")
 
-    def load_products(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, name FROM products ORDER BY name")
-        products = cursor.fetchall()
-        conn.close()
-
-        self.product_combo.clear()
-        for prod_id, prod_name in products:
-            self.product_combo.addItem(prod_name, prod_id)
-
-    def load_materials(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, name, type FROM materials ORDER BY name")
-        materials = cursor.fetchall()
-        conn.close()
+    def load_products(self, changed_ids=None):
+        sync_combo(self.product_combo, self.catalog.product_list(), changed_ids)
 
-        self.material_combo.clear()
-        for mat_id, mat_name, mat_type in materials:
-            self.material_combo.addItem(f"{mat_name} ({mat_type})", mat_id)
+    def load_materials(self, changed_ids=None):
+        sync_combo(self.material_combo, [(mat_id, f"{mat_name} ({mat_type})")
+                                         for mat_id, mat_name, mat_type in self.catalog.material_list()],
+                   changed_ids)
 
     def add_stage(self):
         """Добавляет этап с категорией"""
         name = self.stage_name_input.text().strip()
         category = self.stage_category_combo.currentText()
         description = self.stage_description_input.toPlainText().strip()
+        default_length = self.stage_length_spin.value()
 
         if not name:
             QMessageBox.warning(self, "Ошибка", "Введите название этапа")
@@ -950,10 +952,11 @@ class StagesTab(QWidget):
         cursor = conn.cursor()
         try:
             cursor.execute(
-                "INSERT INTO stages (name, category, description) VALUES (?, ?, ?)",
-                (name, category, description)
+                "INSERT INTO stages (name, category, description, default_length_m) VALUES (?, ?, ?, ?)",
+                (name, category, description, default_length)
             )
             conn.commit()
+            self.catalog.refresh_stages([cursor.lastrowid])
             self.load_stages()
             self.stage_name_input.clear()
             self.stage_description_input.clear()
@@ -984,6 +987,7 @@ class StagesTab(QWidget):
                 cursor.execute("DELETE FROM stage_materials WHERE stage_id = ?", (stage_id,))
                 cursor.execute("DELETE FROM stages WHERE id = ?", (stage_id,))
                 conn.commit()
+                self.catalog.refresh_stages([stage_id])
                 self.load_stages()
                 self.composition_group.setEnabled(False)
                 QMessageBox.information(self, "Успех", "Этап удален")
@@ -1059,7 +1063,7 @@ class StagesTab(QWidget):
             return
 
         try:
-            length_val = float(length) if length else None
+            length_mm = CuttingOptimizer.to_mm(length) if length else None
         except ValueError:
             QMessageBox.warning(self, "Ошибка", "Длина должна быть числом")
             return
@@ -1068,8 +1072,8 @@ class StagesTab(QWidget):
         cursor = conn.cursor()
         try:
             cursor.execute(
-                "INSERT INTO stage_materials (stage_id, material_id, quantity, length, part) VALUES (?, ?, ?, ?, ?)",
-                (self.selected_stage_id, material_id, quantity, length_val, part)
+                "INSERT INTO stage_materials (stage_id, material_id, quantity, length_mm, part) VALUES (?, ?, ?, ?, ?)",
+                (self.selected_stage_id, material_id, quantity, length_mm, part)
             )
             conn.commit()
             self.load_stage_materials()
@@ -1104,44 +1108,11 @@ class StagesTab(QWidget):
             QMessageBox.information(self, "Успех", "Материал удален из этапа")
 
     def recalculate_all_stages_cost(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        """Себестоимость всех этапов по длине по умолчанию - один проход по составу всех этапов"""
         try:
-            cursor.execute("SELECT id FROM stages")
-            stage_ids = [row[0] for row in cursor.fetchall()]
-
-            for stage_id in stage_ids:
-                cursor.execute("""
-                    SELECT SUM(p.cost * sp.quantity) as products_cost
-                    FROM stage_products sp
-                    JOIN products p ON sp.product_id = p.id
-                    WHERE sp.stage_id = ?
-                """, (stage_id,))
-                products_cost = cursor.fetchone()[0] or 0
-
-                cursor.execute("""
-                    SELECT sm.quantity, sm.length, m.price, m.type
-                    FROM stage_materials sm
-                    JOIN materials m ON sm.material_id = m.id
-                    WHERE sm.stage_id = ?
-                """, (stage_id,))
-
-                materials_cost = 0
-                for quantity, length, price, material_type in cursor.fetchall():
-                    if material_type == "Пиломатериал" and length:
-                        materials_cost += price * quantity * length
-                    else:
-                        materials_cost += price * quantity
-
-                total_cost = products_cost + materials_cost
-                cursor.execute("UPDATE stages SET cost = ? WHERE id = ?", (total_cost, stage_id))
-
-            conn.commit()
+            self.store_stage_costs()
         except Exception as e:
             print(f"Ошибка при пересчете себестоимости этапов: {str(e)}")
-            conn.rollback()
-        finally:
-            conn.close()
 
     def filter_table(self, text: str):
         """Скрывает строки, где не найден текст ни в одной ячейке."""
@@ -1157,9 +1128,10 @@ class StagesTab(QWidget):
 
 # КЛАСС МАТЕРИАЛОВ С АВТОЗАПОЛНЕНИЕМ
 class MaterialsTab(QWidget):
-    def __init__(self, db_path):
+    def __init__(self, db_path, catalog=None):
         super().__init__()
         self.db_path = db_path
+        self.catalog = catalog if catalog is not None else Catalog(db_path)
         self.init_ui()
         self.load_data()
 
@@ -1213,6 +1185,40 @@ class MaterialsTab(QWidget):
         btn_layout.addWidget(self.delete_btn)
 
         layout.addLayout(btn_layout)
+
+        # Стандартные длины для планирования закупки
+        self.standard_group = QGroupBox("Стандартные длины для закупки")
+        self.standard_group.setEnabled(False)
+        standard_layout = QVBoxLayout()
+
+        self.standard_table = QTableWidget()
+        self.standard_table.setColumnCount(3)
+        self.standard_table.setHorizontalHeaderLabels(["ID", "Длина (м)", "Цена за шт"])
+        self.standard_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.standard_table.setMaximumHeight(150)
+        standard_layout.addWidget(self.standard_table)
+
+        standard_form = QHBoxLayout()
+        self.standard_length_input = QLineEdit()
+        self.standard_length_input.setPlaceholderText("Длина, м (6.0)")
+        standard_form.addWidget(self.standard_length_input)
+
+        self.standard_price_input = QLineEdit()
+        self.standard_price_input.setPlaceholderText("Цена за доску")
+        standard_form.addWidget(self.standard_price_input)
+
+        self.add_standard_btn = QPushButton("Добавить длину")
+        self.add_standard_btn.clicked.connect(self.add_standard_length)
+        standard_form.addWidget(self.add_standard_btn)
+
+        self.delete_standard_btn = QPushButton("Удалить длину")
+        self.delete_standard_btn.clicked.connect(self.delete_standard_length)
+        standard_form.addWidget(self.delete_standard_btn)
+
+        standard_layout.addLayout(standard_form)
+        self.standard_group.setLayout(standard_layout)
+        layout.addWidget(self.standard_group)
+
         self.setLayout(layout)
 
         self.table.cellClicked.connect(self.on_table_cell_clicked)
@@ -1243,9 +1249,78 @@ class MaterialsTab(QWidget):
                 else:
                     self.unit_label.setText("шт")
 
+                # Стандартные длины есть только у пиломатериалов
+                self.standard_group.setEnabled(m_type == "Пиломатериал")
+                self.load_standard_lengths()
+
         except Exception as e:
             QMessageBox.critical(self, "Ошибка", f"Произошла ошибка при выборе материала: {str(e)}")
 
+    def load_standard_lengths(self):
+        """Загружает стандартные длины для закупки выбранного материала"""
+        self.standard_table.setRowCount(0)
+        if not hasattr(self, 'selected_material_id'):
+            return
+
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, length_mm, price FROM standard_lengths WHERE material_id = ? ORDER BY length_mm",
+                       (self.selected_material_id,))
+        rows = cursor.fetchall()
+        conn.close()
+
+        self.standard_table.setRowCount(len(rows))
+        for row_idx, (std_id, length_mm, price) in enumerate(rows):
+            for col_idx, text in enumerate((str(std_id), CuttingOptimizer.format_m(length_mm), f"{price:.2f}")):
+                item = QTableWidgetItem(text)
+                item.setFlags(item.flags() ^ Qt.ItemIsEditable)
+                self.standard_table.setItem(row_idx, col_idx, item)
+
+    def add_standard_length(self):
+        if not hasattr(self, 'selected_material_id'):
+            QMessageBox.warning(self, "Ошибка", "Выберите материал")
+            return
+
+        try:
+            length_mm = CuttingOptimizer.to_mm(self.standard_length_input.text().strip())
+            price_val = float(self.standard_price_input.text().strip())
+        except ValueError:
+            QMessageBox.warning(self, "Ошибка", "Длина и цена должны быть числами")
+            return
+
+        if length_mm <= 0 or price_val < 0:
+            QMessageBox.warning(self, "Ошибка", "Длина должна быть больше 0, цена - не отрицательной")
+            return
+
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""INSERT INTO standard_lengths (material_id, length_mm, price) VALUES (?, ?, ?)
+                              ON CONFLICT(material_id, length_mm) DO UPDATE SET price = excluded.price""",
+                           (self.selected_material_id, length_mm, price_val))
+            conn.commit()
+            self.standard_length_input.clear()
+            self.standard_price_input.clear()
+            self.load_standard_lengths()
+        except sqlite3.Error as e:
+            QMessageBox.critical(self, "Ошибка базы данных", str(e))
+        finally:
+            conn.close()
+
+    def delete_standard_length(self):
+        selected_row = self.standard_table.currentRow()
+        if selected_row == -1:
+            QMessageBox.warning(self, "Ошибка", "Выберите длину для удаления")
+            return
+
+        std_id = int(self.standard_table.item(selected_row, 0).text())
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM standard_lengths WHERE id = ?", (std_id,))
+        conn.commit()
+        conn.close()
+        self.load_standard_lengths()
+
     def edit_material(self):
         if not hasattr(self, 'selected_material_id'):
             QMessageBox.warning(self, "Ошибка", "Выберите материал для редактирования")
@@ -1280,8 +1355,10 @@ class MaterialsTab(QWidget):
             cursor.execute("UPDATE materials SET name = ?, type = ?, price = ?, unit = ? WHERE id = ?",
                            (name, m_type, price_val, unit, self.selected_material_id))
             conn.commit()
-            self.recalculate_products_with_material(self.selected_material_id)
+            updated_products = self.recalculate_products_with_material(self.selected_material_id)
             conn.close()
+            self.catalog.refresh_materials([self.selected_material_id])
+            self.catalog.refresh_products(updated_products)
             self.load_data()
             self.clear_form()
             QMessageBox.information(self, "Успех", "Материал обновлен!")
@@ -1291,41 +1368,31 @@ class MaterialsTab(QWidget):
             conn.close()
 
     def recalculate_products_with_material(self, material_id):
+        """Пересчитывает себестоимость изделий с материалом; возвращает id пересчитанных"""
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
+        updated_ids = []
         try:
             cursor.execute("SELECT DISTINCT product_id FROM product_composition WHERE material_id = ?", (material_id,))
             product_ids = [row[0] for row in cursor.fetchall()]
 
-            for product_id in product_ids:
-                cursor.execute("""SELECT m.price, pc.quantity, pc.length
-                               FROM product_composition pc
-                               JOIN materials m ON pc.material_id = m.id
-                               WHERE pc.product_id = ?""", (product_id,))
-                composition = cursor.fetchall()
-
-                total_cost = 0
-                for row in composition:
-                    price, quantity, length = row
-                    if length:
-                        total_cost += price * quantity * length
-                    else:
-                        total_cost += price * quantity
-
-                cursor.execute("UPDATE products SET cost = ? WHERE id = ?", (total_cost, product_id))
-
+            # Изделия с материалом и все изделия, куда они входят узлами
+            updated_ids = rollup_costs(cursor, product_ids)
             conn.commit()
         except Exception as e:
             print(f"Ошибка при пересчете себестоимости: {str(e)}")
             conn.rollback()
         finally:
             conn.close()
+        return updated_ids
 
     def clear_form(self):
         self.name_input.clear()
         self.price_input.clear()
         if hasattr(self, 'selected_material_id'):
             delattr(self, 'selected_material_id')
+        self.standard_group.setEnabled(False)
+        self.standard_table.setRowCount(0)
 
     def load_data(self):
         conn = sqlite3.connect(self.db_path)
@@ -1367,6 +1434,7 @@ class MaterialsTab(QWidget):
                            (name, m_type, price_val, unit))
             conn.commit()
             conn.close()
+            self.catalog.refresh_materials([cursor.lastrowid])
             self.load_data()
             self.name_input.clear()
             self.price_input.clear()
@@ -1391,6 +1459,7 @@ class MaterialsTab(QWidget):
             cursor.execute("DELETE FROM materials WHERE id = ?", (material_id,))
             conn.commit()
             conn.close()
+            self.catalog.refresh_materials([material_id])
             self.load_data()
             QMessageBox.information(self, "Успех", "Материал удален")
 
@@ -1408,15 +1477,18 @@ class MaterialsTab(QWidget):
 
 # КЛАСС ИЗДЕЛИЙ С АВТОЗАПОЛНЕНИЕМ
 class ProductsTab(QWidget):
-    def __init__(self, db_path, main_window=None):
+    def __init__(self, db_path, main_window=None, catalog=None):
         super().__init__()
         self.db_path = db_path
         self.main_window = main_window
+        self.catalog = catalog if catalog is not None else Catalog(db_path)
         self.selected_product_id = None
         self.selected_product_name = None
         self.init_ui()
         self.load_products()
 
+        self.catalog.materials_changed.connect(self.load_materials)
+
     def init_ui(self):
         main_layout = QVBoxLayout()
 
@@ -1491,6 +1563,34 @@ class ProductsTab(QWidget):
 
         add_form_layout.addRow(comp_btn_layout)
         composition_layout.addLayout(add_form_layout)
+
+        # Вложенные изделия (узлы): площадка, секция лестницы и т.п.
+        self.subproducts_table = QTableWidget()
+        self.subproducts_table.setColumnCount(3)
+        self.subproducts_table.setHorizontalHeaderLabels(["ID", "Узел (изделие)", "Количество"])
+        self.subproducts_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        composition_layout.addWidget(self.subproducts_table)
+
+        subproduct_form_layout = QFormLayout()
+        self.subproduct_combo = QComboBox()
+        subproduct_form_layout.addRow(QLabel("Узел:"), self.subproduct_combo)
+
+        self.subproduct_quantity_spin = QSpinBox()
+        self.subproduct_quantity_spin.setRange(1, 1000)
+        subproduct_form_layout.addRow(QLabel("Количество:"), self.subproduct_quantity_spin)
+
+        subproduct_btn_layout = QHBoxLayout()
+        self.add_subproduct_btn = QPushButton("Добавить узел")
+        self.add_subproduct_btn.clicked.connect(self.add_subproduct)
+        subproduct_btn_layout.addWidget(self.add_subproduct_btn)
+
+        self.remove_subproduct_btn = QPushButton("Удалить узел")
+        self.remove_subproduct_btn.clicked.connect(self.remove_subproduct)
+        subproduct_btn_layout.addWidget(self.remove_subproduct_btn)
+
+        subproduct_form_layout.addRow(subproduct_btn_layout)
+        composition_layout.addLayout(subproduct_form_layout)
+
         self.cost_label = QLabel("Себестоимость: 0.00 руб")
         composition_layout.addWidget(self.cost_label)
         self.composition_group.setLayout(composition_layout)
@@ -1541,24 +1641,10 @@ class ProductsTab(QWidget):
             cursor.execute("SELECT id FROM products")
             product_ids = [row[0] for row in cursor.fetchall()]
 
-            for product_id in product_ids:
-                cursor.execute("""SELECT m.price, pc.quantity, pc.length
-                               FROM product_composition pc
-                               JOIN materials m ON pc.material_id = m.id
-                               WHERE pc.product_id = ?""", (product_id,))
-                composition = cursor.fetchall()
-
-                total_cost = 0
-                for row in composition:
-                    price, quantity, length = row
-                    if length:
-                        total_cost += price * quantity * length
-                    else:
-                        total_cost += price * quantity
-
-                cursor.execute("UPDATE products SET cost = ? WHERE id = ?", (total_cost, product_id))
-
+            # Узлы пересчитываются раньше изделий, в которые они входят
+            rollup_costs(cursor, product_ids)
             conn.commit()
+            self.catalog.refresh_products(product_ids)
         except Exception as e:
             print(f"Ошибка при пересчете себестоимости: {str(e)}")
             conn.rollback()
@@ -1597,6 +1683,7 @@ class ProductsTab(QWidget):
 
             self.load_materials()
             self.load_composition()
+            self.load_subproducts()
 
             try:
                 self.calculate_product_cost()
@@ -1606,21 +1693,15 @@ class ProductsTab(QWidget):
         except Exception as e:
             QMessageBox.critical(self, "Ошибка выбора", f"Произошла ошибка: {str(e)}")
 
-    def load_materials(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, name, type FROM materials ORDER BY name")
-        materials = cursor.fetchall()
-        conn.close()
-
-        self.material_combo.clear()
-        for mat_id, mat_name, mat_type in materials:
-            self.material_combo.addItem(f"{mat_name} ({mat_type})", mat_id)
+    def load_materials(self, changed_ids=None):
+        sync_combo(self.material_combo, [(mat_id, f"{mat_name} ({mat_type})")
+                                         for mat_id, mat_name, mat_type in self.catalog.material_list()],
+                   changed_ids)
 
     def load_composition(self):
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
-        cursor.execute("""SELECT pc.id, m.name, m.type, pc.quantity, pc.length   
+        cursor.execute("""SELECT pc.id, m.name, m.type, pc.quantity, pc.length_mm
                         FROM product_composition pc
                         JOIN materials m ON pc.material_id = m.id
                         WHERE pc.product_id = ?""", (self.selected_product_id,))
@@ -1628,12 +1709,86 @@ class ProductsTab(QWidget):
         conn.close()
 
         self.composition_table.setRowCount(len(composition))
-        for row_idx, (comp_id, mat_name, mat_type, quantity, length) in enumerate(composition):
+        for row_idx, (comp_id, mat_name, mat_type, quantity, length_mm) in enumerate(composition):
             self.composition_table.setItem(row_idx, 0, QTableWidgetItem(str(comp_id)))
             self.composition_table.setItem(row_idx, 1, QTableWidgetItem(mat_name))
             self.composition_table.setItem(row_idx, 2, QTableWidgetItem(mat_type))
             self.composition_table.setItem(row_idx, 3, QTableWidgetItem(str(quantity)))
-            self.composition_table.setItem(row_idx, 4, QTableWidgetItem(str(length) if length else ""))
+            self.composition_table.setItem(row_idx, 4, QTableWidgetItem(
+                CuttingOptimizer.format_m(length_mm) if length_mm else ""))
+
+    def load_subproducts(self):
+        """Узлы выбранного изделия и список изделий, которые можно добавить узлом"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute("""SELECT pp.id, p.name, pp.quantity
+                        FROM product_products pp
+                        JOIN products p ON pp.child_product_id = p.id
+                        WHERE pp.parent_product_id = ?""", (self.selected_product_id,))
+        subproducts = cursor.fetchall()
+        cursor.execute("SELECT id, name FROM products WHERE id != ? ORDER BY name", (self.selected_product_id,))
+        products = cursor.fetchall()
+        conn.close()
+
+        self.subproducts_table.setRowCount(len(subproducts))
+        for row_idx, (link_id, child_name, quantity) in enumerate(subproducts):
+            self.subproducts_table.setItem(row_idx, 0, QTableWidgetItem(str(link_id)))
+            self.subproducts_table.setItem(row_idx, 1, QTableWidgetItem(child_name))
+            self.subproducts_table.setItem(row_idx, 2, QTableWidgetItem(str(quantity)))
+
+        self.subproduct_combo.clear()
+        for prod_id, prod_name in products:
+            self.subproduct_combo.addItem(prod_name, prod_id)
+
+    def add_subproduct(self):
+        if self.selected_product_id is None:
+            QMessageBox.warning(self, "Ошибка", "Сначала выберите изделие")
+            return
+
+        child_id = self.subproduct_combo.currentData()
+        if not child_id:
+            QMessageBox.warning(self, "Ошибка", "Выберите изделие-узел")
+            return
+
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        try:
+            if would_create_cycle(cursor, self.selected_product_id, child_id):
+                QMessageBox.warning(self, "Ошибка",
+                                    "Это изделие уже содержит выбранное - узел замкнул бы состав в цикл")
+                return
+            cursor.execute("""INSERT INTO product_products (parent_product_id, child_product_id, quantity)
+                            VALUES (?, ?, ?)
+                            ON CONFLICT(parent_product_id, child_product_id)
+                            DO UPDATE SET quantity = quantity + excluded.quantity""",
+                           (self.selected_product_id, child_id, self.subproduct_quantity_spin.value()))
+            conn.commit()
+        except Exception as e:
+            QMessageBox.critical(self, "Ошибка базы данных", str(e))
+            return
+        finally:
+            conn.close()
+
+        self.load_subproducts()
+        self.calculate_product_cost()
+        self.load_products()
+
+    def remove_subproduct(self):
+        selected_row = self.subproducts_table.currentRow()
+        if selected_row == -1:
+            QMessageBox.warning(self, "Ошибка", "Выберите узел для удаления")
+            return
+
+        link_id = int(self.subproducts_table.item(selected_row, 0).text())
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM product_products WHERE id = ?", (link_id,))
+        conn.commit()
+        conn.close()
+
+        self.load_subproducts()
+        self.calculate_product_cost()
+        self.load_products()
 
     def add_product(self):
         name = self.product_name_input.text().strip()
@@ -1646,6 +1801,7 @@ class ProductsTab(QWidget):
         try:
             cursor.execute("INSERT INTO products (name) VALUES (?)", (name,))
             conn.commit()
+            self.catalog.refresh_products([cursor.lastrowid])
             self.load_products()
             self.product_name_input.clear()
             QMessageBox.information(self, "Успех", "Изделие добавлено!")
@@ -1671,9 +1827,17 @@ class ProductsTab(QWidget):
             conn = sqlite3.connect(self.db_path)
             cursor = conn.cursor()
             try:
+                cursor.execute("SELECT parent_product_id FROM product_products WHERE child_product_id = ?",
+                               (product_id,))
+                parent_ids = [row[0] for row in cursor.fetchall()]
                 cursor.execute("DELETE FROM product_composition WHERE product_id = ?", (product_id,))
+                cursor.execute("DELETE FROM product_products WHERE parent_product_id = ? OR child_product_id = ?",
+                               (product_id, product_id))
                 cursor.execute("DELETE FROM products WHERE id = ?", (product_id,))
+                # Изделия, куда удаленное входило узлом, дешевеют
+                updated_ids = rollup_costs(cursor, parent_ids)
                 conn.commit()
+                self.catalog.refresh_products([product_id] + updated_ids)
                 self.load_products()
                 self.composition_group.setEnabled(False)
                 self.composition_table.setRowCount(0)
@@ -1698,7 +1862,7 @@ class ProductsTab(QWidget):
 
         try:
             quantity_val = int(quantity)
-            length_val = float(length) if length else None
+            length_mm = CuttingOptimizer.to_mm(length) if length else None
         except ValueError:
             QMessageBox.warning(self, "Ошибка", "Количество должно быть целым числом, длина - числом")
             return
@@ -1707,8 +1871,8 @@ class ProductsTab(QWidget):
         cursor = conn.cursor()
         try:
             cursor.execute(
-                "INSERT INTO product_composition (product_id, material_id, quantity, length) VALUES (?, ?, ?, ?)",
-                (self.selected_product_id, material_id, quantity_val, length_val))
+                "INSERT INTO product_composition (product_id, material_id, quantity, length_mm) VALUES (?, ?, ?, ?)",
+                (self.selected_product_id, material_id, quantity_val, length_mm))
             conn.commit()
             self.load_composition()
             self.calculate_product_cost()
@@ -1749,29 +1913,14 @@ class ProductsTab(QWidget):
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         try:
-            cursor.execute("""SELECT m.price, pc.quantity, pc.length
-                           FROM product_composition pc
-                           JOIN materials m ON pc.material_id = m.id
-                           WHERE pc.product_id = ?""", (self.selected_product_id,))
-            composition = cursor.fetchall()
-
-            total_cost = 0
-            for row in composition:
-                price, quantity, length = row
-                if length:
-                    total_cost += price * quantity * length
-                else:
-                    total_cost += price * quantity
-
-            self.cost_label.setText(f"Себестоимость: {total_cost:.2f} руб")
-
-            cursor.execute("UPDATE products SET cost = ? WHERE id = ?", (total_cost, self.selected_product_id))
+            # Пересчитываются изделие и все изделия, в которые оно входит узлом
+            updated_ids = rollup_costs(cursor, [self.selected_product_id])
             conn.commit()
 
-            if self.main_window and hasattr(self.main_window, 'orders_tab'):
-                if hasattr(self.main_window.orders_tab, 'product_cost_cache'):
-                    if self.selected_product_id in self.main_window.orders_tab.product_cost_cache:
-                        del self.main_window.orders_tab.product_cost_cache[self.selected_product_id]
+            # Состав и себестоимость изменились - каталог оповестит вкладки и кэши
+            self.catalog.refresh_products(updated_ids)
+            total_cost = self.catalog.products[self.selected_product_id][1]
+            self.cost_label.setText(f"Себестоимость: {total_cost:.2f} руб")
 
         except Exception as e:
             QMessageBox.critical(self, "Ошибка расчета", f"Произошла ошибка: {str(e)}")
@@ -1791,10 +1940,11 @@ class ProductsTab(QWidget):
 
 
 class WarehouseTab(QWidget):
-    def __init__(self, db_path, main_window):
+    def __init__(self, db_path, main_window, catalog=None):
         super().__init__()
         self.db_path = db_path
         self.main_window = main_window
+        self.catalog = catalog if catalog is not None else Catalog(db_path)
         self.repo_root = self.find_git_root(db_path)
         self.init_ui()
         self.load_data()
@@ -1821,6 +1971,7 @@ class WarehouseTab(QWidget):
         # Выбор материала
         self.material_combo = QComboBox()
         self.load_materials()
+        self.catalog.materials_changed.connect(self.load_materials)
         add_layout.addRow(QLabel("Материал:"), self.material_combo)
 
         # Длина
@@ -1844,7 +1995,7 @@ class WarehouseTab(QWidget):
         # Таблица склада
         self.table = QTableWidget()
         self.table.setColumnCount(4)
-        self.table.setHorizontalHeaderLabels(["ID", "Материал", "Длина", "Количество"])
+        self.table.setHorizontalHeaderLabels(["ID", "Материал", "Длина (м)", "Количество"])
         self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
         main_layout.addWidget(self.table)
 
@@ -1951,16 +2102,19 @@ class WarehouseTab(QWidget):
                                          f"Ошибка при получении изменений:\n{result.stderr}")
                     return
 
-            # Восстанавливаем файл базы данных из последнего коммита
-            db_relative_path = os.path.relpath(self.db_path, self.repo_root)
+            # Берем текстовый снимок из последнего коммита (файлы удаленных таблиц тоже убираются)
+            dump_dir = default_dump_dir(self.db_path)
+            dump_relative_path = os.path.relpath(dump_dir, self.repo_root)
 
-            result = subprocess.run(['git', 'checkout', 'origin/master', '--', db_relative_path],
+            result = subprocess.run(['git', 'checkout', '--no-overlay', 'origin/master', '--', dump_relative_path],
                                     cwd=self.repo_root,
                                     capture_output=True,
                                     text=True,
                                     timeout=30)
 
             if result.returncode == 0:
+                # База собирается из снимка заново одной транзакцией
+                load_dump(dump_dir, self.db_path)
                 QMessageBox.information(self, "Успех",
                                         "База данных успешно обновлена из репозитория")
                 # Обновляем все вкладки
@@ -1992,11 +2146,13 @@ class WarehouseTab(QWidget):
             return
 
         try:
-            # Определяем относительный путь к базе данных
-            db_relative_path = os.path.relpath(self.db_path, self.repo_root)
+            # В репозиторий идет текстовый снимок базы: Git хранит только изменившиеся строки
+            dump_dir = default_dump_dir(self.db_path)
+            dump_database(self.db_path, dump_dir)
+            dump_relative_path = os.path.relpath(dump_dir, self.repo_root)
 
-            # Добавляем файл базы данных в индекс
-            result = subprocess.run(['git', 'add', db_relative_path],
+            # Добавляем снимок в индекс (вместе с удалением файлов исчезнувших таблиц)
+            result = subprocess.run(['git', 'add', '-A', '--', dump_relative_path],
                                     cwd=self.repo_root,
                                     capture_output=True,
                                     text=True,
@@ -2022,7 +2178,7 @@ class WarehouseTab(QWidget):
                     return
 
             # Проверяем есть ли изменения для коммита
-            result = subprocess.run(['git', 'status', '--porcelain', db_relative_path],
+            result = subprocess.run(['git', 'status', '--porcelain', dump_relative_path],
                                     cwd=self.repo_root,
                                     capture_output=True,
                                     text=True,
@@ -2053,6 +2209,18 @@ class WarehouseTab(QWidget):
                                     text=True,
                                     timeout=60)
 
+            if result.returncode != 0 and "rejected" in result.stderr:
+                # Другая мастерская уже отправила изменения: сливаем снимки и отправляем снова
+                error = self._merge_remote_dump(dump_dir)
+                if error:
+                    QMessageBox.critical(self, "Ошибка", error)
+                    return
+                result = subprocess.run(['git', 'push', 'origin', 'master'],
+                                        cwd=self.repo_root,
+                                        capture_output=True,
+                                        text=True,
+                                        timeout=60)
+
             if result.returncode == 0:
                 QMessageBox.information(self, "Успех",
                                         "База данных успешно сохранена в репозиторий")
@@ -2065,31 +2233,65 @@ class WarehouseTab(QWidget):
         except Exception as e:
             QMessageBox.critical(self, "Ошибка", f"Произошла ошибка: {str(e)}")
 
-    def load_materials(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, name FROM materials")
-        materials = cursor.fetchall()
-        conn.close()
+    def _merge_remote_dump(self, dump_dir):
+        """
+        Сливает снимок из origin/master с локальным коммитом и пересобирает базу.
+
+        Правки разных записей сливаются построчно. Слитый снимок сначала
+        собирается во временную БД и только потом фиксируется: при конфликте
+        строк или снимке, который не загружается (например, одни и те же id
+        добавлены в обеих мастерских), слияние отменяется, а рабочая база и
+        локальный коммит остаются как были. :return: Текст ошибки или None
+        """
+        def git(*args):
+            return subprocess.run(['git', *args], cwd=self.repo_root, capture_output=True, text=True, timeout=30)
 
-        self.material_combo.clear()
-        for mat_id, mat_name in materials:
-            self.material_combo.addItem(mat_name, mat_id)
+        result = git('fetch', 'origin')
+        if result.returncode != 0:
+            return f"Ошибка при получении изменений:\n{result.stderr}"
+
+        result = git('merge', '--no-commit', '--no-ff', 'origin/master')
+        if result.returncode != 0:
+            git('merge', '--abort')
+            return ("Не удалось слить изменения с репозиторием: одни и те же записи изменены "
+                    f"в обеих мастерских.\n{result.stdout}{result.stderr}")
+
+        merged_db = f"{self.db_path}.merge"
+        try:
+            load_dump(dump_dir, merged_db)
+        except (ValueError, sqlite3.Error) as e:
+            git('merge', '--abort')
+            return f"Слитый снимок базы не загружается, слияние отменено:\n{e}"
+
+        result = git('commit', '--no-edit')
+        if result.returncode != 0:
+            os.remove(merged_db)
+            git('merge', '--abort')
+            return f"Ошибка при создании коммита слияния:\n{result.stderr}"
+
+        os.replace(merged_db, self.db_path)
+        self.main_window.reload_all_tabs()
+        return None
+
+    def load_materials(self, changed_ids=None):
+        sync_combo(self.material_combo, [(mat_id, mat_name) for mat_id, mat_name, _ in self.catalog.material_list()],
+                   changed_ids)
 
     def load_data(self):
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
-        cursor.execute("""SELECT w.id, m.name, w.length, w.quantity 
+        cursor.execute("""SELECT w.id, m.name, w.length_mm, w.quantity 
         FROM warehouse w
         JOIN materials m ON w.material_id = m.id
-        ORDER BY m.name""")
+        ORDER BY m.name, w.length_mm DESC""")
         warehouse = cursor.fetchall()
         conn.close()
 
         self.table.setRowCount(len(warehouse))
-        for row_idx, row_data in enumerate(warehouse):
+        for row_idx, (item_id, name, length_mm, quantity) in enumerate(warehouse):
+            row_data = (str(item_id), name, CuttingOptimizer.format_m(length_mm), str(quantity))
             for col_idx, col_data in enumerate(row_data):
-                item = QTableWidgetItem(str(col_data))
+                item = QTableWidgetItem(col_data)
                 item.setFlags(item.flags() ^ Qt.ItemIsEditable)
                 self.table.setItem(row_idx, col_idx, item)
 
@@ -2103,7 +2305,7 @@ class WarehouseTab(QWidget):
             return
 
         try:
-            length_val = float(length)
+            length_mm = CuttingOptimizer.to_mm(length)
             quantity_val = int(quantity)
         except ValueError:
             QMessageBox.warning(self, "Ошибка", "Длина и количество должны быть числами")
@@ -2113,16 +2315,11 @@ class WarehouseTab(QWidget):
         cursor = conn.cursor()
 
         try:
-            cursor.execute("SELECT id FROM warehouse WHERE material_id = ? AND length = ?",
-                           (material_id, length_val))
-            existing = cursor.fetchone()
-
-            if existing:
-                cursor.execute("UPDATE warehouse SET quantity = quantity + ? WHERE id = ?",
-                               (quantity_val, existing[0]))
-            else:
-                cursor.execute("INSERT INTO warehouse (material_id, length, quantity) VALUES (?, ?, ?)",
-                               (material_id, length_val, quantity_val))
+            # Длина целая, поэтому совпадение точное и идет по индексу (material_id, length_mm)
+            cursor.execute("""INSERT INTO warehouse (material_id, length_mm, quantity) VALUES (?, ?, ?)
+                              ON CONFLICT(material_id, length_mm) DO UPDATE
+                              SET quantity = quantity + excluded.quantity""",
+                           (material_id, length_mm, quantity_val))
 
             conn.commit()
             self.load_data()
@@ -2205,18 +2402,65 @@ class WarehouseTab(QWidget):
 
 
 class OrdersTab(QWidget):
-    def __init__(self, db_path, main_window):
+    def __init__(self, db_path, main_window, catalog=None):
         super().__init__()
         self.db_path = db_path
         self.main_window = main_window
+        self.catalog = catalog if catalog is not None else Catalog(db_path)
         self.init_ui()
 
         # ИСПРАВЛЕНИЕ 3: Загружаем изделия по умолчанию (так как "Изделие" выбрано по умолчанию)
         self.load_products()
 
-        self.current_order = []
-        self.product_cost_cache = {}
-        self.stage_cost_cache = {}
+        # Себестоимости и кривые этапов действительны до следующей правки каталога
+        self.costs = self.catalog.costs
+        self.stage_prices = StagePriceCache(db_path, self.costs)
+        # Требования заказа - одним SQL-запросом по временной таблице позиций
+        self.use_sql_expansion = True
+        # Последний план раскроя: используется как тёплый старт при следующем расчете
+        self.last_cutting_result = None
+        # Отрезки страховочного троса по трассам: {id материала: [Requirement, ...]}
+        self.rope_pieces = {}
+        self.rope_service = RopeService(db_path, self.catalog)
+        # PDF заказов строятся по данным БД и хранятся в ограниченном кэше
+        if getattr(sys, 'frozen', False):
+            data_dir = os.path.dirname(sys.executable)
+        else:
+            data_dir = os.path.dirname(db_path)
+        self.pdf_cache = PdfCache(os.path.join(data_dir, 'pdf_cache'))
+
+        self.catalog.products_changed.connect(self.on_catalog_products_changed)
+        self.catalog.stages_changed.connect(self.on_catalog_stages_changed)
+        self.catalog.materials_changed.connect(self.reprice_order)
+
+    def on_catalog_products_changed(self, product_ids):
+        if self.item_type_combo.currentText() == "Изделие":
+            self.load_products(product_ids)
+        self.reprice_order()
+
+    def on_catalog_stages_changed(self, stage_ids):
+        if self.item_type_combo.currentText() == "Этап":
+            self.load_stages(stage_ids)
+        self.reprice_order()
+
+    def reprice_order(self, *_):
+        """Пересчитывает стоимость позиций открытого заказа по новой версии каталога"""
+        self.order_model.reprice()
+
+    @property
+    def current_order(self):
+        """Позиции открытого заказа: [(тип, id, количество[, длина этапа]), ...]"""
+        return self.order_model.items()
+
+    def _price_line(self, line):
+        """Себестоимость позиции заказа (OrderLine)"""
+        if line.item_type == "Изделие":
+            return self._get_product_cost(line.item_id) * line.quantity
+        if line.item_type == "Этап":
+            return self._compute_stage_cost(line.item_id, line.length_m)
+        # Материал: трос - в метрах, зажимы - в штуках
+        material = self.catalog.materials.get(line.item_id)
+        return material[2] * line.quantity if material else 0.0
 
     def init_ui(self):
         main_layout = QVBoxLayout()
@@ -2224,12 +2468,16 @@ class OrdersTab(QWidget):
         order_group = QGroupBox("Создать заказ")
         order_layout = QVBoxLayout()
 
-        self.order_table = QTableWidget()
-        self.order_table.setColumnCount(6)
-        self.order_table.setHorizontalHeaderLabels(
-            ["Тип", "Название", "Количество", "Длина (м)", "Себестоимость", "Действия"])
+        # Количество изделия и длина этапа правятся двойным щелчком прямо в таблице
+        self.order_model = OrderModel(self._price_line, self)
+        self.order_model.total_changed.connect(self.update_total_cost)
+        self.order_table = QTableView()
+        self.order_table.setModel(self.order_model)
+        order_delegate = OrderDelegate(self.order_table)
+        order_delegate.remove_requested.connect(self.remove_from_order)
+        self.order_table.setItemDelegate(order_delegate)
+        self.order_table.setEditTriggers(QAbstractItemView.DoubleClicked)
         self.order_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
-        self.order_table.cellDoubleClicked.connect(self.on_cell_double_clicked)
         order_layout.addWidget(self.order_table)
 
         form_layout = QFormLayout()
@@ -2260,6 +2508,12 @@ class OrdersTab(QWidget):
         self.add_to_order_btn.clicked.connect(self.add_to_order)
         form_layout.addRow(self.add_to_order_btn)
 
+        self.strategy_combo = QComboBox()
+        for strategy, title in CuttingOptimizer.STRATEGIES.items():
+            self.strategy_combo.addItem(title, strategy)
+        self.strategy_combo.setToolTip("Точный раскрой подбирает лучшую комбинацию кусков для каждой доски")
+        form_layout.addRow(QLabel("Раскрой:"), self.strategy_combo)
+
         order_layout.addLayout(form_layout)
 
         btn_layout = QHBoxLayout()
@@ -2292,11 +2546,22 @@ class OrdersTab(QWidget):
 
         history_group = QGroupBox("История заказов")
         history_layout = QVBoxLayout()
+        self.history_search_input = QLineEdit()
+        self.history_search_input.setPlaceholderText("🔍 Поиск по позициям, инструкциям и дате (например, 2025-08)")
+        self.history_search_input.setClearButtonEnabled(True)
+        self.history_search_input.textChanged.connect(self.search_order_history)
+        history_layout.addWidget(self.history_search_input)
         self.history_table = QTableWidget()
         self.history_table.setColumnCount(4)
         self.history_table.setHorizontalHeaderLabels(["ID", "Дата", "Позиций", "Сумма"])
         self.history_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.history_table.setSelectionBehavior(QTableWidget.SelectRows)
+        self.history_table.setSelectionMode(QTableWidget.ExtendedSelection)
         self.history_table.cellDoubleClicked.connect(self.show_order_details)
+        # История читается страницами: (дата, id) последнего показанного заказа
+        self.history_after = None
+        self.history_exhausted = True
+        self.history_table.verticalScrollBar().valueChanged.connect(self.on_history_scrolled)
         history_layout.addWidget(self.history_table)
 
         history_buttons_layout = QHBoxLayout()
@@ -2304,6 +2569,16 @@ class OrdersTab(QWidget):
         self.open_pdf_btn.clicked.connect(self.open_selected_pdf)
         history_buttons_layout.addWidget(self.open_pdf_btn)
 
+        self.export_pdf_btn = QPushButton("Экспорт PDF...")
+        self.export_pdf_btn.setToolTip("PDF выбранных заказов (или заказов за период) в zip-архив или один файл")
+        self.export_pdf_btn.clicked.connect(self.export_order_pdfs)
+        history_buttons_layout.addWidget(self.export_pdf_btn)
+
+        self.batch_cutting_btn = QPushButton("Раскрой пакета заказов")
+        self.batch_cutting_btn.setToolTip("Совместный раскрой выбранных заказов по текущему складу")
+        self.batch_cutting_btn.clicked.connect(self.calculate_batch_cutting)
+        history_buttons_layout.addWidget(self.batch_cutting_btn)
+
         self.refresh_history_btn = QPushButton("Обновить историю")
         self.refresh_history_btn.clicked.connect(self.load_order_history)
         history_buttons_layout.addWidget(self.refresh_history_btn)
@@ -2322,74 +2597,19 @@ class OrdersTab(QWidget):
 
     def calculate_rope_materials(self, routes):
         """
-        Исправленный расчет материалов страховочного троса.
-        Теперь правильно работает с полными трассами, включая динамические этапы.
-        """
-        total_rope = 0.0
-        total_clamps = 0
-
-        for route in routes:
-            if not route:  # Пустая трасса
-                continue
-
-            # Разбиваем трассу на сегменты (как в show_preview)
-            segments = []
-            current_segment = None
-
-            for stage in route:
-                stage_type = 'static' if stage['category'] == 'Статика' else 'dynamic'
+        Расчет материалов страховочного троса по полным трассам (включая динамические этапы).
 
-                if current_segment is None or current_segment['type'] != stage_type:
-                    # Начинаем новый сегмент
-                    current_segment = {'type': stage_type, 'stages': [stage]}
-                    segments.append(current_segment)
-                else:
-                    # Продолжаем текущий сегмент
-                    current_segment['stages'].append(stage)
-
-            # Рассчитываем трос только для статических сегментов
-            for segment in segments:
-                if segment['type'] == 'static':
-                    N = len(segment['stages'])
-                    L = sum(stage['length'] for stage in segment['stages'])
-                    rope = 5 + 5 * N + L
-                    clamps = 6 + 6 * N
-                    total_rope += rope
-                    total_clamps += clamps
-
-        return total_rope, total_clamps
+        :return: (отрезки троса [Requirement(длина в мм, описание), ...], количество зажимов)
+        """
+        return rope_requirements([route for route in routes if route])
 
     def calculate_safety_rope(self):
         """Рассчитывает и добавляет страховочный трос в заказ"""
-        # Получаем все этапы из заказа
-        stages_in_order = []
-        for row in range(self.order_table.rowCount()):
-            if self.order_table.item(row, 0) and self.order_table.item(row, 0).text() == "Этап":
-                stage_id = self.order_table.item(row, 1).data(Qt.UserRole) if self.order_table.item(row, 1) else None
-                stage_name = self.order_table.item(row, 1).text() if self.order_table.item(row,
-                                                                                           1) else "Неизвестный этап"
-                length_text = self.order_table.item(row, 3).text() if self.order_table.item(row, 3) else "0"
-
-                try:
-                    length = float(length_text)
-                except (ValueError, AttributeError):
-                    length = 0.0
-
-                if stage_id:
-                    # Получаем категорию этапа
-                    conn = sqlite3.connect(self.db_path)
-                    cursor = conn.cursor()
-                    cursor.execute("SELECT category FROM stages WHERE id = ?", (stage_id,))
-                    result = cursor.fetchone()
-                    category = result[0] if result else "Статика"
-                    conn.close()
-
-                    stages_in_order.append({
-                        'id': stage_id,
-                        'name': stage_name,
-                        'length': length,
-                        'category': category
-                    })
+        # Собираем этапы из заказа; категории и материалы троса читаются потом одним запросом
+        stage_rows = [(line.item_id, line.name, line.length_m or 0.0)
+                      for line in self.order_model.lines() if line.item_type == "Этап"]
+
+        stages_in_order, rope_materials = self.rope_service.load(stage_rows)
 
         if not stages_in_order:
             QMessageBox.warning(self, "Ошибка", "В заказе нет этапов для расчета страховочного троса")
@@ -2417,8 +2637,10 @@ class OrdersTab(QWidget):
         if dialog.exec_() == QDialog.Accepted:
             routes = dialog.get_routes()
             if routes:
-                total_rope, total_clamps = self.calculate_rope_materials(routes)
-                self.add_rope_to_order(total_rope, total_clamps)
+                rope_pieces, total_clamps = self.calculate_rope_materials(routes)
+                if not self.add_rope_to_order(rope_pieces, total_clamps, rope_materials):
+                    return
+                total_rope = sum(piece.value for piece in rope_pieces) / 1000
 
                 # Показываем детальный отчет
                 routes_info = f"Создано трасс троса: {len(routes)}\n"
@@ -2427,75 +2649,54 @@ class OrdersTab(QWidget):
 
                 QMessageBox.information(self, "Расчет завершен",
                                         f"{routes_info}\nДобавлено:\n"
-                                        f"• Трос М12: {total_rope:.2f} м\n"
-                                        f"• Зажимы М12: {total_clamps} шт")
+                                        f"• {ROPE_MATERIAL}: {total_rope:.2f} м ({len(rope_pieces)} отрезков)\n"
+                                        f"• {CLAMP_MATERIAL}: {total_clamps} шт")
             else:
                 QMessageBox.warning(self, "Ошибка", "Не удалось создать трассы для страховочного троса")
 
-    def add_rope_to_order(self, rope_length, clamps_count):
-        """Исправленный метод добавления материалов страховочного троса в заказ"""
+    def add_rope_to_order(self, rope_pieces, clamps_count, materials=None):
+        """
+        Добавляет страховочный трос и зажимы в заказ.
+
+        Трос хранится отрезками по участкам трасс: при расчете заказа они
+        раскладываются по бухтам на складе, как куски пиломатериала.
+        Повторный расчет заменяет ранее добавленные трос и зажимы.
+
+        :param materials: {название: (id, цена)} из RopeService.load; если не
+            переданы, читаются заново
+        :return: True, если позиции добавлены
+        """
         try:
-            # Получаем ID материалов из БД
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute("SELECT id, price FROM materials WHERE name = 'Трос М12'")
-            rope_result = cursor.fetchone()
-            cursor.execute("SELECT id, price FROM materials WHERE name = 'Зажим М12'")
-            clamp_result = cursor.fetchone()
-            conn.close()
+            if materials is None:
+                _, materials = self.rope_service.load([])
+            rope_result = materials.get(ROPE_MATERIAL)
+            clamp_result = materials.get(CLAMP_MATERIAL)
 
             if not rope_result or not clamp_result:
                 QMessageBox.warning(self, "Ошибка",
-                                    "Материалы 'Трос М12' или 'Зажим М12' не найдены в базе данных.\n"
+                                    f"Материалы '{ROPE_MATERIAL}' или '{CLAMP_MATERIAL}' не найдены в базе данных.\n"
                                     "Добавьте эти материалы в раздел 'Материалы'")
-                return
-
-            rope_id, rope_price = rope_result
-            clamp_id, clamp_price = clamp_result
-
-            # Добавляем позиции в заказ
-            for material_name, material_id, amount, price in [
-                ("Трос М12", rope_id, rope_length, rope_price),
-                ("Зажим М12", clamp_id, clamps_count, clamp_price),
-            ]:
-                row = self.order_table.rowCount()
-                self.order_table.insertRow(row)
-
-                # Тип позиции
-                self.order_table.setItem(row, 0, QTableWidgetItem("Материал"))
-
-                # Название с ID в данных
-                item = QTableWidgetItem(material_name)
-                item.setData(Qt.UserRole, material_id)
-                self.order_table.setItem(row, 1, item)
-
-                # Количество (округляем зажимы до целого числа)
-                quantity_text = f"{amount:.2f}" if material_name.startswith("Трос") else str(int(amount))
-                self.order_table.setItem(row, 2, QTableWidgetItem(quantity_text))
-
-                # Длина (пустая для материалов)
-                self.order_table.setItem(row, 3, QTableWidgetItem(""))
-
-                # Стоимость
-                total_cost = amount * price
-                self.order_table.setItem(row, 4, QTableWidgetItem(f"{total_cost:.2f} руб"))
+                return False
 
-                # Кнопка удаления
-                delete_btn = QPushButton("Удалить")
-                delete_btn.clicked.connect(partial(self.remove_from_order, row))
-                self.order_table.setCellWidget(row, 5, delete_btn)
+            rope_id = rope_result[0]
+            clamp_id = clamp_result[0]
+            rope_length = sum(piece.value for piece in rope_pieces) / 1000
 
-            # Обновляем кнопки удаления для всех строк
-            for r in range(self.order_table.rowCount()):
-                widget = self.order_table.cellWidget(r, 5)
-                if isinstance(widget, QPushButton):
-                    widget.clicked.disconnect()
-                    widget.clicked.connect(partial(self.remove_from_order, r))
+            # Убираем трос и зажимы прошлого расчета
+            for line in self.order_model.lines():
+                if line.item_type == "Материал" and line.item_id in (rope_id, clamp_id):
+                    self.order_model.remove_line(line.line_id)
+            self.rope_pieces = {rope_id: list(rope_pieces)}
 
-            self.update_total_cost()
+            # Трос - в метрах, в колонке длины - число отрезков; зажимы - целым числом
+            self.order_model.add_line("Материал", rope_id, ROPE_MATERIAL, float(rope_length),
+                                      note=f"{len(rope_pieces)} отрезков")
+            self.order_model.add_line("Материал", clamp_id, CLAMP_MATERIAL, int(clamps_count))
+            return True
 
         except Exception as e:
             QMessageBox.critical(self, "Ошибка", f"Ошибка при добавлении троса: {str(e)}")
+            return False
 
     def on_item_type_changed(self, item_type):
         """Переключение между Изделием и Этапом с показом поля длины для этапа"""
@@ -2509,31 +2710,13 @@ class OrdersTab(QWidget):
             self.quantity_spin.hide()
             self.load_stages()
 
-    def load_products(self):
+    def load_products(self, changed_ids=None):
         """Загружает ТОЛЬКО изделия в выпадающий список"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, name FROM products ORDER BY name")
-        products = cursor.fetchall()
-        conn.close()
-
-        # Очищаем и заполняем список изделиями
-        self.item_combo.clear()
-        for prod_id, prod_name in products:
-            self.item_combo.addItem(prod_name, prod_id)
+        sync_combo(self.item_combo, self.catalog.product_list(), changed_ids)
 
-    def load_stages(self):
+    def load_stages(self, changed_ids=None):
         """Загружает ТОЛЬКО этапы в выпадающий список"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, name FROM stages ORDER BY name")
-        stages = cursor.fetchall()
-        conn.close()
-
-        # Очищаем и заполняем список этапами
-        self.item_combo.clear()
-        for stage_id, stage_name in stages:
-            self.item_combo.addItem(stage_name, stage_id)
+        sync_combo(self.item_combo, self.catalog.stage_list(), changed_ids)
 
     def add_to_order(self):
         """Добавление позиции в заказ: для Этапа учитываем длину, для Изделия — количество"""
@@ -2546,204 +2729,39 @@ class OrdersTab(QWidget):
             return
 
         if item_type == "Изделие":
-            quantity = self.quantity_spin.value()
-            cost_per_unit = self._get_product_cost(item_id)
-
-            row_count = self.order_table.rowCount()
-            self.order_table.setRowCount(row_count + 1)
-
-            self.order_table.setItem(row_count, 0, QTableWidgetItem(item_type))
-
-            name_item = QTableWidgetItem(item_name)
-            name_item.setData(Qt.UserRole, item_id)
-            name_item.setData(Qt.UserRole + 1, item_type)
-            self.order_table.setItem(row_count, 1, name_item)
-
-            self.order_table.setItem(row_count, 2, QTableWidgetItem(str(quantity)))
-            self.order_table.setItem(row_count, 3, QTableWidgetItem(""))  # длина пустая для изделия
-            self.order_table.setItem(row_count, 4, QTableWidgetItem(f"{cost_per_unit * quantity:.2f} руб"))
-
-            delete_btn = QPushButton("Удалить")
-            delete_btn.clicked.connect(lambda: self.remove_from_order(row_count))
-            self.order_table.setCellWidget(row_count, 5, delete_btn)
-
+            self.order_model.add_line(item_type, item_id, item_name, self.quantity_spin.value())
         else:  # Этап
-            # ИСПРАВЛЕНО: НЕ округляем длину, сохраняем точное значение
-            length_m = self.length_spin.value()  # Убрано round()
+            # Длину не округляем, храним точное значение
+            length_m = self.length_spin.value()
 
             if length_m <= 0:
                 QMessageBox.warning(self, "Ошибка", "Длина этапа должна быть больше 0")
                 return
 
-            cost_total = self._compute_stage_cost(stage_id=item_id, length_m=length_m)
-
-            row_count = self.order_table.rowCount()
-            self.order_table.setRowCount(row_count + 1)
-
-            self.order_table.setItem(row_count, 0, QTableWidgetItem(item_type))
-
-            name_item = QTableWidgetItem(item_name)
-            name_item.setData(Qt.UserRole, item_id)
-            name_item.setData(Qt.UserRole + 1, item_type)
-            name_item.setData(Qt.UserRole + 2, length_m)  # сохраним точную длину
-            self.order_table.setItem(row_count, 1, name_item)
-
-            self.order_table.setItem(row_count, 2, QTableWidgetItem("1"))  # количество строкой = 1 для этапа
-
-            # ИСПРАВЛЕНО: показываем точную длину с 2 знаками после запятой
-            self.order_table.setItem(row_count, 3, QTableWidgetItem(f"{length_m:.2f}"))
-            self.order_table.setItem(row_count, 4, QTableWidgetItem(f"{cost_total:.2f} руб"))
-
-            delete_btn = QPushButton("Удалить")
-            delete_btn.clicked.connect(lambda: self.remove_from_order(row_count))
-            self.order_table.setCellWidget(row_count, 5, delete_btn)
-
-        self._update_current_order()
-        self.update_total_cost()
+            self.order_model.add_line(item_type, item_id, item_name, 1, length_m)
 
     def _get_product_cost(self, product_id):
-        if product_id in self.product_cost_cache:
-            return self.product_cost_cache[product_id]
-
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT cost FROM products WHERE id = ?", (product_id,))
-        cost = cursor.fetchone()[0]
-        conn.close()
-
-        self.product_cost_cache[product_id] = cost
-        return cost
+        # Себестоимость уже в каталоге; изделие могли удалить, пока оно в открытом заказе
+        return self.catalog.products.get(product_id, (None, 0.0))[1]
 
     def _get_stage_cost(self, stage_id):
-        if stage_id in self.stage_cost_cache:
-            return self.stage_cost_cache[stage_id]
+        return self.catalog.stages.get(stage_id, (None, None, 0.0))[2]
 
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT cost FROM stages WHERE id = ?", (stage_id,))
-        cost = cursor.fetchone()[0]
-        conn.close()
+    def remove_from_order(self, line_id):
+        """Удаляет позицию заказа по ее id"""
+        line = self.order_model.remove_line(line_id)
+        # Отрезки троса живут, пока строка троса есть в заказе
+        if line is not None and line.item_type == "Материал":
+            self.rope_pieces.pop(line.item_id, None)
 
-        self.stage_cost_cache[stage_id] = cost
-        return cost
-
-    def _update_current_order(self):
-        self.current_order = []
-        for row in range(self.order_table.rowCount()):
-            item_type = self.order_table.item(row, 0).text()
-            item_id = int(self.order_table.item(row, 1).data(Qt.UserRole))
-            quantity = int(self.order_table.item(row, 2).text())
-            self.current_order.append((item_type, item_id, quantity))
-
-    def remove_from_order(self, row):
-        """Безопасно удаляет строку и обновляет индексы кнопок."""
-        if 0 <= row < self.order_table.rowCount():
-            self.order_table.removeRow(row)
-            # Перепривязываем все лямбды удаления с новыми индексами
-            for r in range(self.order_table.rowCount()):
-                widget = self.order_table.cellWidget(r, 5)
-                if isinstance(widget, QPushButton):
-                    widget.clicked.disconnect()
-                    widget.clicked.connect(partial(self.remove_from_order, r))
-            self.update_total_cost()
-
-    def on_cell_double_clicked(self, row, column):
-        # Редактирование количества для изделия и длины (м) для этапа
-        item_type = self.order_table.item(row, 0).text()
-        item_id = int(self.order_table.item(row, 1).data(Qt.UserRole))
-
-        if item_type == "Изделие" and column == 2:
-            dialog = QDialog(self)
-            dialog.setWindowTitle("Изменение количества")
-            dialog.setFixedSize(300, 150)
-            layout = QVBoxLayout()
-            item_name = self.order_table.item(row, 1).text()
-            layout.addWidget(QLabel(f"Позиция: {item_name}"))
-            spin_box = QSpinBox()
-            spin_box.setMinimum(1)
-            spin_box.setMaximum(999)
-            spin_box.setValue(int(self.order_table.item(row, 2).text()))
-            layout.addWidget(QLabel("Новое количество:"))
-            layout.addWidget(spin_box)
-            btn_layout = QHBoxLayout()
-            ok_btn = QPushButton("OK");
-            cancel_btn = QPushButton("Отмена")
-            ok_btn.clicked.connect(dialog.accept);
-            cancel_btn.clicked.connect(dialog.reject)
-            btn_layout.addWidget(ok_btn);
-            btn_layout.addWidget(cancel_btn)
-            layout.addLayout(btn_layout)
-            dialog.setLayout(layout)
-            if dialog.exec_() == QDialog.Accepted:
-                new_quantity = spin_box.value()
-                self.order_table.item(row, 2).setText(str(new_quantity))
-                cost_per_unit = self._get_product_cost(item_id)
-                new_cost = cost_per_unit * new_quantity
-                self.order_table.item(row, 4).setText(f"{new_cost:.2f} руб")
-                self._update_current_order()
-                self.update_total_cost()
-
-        if item_type == "Этап" and column == 3:
-            dialog = QDialog(self)
-            dialog.setWindowTitle("Изменение длины (м)")
-            dialog.setFixedSize(320, 160)
-            layout = QVBoxLayout()
-            item_name = self.order_table.item(row, 1).text()
-            layout.addWidget(QLabel(f"Этап: {item_name}"))
-
-            spin = QDoubleSpinBox()
-            spin.setDecimals(2)  # ИСПРАВЛЕНО: 2 знака после запятой
-            spin.setMinimum(0.01)
-            spin.setMaximum(9999.0)
-            spin.setSingleStep(0.01)  # ИСПРАВЛЕНО: шаг 0.01 вместо 0.10
-
-            current_len_text = self.order_table.item(row, 3).text() or "0"
-            try:
-                current_len = float(current_len_text)
-            except ValueError:
-                current_len = 1.00
-            spin.setValue(current_len if current_len > 0 else 1.00)
-
-            layout.addWidget(QLabel("Новая длина (м):"))
-            layout.addWidget(spin)
-            btn_layout = QHBoxLayout()
-            ok_btn = QPushButton("OK")
-            cancel_btn = QPushButton("Отмена")
-            ok_btn.clicked.connect(dialog.accept)
-            cancel_btn.clicked.connect(dialog.reject)
-            btn_layout.addWidget(ok_btn)
-            btn_layout.addWidget(cancel_btn)
-            layout.addLayout(btn_layout)
-            dialog.setLayout(layout)
-
-            if dialog.exec_() == QDialog.Accepted:
-                # ИСПРАВЛЕНО: НЕ округляем новую длину
-                new_len = spin.value()  # Убрано round()
-                self.order_table.item(row, 3).setText(f"{new_len:.2f}")
-
-                # пересчёт стоимости строки с точной длиной
-                new_cost = self._compute_stage_cost(item_id, new_len)
-                self.order_table.item(row, 4).setText(f"{new_cost:.2f} руб")
-
-                # обновим сохранённую длину в UserRole+2 у названия
-                name_item = self.order_table.item(row, 1)
-                name_item.setData(Qt.UserRole + 2, new_len)  # Сохраняем точную длину
-
-                self._update_current_order()
-                self.update_total_cost()
-
-    def update_total_cost(self):
-        total = 0.0
-        for row in range(self.order_table.rowCount()):
-            cost_text = self.order_table.item(row, 4).text().replace(' руб', '')
-            total += float(cost_text or 0)
+    def update_total_cost(self, total):
         self.total_cost_label.setText(f"Общая себестоимость: {total:.2f} руб")
 
     def clear_order(self):
-        self.order_table.setRowCount(0)
-        self.current_order = []
+        self.order_model.clear()
+        self.last_cutting_result = None
+        self.rope_pieces = {}
         self.instructions_text.clear()
-        self.total_cost_label.setText("Общая себестоимость: 0.00 руб")
 
     def calculate_order(self):
         if not self.current_order:
@@ -2772,14 +2790,21 @@ class OrdersTab(QWidget):
                 if not row:
                     continue
                 unit_price, mtype = row
+                if mtype == "Пиломатериал":
+                    # длины пиломатериалов в мм, цена - за метр
+                    requirements[material] = total_qty = total_qty / 1000
                 # для пиломатериалов cost за метр, для метизов cost за штуку
                 total_cost += unit_price * total_qty
             conn.close()
 
-            # Оптимизация резки
+            # Оптимизация резки (с тёплым стартом от предыдущего расчета)
             stock_items = self._get_current_stock()
             optimizer = CuttingOptimizer()
-            result = optimizer.optimize_cutting(req_details, stock_items, self.db_path)
+            result = optimizer.optimize_cutting(req_details, stock_items, self.db_path,
+                                                previous_result=self.last_cutting_result,
+                                                purchase_options=CuttingOptimizer.get_purchase_options(self.db_path),
+                                                strategy=self.strategy_combo.currentData())
+            self.last_cutting_result = result
 
             # Формируем сообщение по материалам
             materials_message = "📦 Требуемые материалы:\n\n"
@@ -2803,6 +2828,20 @@ class OrdersTab(QWidget):
                 for err in result['missing']:
                     availability += f" - {err}\n"
 
+                if result['purchase']:
+                    purchase_total = 0.0
+                    availability += "\n🛒 Рекомендуемая закупка (с учетом складских остатков):\n"
+                    for material, length, qty, cost in result['purchase']:
+                        purchase_total += cost
+                        availability += (f" - {material}: {CuttingOptimizer.format_m(length)}м × {qty} шт "
+                                         f"= {cost:.2f} руб\n")
+                    availability += f"Итого закупка: {purchase_total:.2f} руб\n"
+                for material, plan in result['purchase_plan'].items():
+                    if plan['unsolvable']:
+                        longest = max(length for length, _ in plan['unsolvable'])
+                        availability += (f" - {material}: {len(plan['unsolvable'])} кусков длиннее любой "
+                                         f"стандартной длины (до {CuttingOptimizer.format_m(longest)}м)\n")
+
             # Итоговые расчеты
             instructions = "📊 Расчет заказа:\n\n"
             instructions += f"💰 Себестоимость: {total_cost:.2f} руб\n"
@@ -2817,18 +2856,18 @@ class OrdersTab(QWidget):
             import traceback;
             print(traceback.format_exc())
 
-    def _expand_order_to_requirements(self):
+    def _expand_order_to_requirements(self, order_items=None):
         """
         ИСПРАВЛЕННЫЙ метод преобразования заказа в требования по материалам
         с правильным подсчетом meter-части этапов
-        """
-        requirements = defaultdict(list)
-        total_cost = 0.0
 
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
+        :param order_items: Позиции заказа; по умолчанию - текущий заказ
+        """
+        if order_items is None:
+            order_items = self.current_order
 
-        for item in self.current_order:
+        items = []
+        for item in order_items:
             # Проверяем длину кортежа
             if len(item) == 3:
                 item_type, item_id, quantity = item
@@ -2839,160 +2878,110 @@ class OrdersTab(QWidget):
                 print(f"Неожиданная структура элемента заказа: {item}")
                 continue
 
-            if item_type == "Изделие":
-                # Обрабатываем изделие
-                c.execute("SELECT cost FROM products WHERE id = ?", (item_id,))
-                cost_row = c.fetchone()
-                if cost_row:
-                    total_cost += cost_row[0] * quantity
+            if item_type == "Этап" and length_m is None:
+                length_m = self.catalog.stages[item_id][3]  # длина по умолчанию
+            items.append((item_type, item_id, quantity, length_m))
 
-                # Материалы изделия
-                c.execute("""SELECT m.name, m.type, pc.quantity, pc.length
-                            FROM product_composition pc
-                            JOIN materials m ON pc.material_id = m.id
-                            WHERE pc.product_id = ?""", (item_id,))
+        if self.use_sql_expansion:
+            return expand_order_sql(self.db_path, items, self.rope_pieces)
+        return expand_order_python(self.db_path, items, self.rope_pieces, self._compute_stage_cost,
+                                   self.main_window.bom)
 
-                product_name = self._get_product_name(item_id)
+    def _load_saved_order_items(self, order_id):
+        """Позиции сохраненного заказа в формате current_order (этапы - с длиной)"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute("""SELECT item_type, product_id, stage_id, quantity, length_meters
+                          FROM order_items WHERE order_id = ?""", (order_id,))
+        rows = cursor.fetchall()
+        conn.close()
 
-                for mname, mtype, q, length in c.fetchall():
-                    if mtype == "Пиломатериал" and length:
-                        # Для пиломатериалов: каждый кусок отдельно
-                        total_pieces = q * quantity
-                        for _ in range(int(total_pieces)):
-                            requirements[mname].append((float(length), product_name))
-                    else:
-                        # Для метизов: общее количество
-                        total_quantity = math.ceil(q * quantity)
-                        requirements[mname].append((total_quantity, product_name))
-
-            else:  # item_type == "Этап"
-                # Получаем длину для этапа
-                if length_m is None:
-                    length_m = self._get_row_length_for_stage(item_id)
-
-                # Обрабатываем этап
-                stage_cost = self._compute_stage_cost(item_id, length_m)
-                total_cost += stage_cost
-
-                # Материалы напрямую из этапа
-                c.execute("""SELECT sm.part, sm.quantity, sm.length, m.name, m.type
-                            FROM stage_materials sm
-                            JOIN materials m ON sm.material_id = m.id
-                            WHERE sm.stage_id = ?""", (item_id,))
-
-                for part, sm_qty, sm_length, mname, mtype in c.fetchall():
-                    # ИСПРАВЛЕНО: правильный расчет multiplier для каждой части
-                    if part == 'start' or part == 'end':
-                        multiplier = 1  # Части start и end берутся по 1 разу
-                    else:  # part == 'meter'
-                        multiplier = length_m  # Часть meter умножается на длину
-
-                    if mtype == "Пиломатериал" and sm_length:
-                        total_pieces = sm_qty * multiplier
-                        for _ in range(math.ceil(total_pieces)):
-                            requirements[mname].append((float(sm_length), f"Этап({part})→Материал"))
-                    else:
-                        total_quantity = math.ceil(sm_qty * multiplier)
-                        requirements[mname].append((total_quantity, f"Этап({part})→Материал"))
+        items = []
+        for item_type, product_id, stage_id, quantity, length_m in rows:
+            if item_type == 'product' and product_id:
+                items.append(("Изделие", product_id, quantity))
+            elif item_type == 'stage' and stage_id:
+                items.append(("Этап", stage_id, 1, length_m or 0.0))
+        return items
 
-                # Материалы из изделий в этапе
-                c.execute("""SELECT m.name, m.type, pc.quantity, pc.length, sp.quantity as stage_qty, sp.part, p.name as product_name
-                            FROM stage_products sp
-                            JOIN products p ON sp.product_id = p.id
-                            JOIN product_composition pc ON sp.product_id = pc.product_id
-                            JOIN materials m ON pc.material_id = m.id
-                            WHERE sp.stage_id = ?""", (item_id,))
-
-                for material, mtype, comp_qty, length, stage_qty, part, product_name in c.fetchall():
-                    # Вычисляем множитель для части этапа
-                    if part in ('start', 'end'):
-                        multiplier = 1
-                    else:  # meter
-                        multiplier = length_m
-
-                    total_qty = comp_qty * stage_qty * multiplier
-                    item_description = f"Этап({part})→{product_name}"
+    def calculate_batch_cutting(self):
+        """
+        Совместный раскрой выбранных в истории заказов (склад не изменяется).
 
-                    if mtype == "Пиломатериал" and length:
-                        # пиломатериалы – по метрам, как раньше
-                        for _ in range(math.ceil(total_qty)):
-                            requirements[material].append((float(length), item_description))
-                    else:
-                        # метизы и изделия – округляем в большую сторону
-                        total_pieces = math.ceil(total_qty)
-                        requirements[material].append((total_pieces, item_description))
+        Заказы в истории подтверждены - их материалы уже списаны, поэтому раскрой
+        идет по складу, каким он был до них: расход по сохраненным планам
+        возвращается на склад.
+        """
+        order_ids = sorted({int(self.history_table.item(index.row(), 0).text())
+                            for index in self.history_table.selectionModel().selectedRows()})
+        if not order_ids:
+            QMessageBox.warning(self, "Выберите заказы",
+                                "Выделите в истории один или несколько заказов")
+            return
 
-        conn.close()
-        return total_cost, requirements
+        try:
+            orders = {}
+            for order_id in order_ids:
+                _, requirements = self._expand_order_to_requirements(self._load_saved_order_items(order_id))
+                orders[order_id] = requirements
 
-    def _get_product_name(self, product_id: int) -> str:
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        c.execute("SELECT name FROM products WHERE id = ?", (product_id,))
-        row = c.fetchone()
-        conn.close()
-        return row if row else f"Изделие #{product_id}"
+            conn = sqlite3.connect(self.db_path)
+            try:
+                plans = {order_id: load_plan(conn.cursor(), order_id) for order_id in order_ids}
+            finally:
+                conn.close()
+            without_plan = [order_id for order_id, plan in plans.items() if plan is None]
+            stock_items = stock_before_plans(self._get_current_stock(),
+                                             [plan for plan in plans.values() if plan is not None])
+            result = CuttingOptimizer.optimize_batch(orders, stock_items, self.db_path,
+                                                     strategy=self.strategy_combo.currentData())
+
+            text = f"📦 Раскрой пакета заказов: {', '.join(map(str, order_ids))}\n\n"
+            if without_plan:
+                text += (f"⚠️ У заказов {', '.join(map(str, without_plan))} нет сохраненного плана раскроя: "
+                         "их материалы уже списаны со склада и в пакет не возвращены\n\n")
+            if result['can_produce']:
+                text += "✅ Материалов достаточно для всего пакета\n\n"
+            else:
+                text += "❌ Материалов недостаточно:\n"
+                for err in result['missing']:
+                    text += f" - {err}\n"
+                text += "\n"
+            text += self._generate_instructions_text(0.0, result, None)
+            text += "\n\n" + self._batch_orders_text(result['by_order'])
+            self.instructions_text.setText(text)
+        except Exception as e:
+            QMessageBox.critical(self, "Ошибка", f"Ошибка при раскрое пакета: {e}")
+
+    @staticmethod
+    def _batch_orders_text(by_order):
+        """Раскрой пакета по заказам: куски каждого заказа с номерами досок из инструкций"""
+        text = "📋 По заказам:\n"
+        for order_id, materials in by_order.items():
+            text += f"Заказ {order_id}:\n"
+            for material, entries in materials.items():
+                pieces = [entry for entry in entries if 'length' in entry]
+                if pieces:
+                    total_mm = sum(entry['length'] for entry in pieces)
+                    boards = ", ".join(map(str, sorted({entry['board'] for entry in pieces})))
+                    text += (f"  {material}: {len(pieces)} кусков, {CuttingOptimizer.format_m(total_mm)}м"
+                             f" (доски {boards})\n")
+                quantity = sum(entry['quantity'] for entry in entries if 'quantity' in entry)
+                if quantity:
+                    text += f"  {material}: {quantity} шт\n"
+        return text.rstrip()
 
     def _compute_stage_cost(self, stage_id: int, length_m: float) -> float:
         """
-        Новый расчет стоимости этапа произвольной длины (с округлением позиций как в calculate_order)
+        Расчет стоимости этапа произвольной длины (с округлением позиций как в calculate_order)
+        по заранее построенной кривой себестоимости этапа
         """
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-
-            # Изделия
-            cursor.execute("""
-                SELECT sp.part, p.cost, sp.quantity
-                FROM stage_products sp
-                JOIN products p ON sp.product_id = p.id
-                WHERE sp.stage_id = ?
-            """, (stage_id,))
-            total_cost = 0.0
-            for part, pcost, qty in cursor.fetchall():
-                multiplier = length_m if part == 'meter' else 1
-                qty_total = math.ceil(qty * multiplier)
-                total_cost += pcost * qty_total
-
-            # Материалы
-            cursor.execute("""
-                SELECT sm.part, m.type, m.price, sm.quantity, sm.length
-                FROM stage_materials sm
-                JOIN materials m ON sm.material_id = m.id
-                WHERE sm.stage_id = ?
-            """, (stage_id,))
-            for part, mtype, price, qty, length_val in cursor.fetchall():
-                multiplier = length_m if part == 'meter' else 1
-                qty_total = math.ceil(qty * multiplier)
-                if mtype == "Пиломатериал" and length_val:
-                    total_cost += price * qty_total * length_val
-                else:
-                    total_cost += price * qty_total
-
-            conn.close()
-            return total_cost
+            return self.stage_prices.price(stage_id, CuttingOptimizer.to_mm(length_m))
         except Exception as e:
             print(f"Ошибка расчета стоимости этапа {stage_id}: {e}")
             return 0.0
 
-    def _get_row_length_for_stage(self, stage_id: int) -> float:
-        # ищем строку в таблице заказа с этим stage_id и читаем колонку "Длина (м)"
-        for row in range(self.order_table.rowCount()):
-            if self.order_table.item(row, 0).text() == "Этап":
-                name_item = self.order_table.item(row, 1)
-                if int(name_item.data(Qt.UserRole)) == stage_id:
-                    # сначала смотрим сохранённое значение
-                    saved = name_item.data(Qt.UserRole + 2)
-                    if saved is not None:
-                        return float(saved)
-                    # иначе читаем из ячейки
-                    txt = self.order_table.item(row, 3).text() or "0"
-                    try:
-                        return float(txt)
-                    except Exception:
-                        return 0.0
-        return 0.0
-
     def _get_stage_materials(self, stage_id, quantity):
         materials_summary = defaultdict(float)
 
@@ -3001,7 +2990,7 @@ class OrdersTab(QWidget):
 
         # Материалы из изделий в этапе
         cursor.execute("""
-        SELECT m.name, m.type, pc.quantity, pc.length, sp.quantity as stage_qty
+        SELECT m.name, m.type, pc.quantity, pc.length_mm / 1000.0, sp.quantity as stage_qty
         FROM stage_products sp
         JOIN product_composition pc ON sp.product_id = pc.product_id
         JOIN materials m ON pc.material_id = m.id
@@ -3017,7 +3006,7 @@ class OrdersTab(QWidget):
 
         # Материалы напрямую в этапе
         cursor.execute("""
-        SELECT m.name, m.type, sm.quantity, sm.length
+        SELECT m.name, m.type, sm.quantity, sm.length_mm / 1000.0
         FROM stage_materials sm
         JOIN materials m ON sm.material_id = m.id
         WHERE sm.stage_id = ?
@@ -3036,7 +3025,7 @@ class OrdersTab(QWidget):
     def _calculate_material_requirements(self):
         requirements = defaultdict(list)
 
-        for item_type, item_id, quantity in self.current_order:
+        for item_type, item_id, quantity, *_ in self.current_order:
             if item_type == "Изделие":
                 conn = sqlite3.connect(self.db_path)
                 cursor = conn.cursor()
@@ -3044,7 +3033,7 @@ class OrdersTab(QWidget):
                 cursor.execute("SELECT name FROM products WHERE id = ?", (item_id,))
                 product_name = cursor.fetchone()[0]
 
-                cursor.execute("""SELECT m.name, m.type, pc.quantity, pc.length
+                cursor.execute("""SELECT m.name, m.type, pc.quantity, pc.length_mm
                 FROM product_composition pc
                 JOIN materials m ON pc.material_id = m.id
                 WHERE pc.product_id = ?""", (item_id,))
@@ -3052,9 +3041,9 @@ class OrdersTab(QWidget):
                 for material, mtype, comp_quantity, length in cursor.fetchall():
                     if mtype == "Пиломатериал" and length:
                         for _ in range(int(comp_quantity * quantity)):
-                            requirements[material].append((length, product_name))
+                            requirements[material].append(Requirement(length, product_name))
                     else:
-                        requirements[material].append((comp_quantity * quantity, product_name))
+                        requirements[material].append(Requirement(comp_quantity * quantity, product_name))
                 conn.close()
 
             else:  # Этап
@@ -3066,7 +3055,7 @@ class OrdersTab(QWidget):
 
                 # Материалы из изделий в этапе
                 cursor.execute("""
-                SELECT m.name, m.type, pc.quantity, pc.length, sp.quantity as stage_qty, p.name as product_name
+                SELECT m.name, m.type, pc.quantity, pc.length_mm, sp.quantity as stage_qty, p.name as product_name
                 FROM stage_products sp
                 JOIN products p ON sp.product_id = p.id
                 JOIN product_composition pc ON sp.product_id = pc.product_id
@@ -3080,13 +3069,13 @@ class OrdersTab(QWidget):
 
                     if mtype == "Пиломатериал" and length:
                         for _ in range(int(total_qty)):
-                            requirements[material].append((length, item_description))
+                            requirements[material].append(Requirement(length, item_description))
                     else:
-                        requirements[material].append((total_qty, item_description))
+                        requirements[material].append(Requirement(total_qty, item_description))
 
                 # Материалы напрямую в этапе
                 cursor.execute("""
-                SELECT m.name, m.type, sm.quantity, sm.length
+                SELECT m.name, m.type, sm.quantity, sm.length_mm
                 FROM stage_materials sm
                 JOIN materials m ON sm.material_id = m.id
                 WHERE sm.stage_id = ?
@@ -3096,9 +3085,9 @@ class OrdersTab(QWidget):
                     total_qty = sm_quantity * quantity
                     if mtype == "Пиломатериал" and length:
                         for _ in range(int(total_qty)):
-                            requirements[material].append((length, stage_name))
+                            requirements[material].append(Requirement(length, stage_name))
                     else:
-                        requirements[material].append((total_qty, stage_name))
+                        requirements[material].append(Requirement(total_qty, stage_name))
 
                 conn.close()
 
@@ -3110,8 +3099,8 @@ class OrdersTab(QWidget):
             conn = sqlite3.connect(self.db_path)
             cursor = conn.cursor()
             cursor.execute(
-                'SELECT m.name, w.length, w.quantity FROM warehouse w JOIN materials m ON w.material_id = m.id')
-            return cursor.fetchall()
+                'SELECT m.name, w.length_mm, w.quantity FROM warehouse w JOIN materials m ON w.material_id = m.id')
+            return [StockLot._make(row) for row in cursor.fetchall()]
         finally:
             if conn:
                 conn.close()
@@ -3126,31 +3115,24 @@ class OrdersTab(QWidget):
             total_cost = 0.0
             order_details = []
 
-            for item_type, item_id, quantity in self.current_order:
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
-                if item_type == "Изделие":
-                    cursor.execute("SELECT name, cost FROM products WHERE id = ?", (item_id,))
-                    name, cost = cursor.fetchone()
-                    total_cost += cost * quantity
-                    order_details.append(('product', item_id, name, quantity, cost * quantity, None))
-                else:
-                    cursor.execute("SELECT name FROM stages WHERE id = ?", (item_id,))
-                    row_stage = cursor.fetchone()
-                    name = row_stage if row_stage else f"Этап #{item_id}"
-                    length_m = self._get_row_length_for_stage(item_id)
-                    cost = self._compute_stage_cost(item_id, length_m)
-                    total_cost += cost
-                    order_details.append(('stage', item_id, name, 1, cost, length_m))
-
-                conn.close()
+            # Себестоимость позиций уже посчитана моделью по текущей версии каталога.
+            # Трос и зажимы входят в себестоимость, раскрой и списание со склада,
+            # но позициями заказа не сохраняются (order_items - изделия и этапы)
+            for line in self.order_model.lines():
+                total_cost += line.cost
+                if line.item_type == "Изделие":
+                    order_details.append(('product', line.item_id, line.name, line.quantity, line.cost, None))
+                elif line.item_type == "Этап":
+                    order_details.append(('stage', line.item_id, line.name, 1, line.cost, line.length_m))
 
             # Единая сборка требований для раскроя
             _, requirements = self._expand_order_to_requirements()
 
             stock_items = self._get_current_stock()
             optimizer = CuttingOptimizer()
-            result = optimizer.optimize_cutting(requirements, stock_items, self.db_path)
+            result = optimizer.optimize_cutting(requirements, stock_items, self.db_path,
+                                                previous_result=self.last_cutting_result,
+                                                strategy=self.strategy_combo.currentData())
 
             if not result['can_produce']:
                 error_msg = "Недостаточно материалов:\n" + "\n".join(result['missing'])
@@ -3161,9 +3143,10 @@ class OrdersTab(QWidget):
             if hasattr(self.main_window, 'warehouse_tab'):
                 self.main_window.warehouse_tab.load_data()
 
-            instructions_text = self._generate_instructions_text(total_cost, result, requirements)
-            order_id = self._save_order_to_db(total_cost, order_details, instructions_text)
-            self._generate_pdf(order_id, total_cost, order_details, requirements, instructions_text)
+            # Сохраняется план раскроя; текст инструкций и PDF строятся из него
+            plan = build_plan(result, requirements, CuttingOptimizer._get_material_types(self.db_path))
+            order_id = self._save_order_to_db(total_cost, order_details, plan)
+            self._generate_pdf(order_id)
 
             self.clear_order()
             self.load_order_history()
@@ -3184,7 +3167,9 @@ class OrdersTab(QWidget):
 
                 if result and quantity > 0:
                     mat_id = result[0]
-                    cursor.execute("INSERT INTO warehouse (material_id, length, quantity) VALUES (?, ?, ?)",
+                    cursor.execute("""INSERT INTO warehouse (material_id, length_mm, quantity) VALUES (?, ?, ?)
+                                      ON CONFLICT(material_id, length_mm) DO UPDATE
+                                      SET quantity = quantity + excluded.quantity""",
                                    (mat_id, length, quantity))
             conn.commit()
         except sqlite3.Error as e:
@@ -3193,16 +3178,16 @@ class OrdersTab(QWidget):
         finally:
             conn.close()
 
-    def _save_order_to_db(self, total_cost, order_details, instructions_text):
-        """Сохранение заказа, включая длину этапов в order_items.length_meters"""
+    def _save_order_to_db(self, total_cost, order_details, plan):
+        """Сохранение заказа, включая длину этапов в order_items.length_meters, и его плана раскроя"""
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         order_id = None
 
         try:
             cursor.execute(
-                "INSERT INTO orders (order_date, total_cost, instructions) VALUES (datetime('now'), ?, ?)",
-                (total_cost, instructions_text)
+                "INSERT INTO orders (order_date, total_cost) VALUES (datetime('now'), ?)",
+                (total_cost,)
             )
             order_id = cursor.lastrowid
 
@@ -3224,6 +3209,7 @@ class OrdersTab(QWidget):
                         VALUES (?, NULL, ?, ?, ?, ?, ?, ?)""",
                         (order_id, item_id, 1, length_m, name, cost, 'stage')
                     )
+            save_plan(cursor, order_id, plan)
             conn.commit()
         except sqlite3.Error as e:
             QMessageBox.critical(self, "Ошибка базы данных", f"Ошибка при сохранении заказа: {str(e)}")
@@ -3232,140 +3218,72 @@ class OrdersTab(QWidget):
             conn.close()
         return order_id
 
-    def _generate_pdf(self, order_id, total_cost, order_details, requirements, instructions_text):
-        try:
-            if getattr(sys, 'frozen', False):
-                pdf_dir = os.path.join(os.path.dirname(sys.executable), 'orders')
-            else:
-                pdf_dir = os.path.join(os.path.dirname(self.db_path), 'orders')
-
-            if not os.path.exists(pdf_dir):
-                os.makedirs(pdf_dir)
-
-            pdf_filename = f"{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}_order.pdf"
-            pdf_path = os.path.join(pdf_dir, pdf_filename)
-
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute("UPDATE orders SET pdf_filename = ? WHERE id = ?", (pdf_filename, order_id))
-            conn.commit()
-            conn.close()
-
-            doc = SimpleDocTemplate(pdf_path, pagesize=letter)
-            styles = getSampleStyleSheet()
-            if ARIAL_FONT_REGISTERED:
-                from reportlab.lib.styles import ParagraphStyle
-                title_style = ParagraphStyle('CustomTitle', parent=styles['Title'], fontName='Arial', fontSize=16,
-                                             spaceAfter=12)
-                heading_style = ParagraphStyle('CustomHeading', parent=styles['Heading2'], fontName='Arial',
-                                               fontSize=14, spaceAfter=6)
-                normal_style = ParagraphStyle('CustomNormal', parent=styles['Normal'], fontName='Arial', fontSize=12)
-            else:
-                title_style = styles['Title']
-                heading_style = styles['Heading2']
-                normal_style = styles['Normal']
-
-            story = []
-            story.append(Paragraph(f"Заказ от {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", title_style))
-            story.append(Spacer(1, 12))
-
-            sale_price = total_cost * 2
-            story.append(Paragraph(f"Себестоимость: {total_cost:.2f} руб", heading_style))
-            story.append(Paragraph(f"Цена реализации: {sale_price:.2f} руб", heading_style))
-            story.append(Spacer(1, 12))
-
-            # Состав заказа (печатаем длину для этапов)
-            story.append(Paragraph("Состав заказа:", heading_style))
-            for item_type, _, name, quantity, cost, length_m in order_details:
-                type_text = "Изделие" if item_type == 'product' else "Этап"
-                line = f"- {name} ({type_text}): {quantity} шт"
-                if item_type == 'stage' and length_m:
-                    line += f", длина {length_m:.2f} м"
-                story.append(Paragraph(line, normal_style))
-
-            # Сводка материалов (агрегировано)
-            story.append(Spacer(1, 12))
-            story.append(Paragraph("Сводка материалов:", heading_style))
-            material_types = CuttingOptimizer._get_material_types(self.db_path)
-
-            totals_lumber = {}  # м
-            totals_fasteners = {}  # шт
-            for material, items in requirements.items():
-                is_lumber = material_types.get(material) == "Пиломатериал"
-                total = 0.0
-                for val, _ in items:
-                    total += float(val)
-                if is_lumber:
-                    totals_lumber[material] = totals_lumber.get(material, 0.0) + total
-                else:
-                    totals_fasteners[material] = totals_fasteners.get(material, 0.0) + total
+    def _order_pdf(self, order_id):
+        """Путь к PDF заказа: готовый из кэша или построенный заново по данным БД"""
+        report = load_order_report(self.db_path, order_id)
+        if report is None:
+            return None
+        return self.pdf_cache.get(report_key(report), lambda path: render_order_pdf(path, report))
 
-            if totals_lumber:
-                story.append(Paragraph("Пиломатериалы:", normal_style))
-                for mat, amount in sorted(totals_lumber.items()):
-                    story.append(Paragraph(f"• {mat}: {amount:.2f} м", normal_style))
-
-            if totals_fasteners:
-                story.append(Paragraph("Метизы:", normal_style))
-                for mat, amount in sorted(totals_fasteners.items()):
-                    story.append(Paragraph(f"• {mat}: {amount:.0f} шт", normal_style))
-
-            # Инструкции распила (уже отфильтрованы от тросов)
-            if instructions_text:
-                story.append(Spacer(1, 12))
-                story.append(Paragraph("Инструкции:", heading_style))
-                story.append(Paragraph(instructions_text.replace('\n', '<br/>'), normal_style))
-
-            doc.build(story)
+    def _generate_pdf(self, order_id):
+        try:
+            pdf_path = self._order_pdf(order_id)
             QMessageBox.information(self, "PDF", f"PDF заказа сохранён: {pdf_path}")
         except Exception as e:
             print(f"Ошибка при генерации PDF: {str(e)}")
 
     def _generate_instructions_text(self, total_cost, result, requirements):
-        instructions = ""
-        material_types = CuttingOptimizer._get_material_types(self.db_path)
-        skip_cut_instructions = {"Трос М8", "Трос М10", "Трос М12"}  # не выводим распил для этих материалов
-
-        if result.get('cutting_instructions'):
-            for material, material_instructions in result['cutting_instructions'].items():
-                # Скрыть раздел распила для тросов
-                if material in skip_cut_instructions:
-                    continue
-                # Метизы также не имеют распила
-                if material_types.get(material) == "Метиз":
-                    continue
+        return render_instructions(build_plan(result, requirements, {}))
 
-                instructions += f"Материал: {material}\n"
-                for i, instr in enumerate(material_instructions, 1):
-                    instructions += f"{i}. {instr}\n\n"
-
-        if not instructions.strip():
-            instructions = "Инструкции по распилу не требуются."
-        return instructions.strip()
+    def search_order_history(self, text):
+        """Заказы по строке поиска, самые релевантные сверху; пустая строка - вся история"""
+        if not text.strip():
+            self.load_order_history()
+            return
+        self.history_exhausted = True  # результаты поиска не догружаются прокруткой
+        try:
+            self._fill_history(search_orders(self.db_path, text))
+        except sqlite3.Error as e:
+            print(f"Ошибка поиска по истории: {e}")
+
+    def _fill_history(self, orders, append=False):
+        """orders: [(id, дата, позиций, сумма), ...]; append - дописать после уже показанных"""
+        start = self.history_table.rowCount() if append else 0
+        self.history_table.setRowCount(start + len(orders))
+        for row_idx, (order_id, date, items_count, total_cost) in enumerate(orders, start):
+            self.history_table.setItem(row_idx, 0, QTableWidgetItem(str(order_id)))
+            self.history_table.setItem(row_idx, 1, QTableWidgetItem(date))
+            self.history_table.setItem(row_idx, 2, QTableWidgetItem(str(items_count)))
+            self.history_table.setItem(row_idx, 3, QTableWidgetItem(f"{total_cost:.2f} руб"))
 
     def load_order_history(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        """Первая страница истории; следующие догружаются при прокрутке вниз"""
+        if self.history_search_input.text().strip():
+            # Открыт поиск - обновляем его результаты
+            self.search_order_history(self.history_search_input.text())
+            return
+        self.history_table.setRowCount(0)
+        self.history_after = None
+        self.history_exhausted = False
+        self.load_more_history()
+
+    def load_more_history(self):
+        """Дописывает в таблицу следующую страницу истории"""
+        if self.history_exhausted:
+            return
         try:
-            cursor.execute("""SELECT o.id, o.order_date, o.total_cost, 
-            SUM(oi.quantity) as total_items
-            FROM orders o
-            JOIN order_items oi ON o.id = oi.order_id
-            GROUP BY o.id
-            ORDER BY o.order_date DESC""")
-            orders = cursor.fetchall()
-
-            self.history_table.setRowCount(len(orders))
-            for row_idx, (order_id, date, total_cost, items_count) in enumerate(orders):
-                self.history_table.setItem(row_idx, 0, QTableWidgetItem(str(order_id)))
-                self.history_table.setItem(row_idx, 1, QTableWidgetItem(date))
-                self.history_table.setItem(row_idx, 2, QTableWidgetItem(str(items_count)))
-                self.history_table.setItem(row_idx, 3, QTableWidgetItem(f"{total_cost:.2f} руб"))
-
+            page = load_history_page(self.db_path, self.history_after)
         except sqlite3.Error as e:
             QMessageBox.critical(self, "Ошибка базы данных", f"Ошибка загрузки истории: {str(e)}")
-        finally:
-            conn.close()
+            return
+        self.history_exhausted = len(page) < HISTORY_PAGE
+        if page:
+            self.history_after = (page[-1][1], page[-1][0])
+            self._fill_history(page, append=True)
+
+    def on_history_scrolled(self, value):
+        if value >= self.history_table.verticalScrollBar().maximum():
+            self.load_more_history()
 
     def show_order_details(self, row, column):
         order_id = self.history_table.item(row, 0).text()
@@ -3376,8 +3294,9 @@ class OrdersTab(QWidget):
                        (order_id,))
         items = cursor.fetchall()
 
-        cursor.execute("SELECT order_date, total_cost, instructions FROM orders WHERE id = ?", (order_id,))
-        order_date, total_cost, instructions = cursor.fetchone()
+        cursor.execute("SELECT order_date, total_cost FROM orders WHERE id = ?", (order_id,))
+        order_date, total_cost = cursor.fetchone()
+        instructions = order_instructions(cursor, int(order_id))
         conn.close()
 
         dialog = QDialog(self)
@@ -3392,6 +3311,8 @@ class OrdersTab(QWidget):
         for name, quantity, cost, item_type in items:
             type_text = "Изделие" if item_type == 'product' else "Этап"
             items_text += f"- {name} ({type_text}): {quantity} шт ({cost:.2f} руб)\n"
+        if instructions:
+            items_text += f"\nИнструкции:\n{instructions}\n"
 
         items_label = QTextEdit(items_text)
         items_label.setReadOnly(True)
@@ -3404,34 +3325,75 @@ class OrdersTab(QWidget):
         dialog.setLayout(layout)
         dialog.exec_()
 
-    # ИСПРАВЛЕНИЕ: Новые методы для работы с PDF
-    def open_pdf_file(self, order_id):
-        """Открывает PDF файл для указанного заказа"""
-        try:
-            # Получаем имя PDF файла из БД
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute("SELECT pdf_filename FROM orders WHERE id = ?", (order_id,))
-            result = cursor.fetchone()
-            conn.close()
-
-            if not result or not result[0]:
-                QMessageBox.warning(self, "PDF не найден", "PDF файл для этого заказа не создан")
+    def _ask_export_period(self):
+        """Период экспорта ('ГГГГ-ММ-ДД', 'ГГГГ-ММ-ДД'); по умолчанию - текущий месяц. None - отмена"""
+        dialog = QDialog(self)
+        dialog.setWindowTitle("Экспорт заказов за период")
+        layout = QFormLayout()
+        today = QDate.currentDate()
+        date_from = QDateEdit(QDate(today.year(), today.month(), 1))
+        date_to = QDateEdit(today)
+        for edit in (date_from, date_to):
+            edit.setCalendarPopup(True)
+            edit.setDisplayFormat("yyyy-MM-dd")
+        layout.addRow("С:", date_from)
+        layout.addRow("По:", date_to)
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        buttons.accepted.connect(dialog.accept)
+        buttons.rejected.connect(dialog.reject)
+        layout.addRow(buttons)
+        dialog.setLayout(layout)
+        if dialog.exec_() != QDialog.Accepted:
+            return None
+        return date_from.date().toString("yyyy-MM-dd"), date_to.date().toString("yyyy-MM-dd")
+
+    def export_order_pdfs(self):
+        """PDF выбранных в истории заказов, а без выбора - заказов за период, в архив или один файл"""
+        order_ids = sorted({int(self.history_table.item(index.row(), 0).text())
+                            for index in self.history_table.selectionModel().selectedRows()})
+        if not order_ids:
+            period = self._ask_export_period()
+            if period is None:
+                return
+            order_ids = orders_in_range(self.db_path, *period)
+            if not order_ids:
+                QMessageBox.information(self, "Экспорт PDF", "За выбранный период заказов нет")
                 return
 
-            pdf_filename = result[0]
+        out_path, _ = QFileDialog.getSaveFileName(self, "Экспорт PDF заказов", "orders.zip",
+                                                  "Архив ZIP (*.zip);;Один PDF (*.pdf)")
+        if not out_path:
+            return
+
+        progress = QProgressDialog("Построение PDF заказов...", None, 0, len(order_ids), self)
+        progress.setWindowTitle("Экспорт PDF")
+        progress.setWindowModality(Qt.WindowModal)
+        progress.setMinimumDuration(0)
 
-            # Определяем путь к PDF файлу
-            if getattr(sys, 'frozen', False):
-                pdf_dir = os.path.join(os.path.dirname(sys.executable), 'orders')
-            else:
-                pdf_dir = os.path.join(os.path.dirname(self.db_path), 'orders')
+        def report_progress(done, total):
+            progress.setValue(done)
+            QApplication.processEvents()
 
-            pdf_path = os.path.join(pdf_dir, pdf_filename)
+        try:
+            count = export_orders(self.db_path, order_ids, out_path, self.pdf_cache, progress=report_progress)
+        except Exception as e:
+            QMessageBox.critical(self, "Ошибка", f"Не удалось экспортировать PDF:\n{str(e)}")
+            return
+        finally:
+            progress.close()
+        if not count:
+            QMessageBox.warning(self, "Экспорт PDF", "Выбранные заказы не найдены - файл не создан")
+            return
+        QMessageBox.information(self, "Экспорт PDF", f"Экспортировано заказов: {count}\n{out_path}")
 
-            if not os.path.exists(pdf_path):
-                QMessageBox.warning(self, "Файл не найден",
-                                    f"PDF файл не найден:\n{pdf_path}")
+    # ИСПРАВЛЕНИЕ: Новые методы для работы с PDF
+    def open_pdf_file(self, order_id):
+        """Открывает PDF файл для указанного заказа"""
+        try:
+            # PDF строится по данным заказа, если его нет в кэше
+            pdf_path = self._order_pdf(order_id)
+            if pdf_path is None:
+                QMessageBox.warning(self, "Заказ не найден", f"Заказ №{order_id} не найден")
                 return
 
             # Открываем PDF файл кроссплатформенно
@@ -3469,6 +3431,11 @@ class MainWindow(QMainWindow):
     def __init__(self, db_path):
         super().__init__()
         self.db_path = db_path
+        # Справочники в памяти: вкладки берут списки отсюда и подписаны на изменения
+        self.catalog = Catalog(db_path, self)
+        # Развернутые составы изделий - общие для вкладок изделий и заказов
+        self.bom = BomResolver(db_path)
+        self.catalog.products_changed.connect(self.on_products_changed)
         self.setWindowTitle("Учет деревообрабатывающего цеха - ИСПРАВЛЕНО")
         self.setGeometry(100, 100, 1200, 900)
 
@@ -3477,27 +3444,27 @@ class MainWindow(QMainWindow):
         self.refresh_btn.setFixedSize(150, 30)
         self.refresh_btn.move(self.width() - 160, 0)
 
+        # Переключение вкладок не обращается к БД: списки обновляются по сигналам каталога
         self.tabs = QTabWidget()
         self.setCentralWidget(self.tabs)
-        self.tabs.currentChanged.connect(self.on_tab_changed)
 
         # Существующие вкладки
-        self.materials_tab = MaterialsTab(db_path)
+        self.materials_tab = MaterialsTab(db_path, self.catalog)
         self.materials_tab.main_window_ref = self
         self.tabs.addTab(self.materials_tab, "Материалы")
 
-        self.warehouse_tab = WarehouseTab(db_path, self)
+        self.warehouse_tab = WarehouseTab(db_path, self, self.catalog)
         self.tabs.addTab(self.warehouse_tab, "Склад")
 
-        self.products_tab = ProductsTab(db_path, self)
+        self.products_tab = ProductsTab(db_path, self, self.catalog)
         self.tabs.addTab(self.products_tab, "Изделия")
 
         # ИСПРАВЛЕННАЯ ВКЛАДКА ЭТАПОВ
-        self.stages_tab = StagesTab(db_path, self)
+        self.stages_tab = StagesTab(db_path, self, self.catalog)
         self.tabs.addTab(self.stages_tab, "Этапы")
 
         # ИСПРАВЛЕННАЯ ВКЛАДКА ЗАКАЗОВ
-        self.orders_tab = OrdersTab(db_path, self)
+        self.orders_tab = OrdersTab(db_path, self, self.catalog)
         self.tabs.addTab(self.orders_tab, "Заказы")
 
         self.refresh_btn.setParent(self)
@@ -3505,37 +3472,14 @@ class MainWindow(QMainWindow):
 
         self.statusBar().showMessage("Готово - все ошибки исправлены!")
 
-    def on_tab_changed(self, index):
-        tab_name = self.tabs.tabText(index)
-
-        if tab_name == "Склад":
-            self.warehouse_tab.load_materials()
-        elif tab_name == "Изделия":
-            self.products_tab.load_materials()
-        elif tab_name == "Этапы":
-            self.stages_tab.load_products()
-            self.stages_tab.load_materials()
-        elif tab_name == "Заказы":
-            # ИСПРАВЛЕНИЕ 3: Загружаем правильный тип по умолчанию
-            current_type = self.orders_tab.item_type_combo.currentText()
-            if current_type == "Изделие":
-                self.orders_tab.load_products()
-            else:
-                self.orders_tab.load_stages()
-            self.orders_tab.load_order_history()
+    def on_products_changed(self, product_ids):
+        # Развернутые составы, куда входят изменившиеся изделия, устарели
+        for product_id in product_ids:
+            self.bom.invalidate(product_id)
 
     def update_all_comboboxes(self):
-        self.warehouse_tab.load_materials()
-        self.products_tab.load_materials()
-        self.stages_tab.load_products()
-        self.stages_tab.load_materials()
-
-        # ИСПРАВЛЕНИЕ 3: Обновляем правильный список в заказах
-        current_type = self.orders_tab.item_type_combo.currentText()
-        if current_type == "Изделие":
-            self.orders_tab.load_products()
-        else:
-            self.orders_tab.load_stages()
+        """Перечитывает каталог из БД; вкладки обновят списки по сигналам"""
+        self.catalog.load()
 
     def resizeEvent(self, event):
         super().resizeEvent(event)
@@ -3545,6 +3489,8 @@ class MainWindow(QMainWindow):
         """Перезагружает данные во всех вкладках"""
         self.products_tab.recalculate_all_products_cost()
         self.stages_tab.recalculate_all_stages_cost()
+        # Данные могли смениться целиком (git pull) - каталог перечитывается и оповещает вкладки
+        self.catalog.load()
 
         self.materials_tab.load_data()
         self.warehouse_tab.load_data()
@@ -3552,13 +3498,6 @@ class MainWindow(QMainWindow):
         self.stages_tab.load_stages()
         self.orders_tab.load_order_history()
 
-        # ИСПРАВЛЕНИЕ 3: Правильное обновление списков в заказах
-        current_type = self.orders_tab.item_type_combo.currentText()
-        if current_type == "Изделие":
-            self.orders_tab.load_products()
-        else:
-            self.orders_tab.load_stages()
-
         self.statusBar().showMessage("Данные обновлены", 3000)
 
     def force_close_all_db_connections(self):
@@ -1,9 +1,11 @@
 # main.py - исправленная версия без тестовых этапов
+import multiprocessing
 import sys
 import os
 from gui import MainWindow
 from PyQt5.QtWidgets import QApplication
 from database import create_database, add_stage_category_column
+from db_dump import default_dump_dir, load_dump
 
 
 def get_db_path():
@@ -29,6 +31,8 @@ def get_db_path():
 
 
 if __name__ == "__main__":
+    # Пакетный экспорт PDF запускает процессы - в собранном exe они стартуют через freeze_support
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
     db_path = get_db_path()
 
@@ -37,6 +41,11 @@ if __name__ == "__main__":
     if not os.path.exists(data_dir):
         os.makedirs(data_dir)
 
+    # В репозитории хранится текстовый снимок базы: в новой копии база собирается из него
+    dump_dir = default_dump_dir(db_path)
+    if not os.path.exists(db_path) and os.path.isdir(dump_dir):
+        load_dump(dump_dir, db_path)
+
     create_database(db_path)
     add_stage_category_column(db_path)
 
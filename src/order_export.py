@@ -0,0 +1,165 @@
+# order_export.py - пакетный экспорт PDF заказов
+#
+# Отчеты строятся параллельно в пуле процессов: у каждого процесса свое
+# соединение с БД только на чтение, готовые PDF кладутся в общий PdfCache
+# (после смены шаблона REPORT_FORMAT меняет ключи, и экспорт заодно
+# перестраивает кэш). Из файлов кэша собирается zip-архив или один общий
+# PDF; вытесняет кэш только родительский процесс, когда результат записан.
+#
+# Запуск из командной строки:
+#   python order_export.py data/database.db --from 2025-08-01 --to 2025-08-31 -o август.zip
+#   python order_export.py data/database.db --ids 12 15 40 -o заказы.pdf
+import multiprocessing
+import os
+import zipfile
+
+from reportlab.lib.pagesizes import letter
+from reportlab.platypus import PageBreak, SimpleDocTemplate
+
+from database import connect_read_only
+from order_report import read_order_report, render_order_pdf, report_flowables, report_key
+from pdf_cache import PdfCache
+
+try:
+    from pypdf import PdfWriter
+except ImportError:  # pypdf не обязателен: без него общий PDF собирается заново одним процессом
+    PdfWriter = None
+
+_worker = {}
+
+
+def _init_worker(db_path, cache_dir):
+    _worker['conn'] = connect_read_only(db_path)
+    _worker['cache'] = PdfCache(cache_dir, max_bytes=None)
+
+
+def _render_order(order_id):
+    """PDF заказа в общем кэше: (id, дата, путь) или (id, None, None), если заказа нет"""
+    report = read_order_report(_worker['conn'].cursor(), order_id)
+    if report is None:
+        return order_id, None, None
+    path = _worker['cache'].get(report_key(report), lambda target: render_order_pdf(target, report))
+    return order_id, report['date'], path
+
+
+def render_orders(db_path, order_ids, cache_dir, workers=None, progress=None):
+    """
+    Строит PDF заказов в пуле процессов.
+
+    :param workers: Число процессов (None - по числу ядер); 1 - без пула
+    :param progress: progress(готово, всего) после каждого заказа
+    :return: {id: (дата, путь)} для найденных заказов
+    """
+    total = len(order_ids)
+    workers = min(workers or os.cpu_count() or 1, total)
+    results = {}
+
+    def collect(rendered):
+        for done, (order_id, date, path) in enumerate(rendered, 1):
+            if path is not None:
+                results[order_id] = (date, path)
+            if progress:
+                progress(done, total)
+
+    if workers <= 1:
+        _init_worker(db_path, cache_dir)
+        try:
+            collect(map(_render_order, order_ids))
+        finally:
+            _worker.pop('conn').close()
+    else:
+        with multiprocessing.Pool(workers, _init_worker, (db_path, cache_dir)) as pool:
+            collect(pool.imap_unordered(_render_order, order_ids))
+    return results
+
+
+def write_zip(out_path, order_ids, rendered):
+    """Архив с PDF заказов: order_<id>_<дата>.pdf"""
+    with zipfile.ZipFile(out_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for order_id in order_ids:
+            if order_id in rendered:
+                date, path = rendered[order_id]
+                archive.write(path, f"order_{order_id}_{date[:10]}.pdf")
+
+
+def write_merged(out_path, order_ids, rendered, db_path):
+    """Один PDF со всеми заказами подряд"""
+    if PdfWriter is not None:
+        writer = PdfWriter()
+        for order_id in order_ids:
+            if order_id in rendered:
+                writer.append(rendered[order_id][1])
+        with open(out_path, 'wb') as output:
+            writer.write(output)
+        return
+
+    conn = connect_read_only(db_path)
+    try:
+        flowables = []
+        for order_id in order_ids:
+            if order_id in rendered:
+                if flowables:
+                    flowables.append(PageBreak())
+                flowables.extend(report_flowables(read_order_report(conn.cursor(), order_id)))
+    finally:
+        conn.close()
+    SimpleDocTemplate(out_path, pagesize=letter).build(flowables)
+
+
+def export_orders(db_path, order_ids, out_path, cache, workers=None, progress=None):
+    """
+    Экспорт заказов в out_path: *.zip - архив отдельных PDF, иначе один общий PDF.
+
+    :param cache: PdfCache приложения - в его папку строятся отчеты
+    :return: Число экспортированных заказов; 0 - ни одного заказа не найдено, out_path не тронут
+    """
+    if not order_ids:
+        return 0
+    rendered = render_orders(db_path, order_ids, cache.directory, workers, progress)
+    if not rendered:
+        return 0
+    # Пишем во временный файл: недописанный архив не должен остаться под именем результата
+    partial = f"{out_path}.{os.getpid()}.tmp"
+    try:
+        if out_path.lower().endswith(".zip"):
+            write_zip(partial, order_ids, rendered)
+        else:
+            write_merged(partial, order_ids, rendered, db_path)
+        os.replace(partial, out_path)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    cache.evict()
+    return len(rendered)
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+    import time
+
+    from order_history import orders_in_range
+
+    parser = argparse.ArgumentParser(description="Пакетный экспорт PDF заказов")
+    parser.add_argument("db_path")
+    parser.add_argument("-o", "--output", required=True, help="*.zip - архив, *.pdf - общий документ")
+    parser.add_argument("--ids", type=int, nargs="+", help="Номера заказов")
+    parser.add_argument("--from", dest="date_from", help="Первый день ГГГГ-ММ-ДД")
+    parser.add_argument("--to", dest="date_to", help="Последний день ГГГГ-ММ-ДД")
+    parser.add_argument("--workers", type=int, help="Число процессов (по умолчанию - по числу ядер)")
+    parser.add_argument("--cache", help="Папка кэша PDF (по умолчанию - pdf_cache рядом с БД)")
+    args = parser.parse_args()
+
+    order_ids = args.ids or orders_in_range(args.db_path, args.date_from, args.date_to)
+    cache = PdfCache(args.cache or os.path.join(os.path.dirname(os.path.abspath(args.db_path)), 'pdf_cache'))
+
+    def report_progress(done, total):
+        print(f"\r{done}/{total}", end="", flush=True)
+
+    started = time.perf_counter()
+    count = export_orders(args.db_path, order_ids, args.output, cache, args.workers, report_progress)
+    if not count:
+        print("\nЗаказов для экспорта нет - файл не создан")
+        sys.exit(1)
+    print(f"\nЭкспортировано заказов: {count} из {len(order_ids)} за {time.perf_counter() - started:.1f} с"
+          f" -> {args.output}")
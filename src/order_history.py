@@ -0,0 +1,148 @@
+# order_history.py - список и поиск по истории заказов
+#
+# Список читается страницами по HISTORY_PAGE заказов: следующая страница
+# начинается после последнего показанного заказа (ключ - дата и id), поэтому
+# каждая страница - один проход по индексу idx_orders_date, сколько бы
+# заказов ни было в истории. Число позиций хранится в orders.items_count.
+#
+# Поиск идет по FTS5-индексу order_search (database.create_order_search_index):
+# дата заказа, названия позиций и слова инструкций раскроя (у заказов с планом -
+# названия материалов и изделий плана). Результаты
+# ранжируются по bm25, совпадение в названиях позиций весит больше всего.
+import sqlite3
+
+SEARCH_LIMIT = 200
+HISTORY_PAGE = 100
+
+HISTORY_PAGE_SQL = """
+    SELECT id, order_date, items_count, total_cost
+    FROM orders
+    {where}
+    ORDER BY order_date DESC, id DESC
+    LIMIT ?"""
+
+# Веса столбцов order_search для bm25: дата, позиции, инструкции
+SEARCH_SQL = """
+    SELECT o.id, o.order_date, o.items_count, o.total_cost
+    FROM order_search
+    JOIN orders o ON o.id = order_search.rowid
+    WHERE order_search MATCH ?
+    ORDER BY bm25(order_search, 2.0, 5.0, 1.0), o.order_date DESC
+    LIMIT ?"""
+
+
+def load_history_page(db_path, after=None, limit=HISTORY_PAGE):
+    """
+    Страница истории заказов, новые сверху.
+
+    :param after: (дата, id) последнего заказа предыдущей страницы; None - первая страница
+    :return: [(id, дата, позиций, сумма), ...] - не больше limit заказов
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        if after is None:
+            return conn.execute(HISTORY_PAGE_SQL.format(where=""), (limit,)).fetchall()
+        date, order_id = after
+        return conn.execute(HISTORY_PAGE_SQL.format(where="WHERE (order_date, id) < (?, ?)"),
+                            (date, order_id, limit)).fetchall()
+    finally:
+        conn.close()
+
+
+def orders_in_range(db_path, date_from=None, date_to=None):
+    """
+    Id заказов за период по дате заказа, старые сверху.
+
+    :param date_from: Первый день 'ГГГГ-ММ-ДД' (None - с начала истории)
+    :param date_to: Последний день включительно (None - до конца)
+    """
+    conditions, params = [], []
+    if date_from:
+        conditions.append("order_date >= ?")
+        params.append(date_from)
+    if date_to:
+        conditions.append("order_date < date(?, '+1 day')")
+        params.append(date_to)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute(f"SELECT id FROM orders {where} ORDER BY order_date, id", params).fetchall()
+    finally:
+        conn.close()
+    return [order_id for order_id, in rows]
+
+
+def fts_query(text):
+    """
+    Запрос FTS5 из строки пользователя: каждое слово - фраза с поиском по
+    началу слова, все слова обязательны. "2025-08" ищется как дата.
+
+    :return: Строка для MATCH или None, если искать нечего
+    """
+    terms = ['"' + word.replace('"', '""') + '"*' for word in text.split()]
+    return " AND ".join(terms) or None
+
+
+def search_orders(db_path, text, limit=SEARCH_LIMIT):
+    """
+    Заказы, подходящие под строку поиска, в порядке релевантности.
+
+    :return: [(id, дата, позиций, сумма), ...]
+    """
+    query = fts_query(text)
+    if query is None:
+        return []
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute(SEARCH_SQL, (query, limit)).fetchall()
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    # Поиск по нескольким годам истории с длинными инструкциями
+    import os
+    import random
+    import sys
+    import tempfile
+    import time
+
+    from database import create_database
+
+    random.seed(11)
+    N = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    words = ["Бревно", "Доска", "Брус", "отрезок", "остаток", "Площадка", "Лестница", "Мост", "Сетка",
+             "Канат", "Тарзанка", "Балка", "Стойка", "Трос", "Зажим", "Кольцо", "Переход", "Бум"]
+    db_path = os.path.join(tempfile.mkdtemp(), "history.db")
+    create_database(db_path)
+
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    started = time.perf_counter()
+    for order_id in range(1, N + 1):
+        date = f"{random.randint(2021, 2025)}-{random.randint(1, 12):02d}-{random.randint(1, 28):02d} 12:00:00"
+        instructions = "\n".join(f"{random.choice(words)} {random.randint(100, 6000)} мм: "
+                                 + " ".join(random.choices(words, k=8)) for _ in range(30))
+        cursor.execute("INSERT INTO orders (id, order_date, total_cost, instructions) VALUES (?, ?, ?, ?)",
+                       (order_id, date, random.uniform(1000, 90000), instructions))
+        cursor.executemany("""INSERT INTO order_items (order_id, quantity, product_name, cost)
+                              VALUES (?, 1, ?, 0)""",
+                           [(order_id, f"{random.choice(words)} {random.randint(1, 40)}") for _ in range(5)])
+    conn.commit()
+    conn.close()
+    print(f"{N} заказов с индексом: {time.perf_counter() - started:.1f} с")
+
+    started = time.perf_counter()
+    page = load_history_page(db_path)
+    print(f"Первая страница: {(time.perf_counter() - started) * 1000:.1f} мс")
+    started = time.perf_counter()
+    shown = len(page)
+    while page:
+        page = load_history_page(db_path, (page[-1][1], page[-1][0]))
+        shown += len(page)
+    print(f"Листание всей истории ({shown} заказов): {(time.perf_counter() - started) * 1000:.1f} мс")
+
+    for text in ("Тарзанка 17", "2024-03", "канат зажим", "переход бум стойка"):
+        started = time.perf_counter()
+        found = search_orders(db_path, text)
+        print(f"'{text}': {len(found)} заказов, {(time.perf_counter() - started) * 1000:.1f} мс")
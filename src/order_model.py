@@ -0,0 +1,246 @@
+# order_model.py - состав открытого заказа как модель Qt
+#
+# Позиции заказа хранятся числами (количество, длина, себестоимость), а не
+# текстом ячеек; итог ведется нарастающим при каждой правке. Строка
+# адресуется постоянным id позиции, а не номером строки, поэтому удаление
+# не требует перепривязывать кнопки остальных строк: кнопка "Удалить" и
+# редакторы количества и длины рисует делегат. Номер строки по id хранится
+# в словаре: правка позиции не ищет ее в списке, удаление сдвигает номера
+# только следующих за ней строк.
+from PyQt5.QtCore import QAbstractTableModel, QEvent, QModelIndex, Qt, pyqtSignal
+from PyQt5.QtWidgets import (QApplication, QDoubleSpinBox, QSpinBox, QStyle, QStyledItemDelegate,
+                             QStyleOptionButton)
+
+TYPE, NAME, QUANTITY, LENGTH, COST, ACTIONS = range(6)
+HEADERS = ["Тип", "Название", "Количество", "Длина (м)", "Себестоимость", "Действия"]
+
+
+class OrderLine:
+    """
+    Позиция заказа.
+
+    :ivar quantity: Штуки (int) или метры троса (float)
+    :ivar length_m: Длина этапа в метрах; None - для изделий и материалов
+    :ivar note: Текст колонки длины для позиций без длины (например, число отрезков троса)
+    """
+    __slots__ = ('line_id', 'item_type', 'item_id', 'name', 'quantity', 'length_m', 'cost', 'note')
+
+    def __init__(self, line_id, item_type, item_id, name, quantity, length_m=None, note=""):
+        self.line_id = line_id
+        self.item_type = item_type
+        self.item_id = item_id
+        self.name = name
+        self.quantity = quantity
+        self.length_m = length_m
+        self.note = note
+        self.cost = 0.0
+
+    def as_item(self):
+        """Позиция в формате _expand_order_to_requirements: этап - с длиной"""
+        if self.item_type == "Этап":
+            return self.item_type, self.item_id, self.quantity, self.length_m
+        return self.item_type, self.item_id, self.quantity
+
+
+class OrderModel(QAbstractTableModel):
+    """
+    Позиции открытого заказа с нарастающим итогом.
+
+    :param pricer: Функция себестоимости позиции: pricer(OrderLine) -> руб
+    """
+    total_changed = pyqtSignal(float)
+
+    def __init__(self, pricer, parent=None):
+        super().__init__(parent)
+        self.pricer = pricer
+        self.total = 0.0
+        self._lines = []
+        self._by_id = {}
+        self._rows = {}  # id позиции -> номер строки
+        self._next_id = 1
+
+    # Интерфейс QAbstractTableModel
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._lines)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(HEADERS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return HEADERS[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        line = self._lines[index.row()]
+        column = index.column()
+        if role == Qt.UserRole:
+            return line.line_id
+        if role == Qt.EditRole:
+            return line.length_m if column == LENGTH else line.quantity
+        if role != Qt.DisplayRole:
+            return None
+        if column == TYPE:
+            return line.item_type
+        if column == NAME:
+            return line.name
+        if column == QUANTITY:
+            return f"{line.quantity:.2f}" if isinstance(line.quantity, float) else str(line.quantity)
+        if column == LENGTH:
+            return f"{line.length_m:.2f}" if line.length_m is not None else line.note
+        if column == COST:
+            return f"{line.cost:.2f} руб"
+        return None
+
+    def flags(self, index):
+        flags = super().flags(index)
+        if index.isValid():
+            line = self._lines[index.row()]
+            if ((index.column() == QUANTITY and line.item_type == "Изделие")
+                    or (index.column() == LENGTH and line.item_type == "Этап")):
+                flags |= Qt.ItemIsEditable
+        return flags
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if role != Qt.EditRole or not index.isValid():
+            return False
+        line = self._lines[index.row()]
+        if index.column() == QUANTITY:
+            self.update_line(line.line_id, quantity=int(value))
+        elif index.column() == LENGTH:
+            self.update_line(line.line_id, length_m=float(value))
+        else:
+            return False
+        return True
+
+    # Позиции по id
+    def add_line(self, item_type, item_id, name, quantity, length_m=None, note=""):
+        """Добавляет позицию в конец заказа и возвращает ее id"""
+        line = OrderLine(self._next_id, item_type, item_id, name, quantity, length_m, note)
+        self._next_id += 1
+        line.cost = self.pricer(line)
+
+        row = len(self._lines)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self._lines.append(line)
+        self._by_id[line.line_id] = line
+        self._rows[line.line_id] = row
+        self.endInsertRows()
+        self._add_to_total(line.cost)
+        return line.line_id
+
+    def remove_line(self, line_id):
+        """Удаляет позицию; возвращает удаленную OrderLine или None"""
+        row = self.row_of(line_id)
+        if row is None:
+            return None
+        line = self._by_id.pop(line_id)
+        del self._rows[line_id]
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self._lines[row]
+        for shifted in range(row, len(self._lines)):
+            self._rows[self._lines[shifted].line_id] = shifted
+        self.endRemoveRows()
+        self._add_to_total(-line.cost)
+        return line
+
+    def update_line(self, line_id, quantity=None, length_m=None):
+        """Меняет количество или длину позиции и пересчитывает ее себестоимость"""
+        line = self._by_id[line_id]
+        if quantity is not None:
+            line.quantity = quantity
+        if length_m is not None:
+            line.length_m = length_m
+        old_cost, line.cost = line.cost, self.pricer(line)
+
+        row = self._rows[line_id]
+        self.dataChanged.emit(self.index(row, QUANTITY), self.index(row, COST))
+        self._add_to_total(line.cost - old_cost)
+
+    def line(self, line_id):
+        return self._by_id.get(line_id)
+
+    def lines(self):
+        """Позиции в порядке строк"""
+        return list(self._lines)
+
+    def items(self):
+        """Позиции для расчета требований: [(тип, id, количество[, длина этапа]), ...]"""
+        return [line.as_item() for line in self._lines]
+
+    def row_of(self, line_id):
+        """Номер строки позиции по словарю id -> строка (None - нет такой)"""
+        return self._rows.get(line_id)
+
+    def clear(self):
+        self.beginResetModel()
+        self._lines = []
+        self._by_id = {}
+        self._rows = {}
+        self.endResetModel()
+        self.total = 0.0
+        self.total_changed.emit(self.total)
+
+    def reprice(self):
+        """Пересчитывает себестоимость всех позиций (после изменения справочников)"""
+        if not self._lines:
+            return
+        for line in self._lines:
+            line.cost = self.pricer(line)
+        self.total = sum(line.cost for line in self._lines)
+        self.dataChanged.emit(self.index(0, COST), self.index(len(self._lines) - 1, COST))
+        self.total_changed.emit(self.total)
+
+    def _add_to_total(self, delta):
+        self.total = self.total + delta if self._lines else 0.0
+        self.total_changed.emit(self.total)
+
+
+class OrderDelegate(QStyledItemDelegate):
+    """Кнопка "Удалить" в колонке действий и редакторы количества и длины"""
+    remove_requested = pyqtSignal(int)  # id позиции
+
+    def paint(self, painter, option, index):
+        if index.column() != ACTIONS:
+            super().paint(painter, option, index)
+            return
+        button = QStyleOptionButton()
+        button.rect = option.rect.adjusted(2, 2, -2, -2)
+        button.text = "Удалить"
+        button.state = QStyle.State_Enabled | QStyle.State_Raised
+        QApplication.style().drawControl(QStyle.CE_PushButton, button, painter)
+
+    def editorEvent(self, event, model, option, index):
+        if (index.column() == ACTIONS and event.type() == QEvent.MouseButtonRelease
+                and event.button() == Qt.LeftButton):
+            self.remove_requested.emit(index.data(Qt.UserRole))
+            return True
+        return super().editorEvent(event, model, option, index)
+
+    def createEditor(self, parent, option, index):
+        if index.column() == QUANTITY:
+            editor = QSpinBox(parent)
+            editor.setRange(1, 999)
+        elif index.column() == LENGTH:
+            editor = QDoubleSpinBox(parent)
+            editor.setDecimals(2)
+            editor.setRange(0.01, 9999.0)
+            editor.setSingleStep(0.01)
+        else:
+            return super().createEditor(parent, option, index)
+        return editor
+
+    def setEditorData(self, editor, index):
+        if index.column() in (QUANTITY, LENGTH):
+            editor.setValue(index.data(Qt.EditRole) or 1)
+        else:
+            super().setEditorData(editor, index)
+
+    def setModelData(self, editor, model, index):
+        if index.column() in (QUANTITY, LENGTH):
+            editor.interpretText()
+            model.setData(index, editor.value(), Qt.EditRole)
+        else:
+            super().setModelData(editor, model, index)
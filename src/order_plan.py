@@ -0,0 +1,215 @@
+# order_plan.py - сохраненный план раскроя подтвержденного заказа
+#
+# Вместо готового текста инструкций заказ хранит сам план: доски каждого
+# пиломатериала с отпиленными кусками и остатками, расход метизов и сводку
+# материалов. План - JSON, сжатый zlib, в таблице order_plans; текст
+# инструкций и PDF строятся из него по требованию, а статистику по истории
+# можно считать без разбора строк.
+#
+# Формат (PLAN_FORMAT = 1):
+#   {"materials": [{"name": ..., "boards": [[повторов, длина, остаток, [[длина куска, изделие], ...]], ...]}],
+#    "fasteners": [{"name": ..., "used": [[количество, изделие], ...]}],
+#    "totals": [[материал, "м" | "шт", количество], ...]}
+# Длины - целые миллиметры. Подряд идущие одинаковые доски хранятся одной
+# записью с числом повторов.
+import json
+import zlib
+from collections import Counter
+
+from cutting_optimizer import CuttingOptimizer
+from domain import Board, Cut, StockLot
+
+PLAN_FORMAT = 1
+
+
+def build_plan(result, requirements, material_types):
+    """
+    План заказа из результата optimize_cutting.
+
+    :param requirements: Требования заказа {материал: [Requirement, ...]} - для сводки
+    :param material_types: {материал: тип}
+    """
+    materials = []
+    for material, plan in result.get('plan', {}).items():
+        boards = []
+        for board in plan.boards:
+            if not board.cuts:
+                continue
+            entry = [board.original_length, board.current_length,
+                     [[cut.length, str(cut.product)] for cut in board.cuts]]
+            if boards and boards[-1][1:] == entry:
+                boards[-1][0] += 1
+            else:
+                boards.append([1] + entry)
+        materials.append({'name': material, 'boards': boards})
+
+    fasteners = []
+    for material, req_list in (requirements or {}).items():
+        if material_types.get(material) == "Метиз":
+            fasteners.append({'name': material, 'used': [[value, str(product)] for value, product in req_list]})
+
+    totals = []
+    for material, req_list in sorted((requirements or {}).items()):
+        total = sum(float(value) for value, _ in req_list)
+        if material_types.get(material) == "Пиломатериал":
+            totals.append([material, "м", total / 1000])
+        else:
+            totals.append([material, "шт", total])
+
+    return {'materials': materials, 'fasteners': fasteners, 'totals': totals}
+
+
+def pack_plan(plan):
+    return zlib.compress(json.dumps(plan, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), 9)
+
+
+def unpack_plan(blob):
+    return json.loads(zlib.decompress(blob).decode('utf-8'))
+
+
+def iter_boards(entry):
+    """Доски одного пиломатериала плана по порядку (повторы развернуты)"""
+    for count, original_length, remainder, cuts in entry['boards']:
+        for _ in range(count):
+            yield Board(original_length, remainder, [Cut(length, product) for length, product in cuts])
+
+
+def render_instructions(plan):
+    """Текст инструкций распила - тот же, что показывался при подтверждении заказа"""
+    instructions = ""
+    for entry in plan['materials']:
+        instructions += f"Материал: {entry['name']}\n"
+        for i, board in enumerate(iter_boards(entry), 1):
+            instructions += f"{i}. {CuttingOptimizer._board_instruction(board)}\n\n"
+
+    if not instructions.strip():
+        instructions = "Инструкции по распилу не требуются."
+    return instructions.strip()
+
+
+def plan_usage(plan):
+    """
+    Расход пиломатериалов по плану.
+
+    :return: {материал: (досок, отпилено мм, остатков мм)}
+    """
+    usage = {}
+    for entry in plan['materials']:
+        boards = cut_mm = remainder_mm = 0
+        for count, _, remainder, cuts in entry['boards']:
+            boards += count
+            cut_mm += count * sum(length for length, _ in cuts)
+            remainder_mm += count * remainder
+        usage[entry['name']] = (boards, cut_mm, remainder_mm)
+    return usage
+
+
+def plan_terms(plan):
+    """
+    Слова плана для поиска: названия материалов, метизов и изделий без
+    повторов, в порядке первого появления. Длины и текст инструкций в индекс не
+    попадают - он строится из плана по требованию.
+    """
+    terms = {}
+    for entry in plan['materials']:
+        terms[entry['name']] = None
+        for _, _, _, cuts in entry['boards']:
+            terms.update(dict.fromkeys(product for _, product in cuts))
+    for entry in plan['fasteners']:
+        terms[entry['name']] = None
+        terms.update(dict.fromkeys(product for _, product in entry['used']))
+    return " ".join(terms)
+
+
+def stock_before_plans(stock, plans):
+    """
+    Склад до списания по планам подтвержденных заказов. При подтверждении
+    распиленные доски уходят со склада, а их полезные остатки ложатся на него,
+    поэтому доски возвращаются целиком, остатки снимаются, метизы
+    возвращаются количеством.
+
+    :param stock: Текущий склад [StockLot, ...]
+    :param plans: Планы заказов (load_plan)
+    :return: [StockLot, ...]
+    """
+    lots = Counter()
+    for material, length, quantity in stock:
+        lots[material, length] += quantity
+    for plan in plans:
+        for entry in plan['materials']:
+            for count, original_length, remainder, _ in entry['boards']:
+                lots[entry['name'], original_length] += count
+                if remainder >= CuttingOptimizer.MIN_LENGTH_MM:
+                    lots[entry['name'], remainder] -= count
+        for entry in plan['fasteners']:
+            lots[entry['name'], 0] += sum(quantity for quantity, _ in entry['used'])
+    # Остаток мог уже уйти в следующий заказ - тогда его на складе нет
+    return [StockLot(material, length, quantity) for (material, length), quantity in lots.items() if quantity > 0]
+
+
+def save_plan(cursor, order_id, plan):
+    """
+    Сохраняет план заказа и кладет его слова в поисковый индекс
+    (в orders.instructions текст инструкций больше не хранится).
+    """
+    cursor.execute("INSERT OR REPLACE INTO order_plans (order_id, format, plan) VALUES (?, ?, ?)",
+                   (order_id, PLAN_FORMAT, pack_plan(plan)))
+    index_plan(cursor, order_id, plan)
+
+
+def index_plan(cursor, order_id, plan):
+    """Кладет названия материалов и изделий плана в поисковый индекс заказа"""
+    cursor.execute("UPDATE order_search SET instructions = ? WHERE rowid = ?", (plan_terms(plan), order_id))
+
+
+def index_plans(cursor):
+    """Переиндексирует все сохраненные планы; возвращает их число"""
+    cursor.execute("SELECT order_id, plan FROM order_plans WHERE format = ?", (PLAN_FORMAT,))
+    rows = cursor.fetchall()
+    for order_id, blob in rows:
+        index_plan(cursor, order_id, unpack_plan(blob))
+    return len(rows)
+
+
+def load_plan(cursor, order_id):
+    """План заказа или None (заказы до появления order_plans)"""
+    cursor.execute("SELECT format, plan FROM order_plans WHERE order_id = ?", (order_id,))
+    row = cursor.fetchone()
+    if row is None or row[0] != PLAN_FORMAT:
+        return None
+    return unpack_plan(row[1])
+
+
+def order_instructions(cursor, order_id):
+    """Текст инструкций заказа: из плана или сохраненный текстом в старых заказах"""
+    plan = load_plan(cursor, order_id)
+    if plan is not None:
+        return render_instructions(plan)
+    cursor.execute("SELECT instructions FROM orders WHERE id = ?", (order_id,))
+    row = cursor.fetchone()
+    return (row[0] or "") if row else ""
+
+
+if __name__ == "__main__":
+    # Размер плана на 2000 досок против текста инструкций
+    import random
+
+    from domain import Requirement
+
+    random.seed(7)
+    products = [f"Изделие {i}" for i in range(40)]
+    requirements = {"Брус": [Requirement(random.choice([450, 900, 1200, 1350, 2050]), random.choice(products))
+                             for _ in range(10000)],
+                    "Саморез": [Requirement(random.randint(4, 40), random.choice(products)) for _ in range(200)]}
+    types = {"Брус": "Пиломатериал", "Саморез": "Метиз"}
+    lumber = CuttingOptimizer._process_lumber("Брус", requirements["Брус"], [StockLot("Брус", 6000, 5000)])
+    result = {'plan': {"Брус": lumber['plan']}, 'cutting_instructions': {"Брус": lumber['instructions']}}
+
+    plan = build_plan(result, requirements, types)
+    text = render_instructions(plan)
+    legacy = "".join(f"{i}. {instr}\n\n" for i, instr in enumerate(result['cutting_instructions']["Брус"], 1))
+    assert text == ("Материал: Брус\n" + legacy).strip()
+    blob = pack_plan(plan)
+    print(f"Досок: {plan_usage(plan)['Брус'][0]}, текст: {len(text.encode('utf-8')) // 1024} КБ, "
+          f"план: {len(blob) // 1024} КБ")
+    assert unpack_plan(blob) == plan
@@ -0,0 +1,251 @@
+# order_report.py - PDF-отчет по заказу из данных БД
+#
+# Отчет строится только из сохраненного заказа (заказ, позиции, план
+# раскроя), поэтому его можно пересобрать в любой момент. Ключ отчета -
+# хеш этих данных: одинаковые данные дают тот же файл в PdfCache.
+#
+# Раскрой печатается таблицами по материалам: строка - группа одинаковых
+# подряд идущих досок (схема распила). Длинные таблицы режутся на куски по
+# TABLE_CHUNK строк с повтором шапки: reportlab переразбивает таблицу на
+# каждой странице, и на кусках фиксированного размера сборка остается
+# линейной по числу досок. Стили создаются один раз на модуль.
+#
+# Перед списком кусков в ячейке - схема распила в масштабе (cut_diagram):
+# одинаковые схемы рисуются в файл один раз.
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+from functools import lru_cache
+from xml.sax.saxutils import escape
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+from cut_diagram import DiagramCache
+from cutting_optimizer import CuttingOptimizer
+from order_plan import load_plan
+
+# Меняется вместе с оформлением отчета: старые файлы кэша перестают подходить
+REPORT_FORMAT = 3
+TABLE_CHUNK = 60  # строк в одном куске таблицы раскроя
+PATTERN_COLUMNS = [60, 45, 298, 65]  # доски, длина, схема и распил, остаток - вся ширина страницы
+CELL_PADDING = 6  # поля ячейки таблицы reportlab по умолчанию
+
+# ИСПРАВЛЕНИЕ 1: Улучшенная регистрация шрифта Arial
+ARIAL_FONT_REGISTERED = False
+
+
+def setup_arial_font():
+    global ARIAL_FONT_REGISTERED
+    try:
+        if getattr(sys, 'frozen', False):
+            font_path = os.path.join(os.path.dirname(sys.executable), 'fonts', 'arial.ttf')
+        else:
+            font_path = os.path.join(os.path.dirname(__file__), 'fonts', 'arial.ttf')
+        print(f"Попытка загрузить шрифт: {font_path}")
+        if os.path.exists(font_path):
+            pdfmetrics.registerFont(TTFont('Arial', font_path))
+            ARIAL_FONT_REGISTERED = True
+            print("✓ Шрифт Arial успешно зарегистрирован")
+        else:
+            print(f"✗ Файл шрифта не найден: {font_path}")
+            ARIAL_FONT_REGISTERED = False
+    except Exception as e:
+        print(f"✗ Ошибка регистрации шрифта Arial: {e}")
+        ARIAL_FONT_REGISTERED = False
+
+
+# Вызываем функцию регистрации
+setup_arial_font()
+
+
+def load_order_report(db_path, order_id):
+    """Данные отчета по заказу (см. read_order_report)"""
+    conn = sqlite3.connect(db_path)
+    try:
+        return read_order_report(conn.cursor(), order_id)
+    finally:
+        conn.close()
+
+
+def read_order_report(cursor, order_id):
+    """
+    Данные отчета по заказу через открытое соединение.
+
+    :return: {'id', 'date', 'total_cost', 'items': [[тип, название, количество, стоимость, длина], ...],
+              'plan': план или None, 'instructions': текст старого заказа без плана}; None - нет заказа
+    """
+    cursor.execute("SELECT order_date, total_cost, instructions FROM orders WHERE id = ?", (order_id,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    order_date, total_cost, instructions = row
+    cursor.execute("""SELECT item_type, product_name, quantity, cost, length_meters
+                      FROM order_items WHERE order_id = ? ORDER BY id""", (order_id,))
+    items = [list(item) for item in cursor.fetchall()]
+    plan = load_plan(cursor, order_id)
+
+    return {'id': order_id, 'date': order_date, 'total_cost': total_cost, 'items': items,
+            'plan': plan, 'instructions': None if plan is not None else instructions}
+
+
+def report_key(report):
+    """Хеш содержимого отчета - имя файла в кэше"""
+    payload = json.dumps([REPORT_FORMAT, report], ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+@lru_cache(maxsize=None)
+def report_styles():
+    """Стили отчета: с Arial, если шрифт зарегистрирован"""
+    styles = getSampleStyleSheet()
+    if not ARIAL_FONT_REGISTERED:
+        return {'title': styles['Title'], 'heading': styles['Heading2'], 'normal': styles['Normal'],
+                'cell': styles['BodyText'], 'table': _table_style('Helvetica', 'Helvetica-Bold'),
+                'font': 'Helvetica'}
+    return {
+        'title': ParagraphStyle('CustomTitle', parent=styles['Title'], fontName='Arial', fontSize=16,
+                                spaceAfter=12),
+        'heading': ParagraphStyle('CustomHeading', parent=styles['Heading2'], fontName='Arial',
+                                  fontSize=14, spaceAfter=6),
+        'normal': ParagraphStyle('CustomNormal', parent=styles['Normal'], fontName='Arial', fontSize=12),
+        'cell': ParagraphStyle('CustomCell', parent=styles['BodyText'], fontName='Arial', fontSize=9, leading=11),
+        'table': _table_style('Arial', 'Arial'),
+        'font': 'Arial',
+    }
+
+
+def _table_style(font, header_font):
+    return TableStyle([
+        ('FONTNAME', (0, 0), (-1, -1), font),
+        ('FONTNAME', (0, 0), (-1, 0), header_font),
+        ('FONTSIZE', (0, 0), (-1, -1), 9),
+        ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+        ('GRID', (0, 0), (-1, -1), 0.25, colors.grey),
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+    ])
+
+
+def _chunked_table(header, rows, col_widths, style):
+    """Таблица кусками по TABLE_CHUNK строк, шапка повторяется на каждой странице"""
+    for start in range(0, len(rows), TABLE_CHUNK):
+        yield Table([header] + rows[start:start + TABLE_CHUNK], colWidths=col_widths, repeatRows=1, style=style)
+
+
+def _pattern_rows(entry, cell_style, diagrams):
+    """Строки таблицы раскроя материала: [доски, длина, схема и распил, остаток]"""
+    format_m = CuttingOptimizer.format_m
+    rows = []
+    number = 1
+    for count, original_length, remainder, cuts in entry['boards']:
+        boards = str(number) if count == 1 else f"{number}-{number + count - 1}\n({count} шт)"
+        number += count
+        cuts_text = "<br/>".join(f"{i}. {format_m(length)}м - {escape(product)}"
+                                 for i, (length, product) in enumerate(cuts, 1))
+        remainder_text = f"{format_m(remainder)}м"
+        if remainder < CuttingOptimizer.MIN_LENGTH_MM:
+            remainder_text += " (не исп.)"
+        diagram = diagrams.flowable(original_length, [length for length, _ in cuts], remainder)
+        rows.append([boards, f"{format_m(original_length)}м", [diagram, Paragraph(cuts_text, cell_style)],
+                     remainder_text])
+    return rows
+
+
+def report_flowables(report):
+    """Элементы PDF отчета по порядку - по одному на строку состава, материал и кусок таблицы"""
+    styles = report_styles()
+    title_style, heading_style, normal_style = styles['title'], styles['heading'], styles['normal']
+
+    yield Paragraph(f"Заказ от {escape(str(report['date']))}", title_style)
+    yield Spacer(1, 12)
+
+    total_cost = report['total_cost']
+    yield Paragraph(f"Себестоимость: {total_cost:.2f} руб", heading_style)
+    yield Paragraph(f"Цена реализации: {total_cost * 2:.2f} руб", heading_style)
+    yield Spacer(1, 12)
+
+    # Состав заказа (печатаем длину для этапов)
+    yield Paragraph("Состав заказа:", heading_style)
+    for item_type, name, quantity, _, length_m in report['items']:
+        type_text = "Изделие" if item_type == 'product' else "Этап"
+        line = f"- {escape(str(name))} ({type_text}): {quantity} шт"
+        if item_type == 'stage' and length_m:
+            line += f", длина {length_m:.2f} м"
+        yield Paragraph(line, normal_style)
+
+    plan = report['plan']
+    if plan is None:
+        # Старый заказ без плана: сохраненный текст, абзац на каждую инструкцию
+        if report['instructions']:
+            yield Spacer(1, 12)
+            yield Paragraph("Инструкции:", heading_style)
+            for block in report['instructions'].split("\n\n"):
+                if block.strip():
+                    yield Paragraph(escape(block).replace("\n", "<br/>"), normal_style)
+        return
+
+    # Сводка материалов (агрегировано)
+    yield Spacer(1, 12)
+    yield Paragraph("Сводка материалов:", heading_style)
+    totals_lumber = [(mat, amount) for mat, unit, amount in plan['totals'] if unit == "м"]
+    totals_fasteners = [(mat, amount) for mat, unit, amount in plan['totals'] if unit == "шт"]
+
+    if totals_lumber:
+        yield Paragraph("Пиломатериалы:", normal_style)
+        for mat, amount in totals_lumber:
+            yield Paragraph(f"• {escape(mat)}: {amount:.2f} м", normal_style)
+
+    if totals_fasteners:
+        yield Paragraph("Метизы:", normal_style)
+        for mat, amount in totals_fasteners:
+            yield Paragraph(f"• {escape(mat)}: {amount:.0f} шт", normal_style)
+
+    # Раскрой по материалам (включая отрезки троса с бухт)
+    yield Spacer(1, 12)
+    yield Paragraph("Инструкции:", heading_style)
+    if not plan['materials']:
+        yield Paragraph("Инструкции по распилу не требуются.", normal_style)
+    diagrams = DiagramCache(PATTERN_COLUMNS[2] - 2 * CELL_PADDING, styles['font'])
+    for entry in plan['materials']:
+        yield Paragraph(f"Материал: {escape(entry['name'])}", normal_style)
+        yield from _chunked_table(["Доски", "Длина", "Распил", "Остаток"],
+                                  _pattern_rows(entry, styles['cell'], diagrams), PATTERN_COLUMNS, styles['table'])
+        yield Spacer(1, 8)
+
+
+def render_order_pdf(path, report):
+    """Строит PDF отчета по данным load_order_report"""
+    SimpleDocTemplate(path, pagesize=letter).build(list(report_flowables(report)))
+
+
+if __name__ == "__main__":
+    # Время сборки PDF в зависимости от числа досок
+    import random
+    import tempfile
+    import time
+
+    from domain import Requirement, StockLot
+    from order_plan import build_plan
+
+    random.seed(7)
+    products = [f"Изделие {i}" for i in range(40)]
+    out = os.path.join(tempfile.mkdtemp(), "report.pdf")
+    for pieces in (2500, 5000, 10000):
+        requirements = {"Брус": [Requirement(random.choice([450, 900, 1200, 1350, 2050]), random.choice(products))
+                                 for _ in range(pieces)]}
+        lumber = CuttingOptimizer._process_lumber("Брус", requirements["Брус"], [StockLot("Брус", 6000, 5000)])
+        plan = build_plan({'plan': {"Брус": lumber['plan']}}, requirements, {"Брус": "Пиломатериал"})
+        report = {'id': 1, 'date': "2025-01-01 12:00:00", 'total_cost': 100000.0,
+                  'items': [['product', name, 1, 1000.0, None] for name in products], 'plan': plan,
+                  'instructions': None}
+
+        started = time.perf_counter()
+        render_order_pdf(out, report)
+        boards = sum(count for count, *_ in plan['materials'][0]['boards'])
+        print(f"{boards} досок: {time.perf_counter() - started:.2f} с, {os.path.getsize(out) // 1024} КБ")
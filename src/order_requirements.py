@@ -0,0 +1,266 @@
+# order_requirements.py - разворачивание заказа в требования по материалам
+#
+# Два равноценных пути:
+#   expand_order_python - по позициям заказа, несколько запросов на позицию;
+#   expand_order_sql    - позиции заказа кладутся во временную таблицу, и все
+#                         требования и стоимости считаются одним запросом.
+# Результат одинаковый: (стоимость, {материал: [Requirement, ...]}).
+# Позиции заказа - кортежи (тип, id, количество[, длина в м]); длина этапа
+# должна быть уже известна. Изделия разворачиваются до материалов вместе с
+# вложенными узлами (bom).
+import math
+import sqlite3
+from collections import defaultdict
+
+from bom import BOM_TREE_CTE, BomResolver
+from domain import Requirement
+
+LUMBER = "Пиломатериал"
+
+
+def _append_requirement(requirements, material, mtype, length_mm, count, description):
+    """Пиломатериал - отдельными кусками длиной length_mm, остальное - одним количеством"""
+    if mtype == LUMBER and length_mm:
+        requirements[material].extend([Requirement(length_mm, description)] * count)
+    else:
+        requirements[material].append(Requirement(count, description))
+
+
+def expand_order_python(db_path, order_items, rope_pieces, stage_cost, bom=None):
+    """
+    Требования заказа обходом позиций в Python.
+
+    :param rope_pieces: Отрезки троса {id материала: [Requirement, ...]}
+    :param stage_cost: Функция стоимости этапа (id этапа, длина в м) -> руб
+    :param bom: BomResolver с уже развернутыми составами (по умолчанию - новый)
+    :return: (стоимость, {материал: [Requirement, ...]})
+    """
+    requirements = defaultdict(list)
+    total_cost = 0.0
+    if bom is None:
+        bom = BomResolver(db_path)
+
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+
+    for item in order_items:
+        item_type, item_id, quantity = item[:3]
+        length_m = item[3] if len(item) > 3 else None
+
+        if item_type == "Изделие":
+            c.execute("SELECT name, cost FROM products WHERE id = ?", (item_id,))
+            product_row = c.fetchone()
+            if not product_row:
+                continue
+            product_name, product_cost = product_row
+            total_cost += product_cost * quantity
+
+            for mname, mtype, q, length_mm in bom.flatten([item_id])[item_id]:
+                total = q * quantity
+                # Куски пиломатериала в изделии - целые, метизы округляются вверх
+                count = int(total) if mtype == LUMBER and length_mm else math.ceil(total)
+                _append_requirement(requirements, mname, mtype, length_mm, count, product_name)
+
+        elif item_type == "Материал":
+            # Материал, добавленный напрямую (страховочный трос и зажимы)
+            c.execute("SELECT name, type, price FROM materials WHERE id = ?", (item_id,))
+            row = c.fetchone()
+            if not row:
+                continue
+            mname, mtype, price = row
+            pieces = rope_pieces.get(item_id)
+            if pieces and mtype == LUMBER:
+                # Трос режется с бухты отрезками по участкам трасс
+                requirements[mname].extend(pieces)
+                total_cost += price * sum(piece.value for piece in pieces) / 1000
+            else:
+                requirements[mname].append(Requirement(math.ceil(quantity), "Страховочный трос"))
+                total_cost += price * quantity
+
+        else:  # Этап
+            total_cost += stage_cost(item_id, length_m)
+
+            # Материалы напрямую из этапа
+            c.execute("""SELECT sm.part, sm.quantity, sm.length_mm, m.name, m.type
+                        FROM stage_materials sm
+                        JOIN materials m ON sm.material_id = m.id
+                        WHERE sm.stage_id = ?""", (item_id,))
+            for part, sm_qty, sm_length_mm, mname, mtype in c.fetchall():
+                multiplier = length_m if part == 'meter' else 1
+                _append_requirement(requirements, mname, mtype, sm_length_mm,
+                                    math.ceil(sm_qty * multiplier), f"Этап({part})→Материал")
+
+            # Материалы из изделий в этапе
+            c.execute("""SELECT sp.product_id, sp.quantity, sp.part, p.name
+                        FROM stage_products sp
+                        JOIN products p ON sp.product_id = p.id
+                        WHERE sp.stage_id = ?""", (item_id,))
+            stage_products = c.fetchall()
+            flat = bom.flatten([row[0] for row in stage_products])
+            for product_id, stage_qty, part, product_name in stage_products:
+                multiplier = length_m if part == 'meter' else 1
+                for mname, mtype, comp_qty, length_mm in flat[product_id]:
+                    _append_requirement(requirements, mname, mtype, length_mm,
+                                        math.ceil(comp_qty * stage_qty * multiplier), f"Этап({part})→{product_name}")
+
+    conn.close()
+    return total_cost, requirements
+
+
+# Все источники требований одним запросом. Изделия заказа и этапов
+# разворачиваются рекурсивным tree (bom) до позиций состава. Каждая ветка UNION ALL дает строку
+# (позиция, ветка, материал, тип, длина куска, количество до округления,
+# усечение вместо округления вверх, описание, цена, цена за округленное
+# количество, id позиции). Строки без материала несут только стоимость.
+# В SQLite 3.40 нет CEIL, поэтому округление вверх - через CAST.
+EXPAND_ORDER_SQL = """
+    WITH RECURSIVE """ + BOM_TREE_CTE.format(roots="""
+            SELECT item_id FROM order_lines WHERE item_type = 'Изделие'
+            UNION
+            SELECT sp.product_id FROM order_lines l JOIN stage_products sp ON sp.stage_id = l.item_id
+            WHERE l.item_type = 'Этап'""") + """,
+    bom AS (
+        SELECT t.root, pc.id, pc.material_id, SUM(t.multiplier * pc.quantity) AS quantity, pc.length_mm
+        FROM tree t JOIN product_composition pc ON pc.product_id = t.product_id
+        GROUP BY t.root, pc.id
+    ),
+    raw AS (
+        -- Изделие: стоимость
+        SELECT l.line, 0 AS branch, NULL AS material, NULL AS mtype, NULL AS length_mm,
+               l.quantity AS amount, 0 AS truncate, NULL AS description,
+               p.cost AS unit_cost, 0 AS by_count, l.item_id
+        FROM order_lines l JOIN products p ON p.id = l.item_id
+        WHERE l.item_type = 'Изделие'
+        UNION ALL
+        -- Изделие: состав
+        SELECT l.line, 1, m.name, m.type, pc.length_mm,
+               pc.quantity * l.quantity, m.type = 'Пиломатериал' AND COALESCE(pc.length_mm, 0) != 0,
+               p.name, 0, 0, l.item_id
+        FROM order_lines l
+        JOIN products p ON p.id = l.item_id
+        JOIN bom pc ON pc.root = l.item_id
+        JOIN materials m ON m.id = pc.material_id
+        WHERE l.item_type = 'Изделие'
+        UNION ALL
+        -- Материал напрямую (трос, зажимы)
+        SELECT l.line, 2, m.name, m.type, NULL,
+               l.quantity, 0, 'Страховочный трос', m.price, 0, l.item_id
+        FROM order_lines l JOIN materials m ON m.id = l.item_id
+        WHERE l.item_type = 'Материал'
+        UNION ALL
+        -- Этап: свои материалы (и требование, и стоимость)
+        SELECT l.line, 3, m.name, m.type, sm.length_mm,
+               sm.quantity * CASE sm.part WHEN 'meter' THEN l.length_m ELSE 1 END, 0,
+               'Этап(' || sm.part || ')→Материал',
+               CASE WHEN m.type = 'Пиломатериал' AND COALESCE(sm.length_mm, 0) != 0
+                    THEN m.price * sm.length_mm / 1000.0 ELSE m.price END, 1, l.item_id
+        FROM order_lines l
+        JOIN stage_materials sm ON sm.stage_id = l.item_id
+        JOIN materials m ON m.id = sm.material_id
+        WHERE l.item_type = 'Этап'
+        UNION ALL
+        -- Этап: стоимость изделий
+        SELECT l.line, 4, NULL, NULL, NULL,
+               sp.quantity * CASE sp.part WHEN 'meter' THEN l.length_m ELSE 1 END, 0, NULL,
+               p.cost, 1, l.item_id
+        FROM order_lines l
+        JOIN stage_products sp ON sp.stage_id = l.item_id
+        JOIN products p ON p.id = sp.product_id
+        WHERE l.item_type = 'Этап'
+        UNION ALL
+        -- Этап: материалы изделий
+        SELECT l.line, 5, m.name, m.type, pc.length_mm,
+               pc.quantity * sp.quantity * CASE sp.part WHEN 'meter' THEN l.length_m ELSE 1 END, 0,
+               'Этап(' || sp.part || ')→' || p.name, 0, 0, l.item_id
+        FROM order_lines l
+        JOIN stage_products sp ON sp.stage_id = l.item_id
+        JOIN products p ON p.id = sp.product_id
+        JOIN bom pc ON pc.root = sp.product_id
+        JOIN materials m ON m.id = pc.material_id
+        WHERE l.item_type = 'Этап'
+    ),
+    counted AS (
+        SELECT *, CASE WHEN truncate THEN CAST(amount AS INTEGER)
+                       ELSE CAST(amount AS INTEGER) + (amount > CAST(amount AS INTEGER)) END AS count
+        FROM raw
+    )
+    SELECT line, branch, material, mtype, length_mm, count, description, unit_cost,
+           unit_cost * CASE WHEN by_count THEN count ELSE amount END AS cost, item_id
+    FROM counted
+    ORDER BY line, branch
+"""
+
+
+def expand_order_sql(db_path, order_items, rope_pieces):
+    """
+    Требования заказа одним запросом по временной таблице позиций.
+
+    :param rope_pieces: Отрезки троса {id материала: [Requirement, ...]}
+    :return: (стоимость, {материал: [Requirement, ...]})
+    """
+    requirements = defaultdict(list)
+    total_cost = 0.0
+
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute("""CREATE TEMP TABLE order_lines (
+                          line INTEGER PRIMARY KEY,
+                          item_type TEXT NOT NULL,
+                          item_id INTEGER NOT NULL,
+                          quantity REAL NOT NULL,
+                          length_m REAL)""")
+    cursor.executemany("INSERT INTO order_lines VALUES (?, ?, ?, ?, ?)",
+                       [(line, item[0], item[1], item[2], item[3] if len(item) > 3 else None)
+                        for line, item in enumerate(order_items)])
+    cursor.execute(EXPAND_ORDER_SQL)
+    rows = cursor.fetchall()
+    conn.close()
+
+    for _, branch, material, mtype, length_mm, count, description, unit_cost, cost, item_id in rows:
+        if branch == 2:
+            pieces = rope_pieces.get(item_id)
+            if pieces and mtype == LUMBER:
+                requirements[material].extend(pieces)
+                total_cost += unit_cost * sum(piece.value for piece in pieces) / 1000
+                continue
+        total_cost += cost or 0.0
+        if material is not None:
+            _append_requirement(requirements, material, mtype, length_mm, count, description)
+
+    return total_cost, requirements
+
+
+if __name__ == "__main__":
+    # Большой заказ по базе (путь - аргументом, база уже со столбцами length_mm):
+    # путь по позициям против одного запроса
+    import os
+    import sys
+    import time
+
+    from stage_pricing import StagePriceCache
+
+    db_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(__file__), '..', 'data', 'database.db')
+    conn = sqlite3.connect(db_path)
+    product_ids = [row[0] for row in conn.execute("SELECT id FROM products")]
+    stage_ids = [row[0] for row in conn.execute("SELECT id FROM stages")]
+    conn.close()
+
+    order = [("Изделие", product_id, 3) for product_id in product_ids] * 8
+    order += [("Этап", stage_id, 1, 12.5 + index) for index, stage_id in enumerate(stage_ids * 40)]
+
+    def python_path():
+        return expand_order_python(db_path, order, {}, lambda stage_id, length_m:
+                                   prices.price(stage_id, round(length_m * 1000)))
+
+    results = {}
+    for title, compute in (("по позициям", python_path),
+                           ("одним запросом", lambda: expand_order_sql(db_path, order, {}))):
+        prices = StagePriceCache(db_path)
+        started = time.perf_counter()
+        results[title] = compute()
+        print(f"{title}: {len(order)} позиций, {(time.perf_counter() - started) * 1000:.1f} мс")
+
+    (cost_a, req_a), (cost_b, req_b) = results.values()
+    assert abs(cost_a - cost_b) < 1e-6 * max(1.0, abs(cost_a))
+    assert {k: sorted(v) for k, v in req_a.items()} == {k: sorted(v) for k, v in req_b.items()}
+    print(f"Стоимость {cost_a:.2f} руб, материалов {len(req_a)} - результаты совпадают")
@@ -0,0 +1,77 @@
+# pdf_cache.py - ограниченный кэш PDF-файлов на диске
+#
+# Файл называется хешем содержимого отчета (<ключ>.pdf), поэтому повторное
+# открытие заказа с теми же данными отдает готовый файл, а изменившиеся
+# данные дают новый ключ. Время последнего обращения - mtime файла; когда
+# размер папки превышает предел, удаляются давно не открывавшиеся файлы.
+import os
+
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+
+
+class PdfCache:
+    """
+    Папка с PDF, вытесняемыми по давности обращения.
+
+    :param directory: Папка кэша (создается при первой записи)
+    :param max_bytes: Предельный суммарный размер файлов; None - без вытеснения
+                      (так пишут в общую папку процессы пакетного экспорта)
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def path_for(self, key):
+        return os.path.join(self.directory, f"{key}.pdf")
+
+    def get(self, key, render):
+        """
+        Путь к PDF с ключом key; если файла нет, он строится render(путь).
+
+        :return: Путь к готовому файлу
+        """
+        path = self.path_for(key)
+        if os.path.exists(path):
+            os.utime(path)
+            self.hits += 1
+            return path
+
+        self.misses += 1
+        os.makedirs(self.directory, exist_ok=True)
+        # Пишем во временный файл: недостроенный PDF не должен попасть в кэш
+        partial = f"{path}.{os.getpid()}.tmp"
+        try:
+            render(partial)
+            os.replace(partial, path)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+        self.evict(keep=path)
+        return path
+
+    def evict(self, keep=None):
+        """Удаляет самые давние файлы, пока кэш больше max_bytes (keep не удаляется)"""
+        if self.max_bytes is None or not os.path.isdir(self.directory):
+            return
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(".pdf"):
+                try:
+                    stat = entry.stat()
+                except OSError:  # файл успел удалить другой процесс
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except OSError as e:
+                print(f"Не удалось удалить {path} из кэша PDF: {e}")
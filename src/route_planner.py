@@ -0,0 +1,97 @@
+# route_planner.py - автоматическое разбиение этапов на трассы страховочного троса
+#
+# Этапы идут в порядке заказа - так, как они стоят в парке. Трасса - непрерывный
+# отрезок этой последовательности. Внутри трассы динамические/Зип этапы рвут
+# трос, и каждый статический участок стоит 5 + 5N + L м троса и 6 + 6N зажимов
+# (safety_rope). Лишний участок появляется, только если трасса рвется посреди
+# статических этапов, поэтому задача - выбрать точки разреза так, чтобы
+# соблюсти ограничения и не плодить участков. Решается динамикой по префиксам.
+from safety_rope import CLAMPS_PER_SEGMENT, CLAMPS_PER_STAGE, ROPE_PER_SEGMENT, ROPE_PER_STAGE
+
+
+def plan_routes(stages, max_route_length=None, max_stages=None):
+    """
+    Оптимальное разбиение этапов на трассы.
+
+    dp[j] - лучшая стоимость разбиения первых j этапов; переход - последняя
+    трасса stages[i:j]. Стоимость сравнивается как (трос, зажимы, число трасс):
+    при равных расходах выбирается меньше трасс. Стоимость трассы считается
+    нарастающим итогом при продлении конца, а перебор концов обрывается, как
+    только трасса перестает проходить по ограничениям, - O(n^2) в худшем случае.
+
+    :param stages: Этапы по порядку [{'length', 'category', ...}, ...]
+    :param max_route_length: Максимальная суммарная длина этапов трассы, м (None - без ограничения)
+    :param max_stages: Максимальное число этапов в трассе (None - без ограничения)
+    :return: Трассы - списки индексов этапов по порядку
+    """
+    n = len(stages)
+    if not n:
+        return []
+
+    best = [None] * (n + 1)  # (трос, зажимы, трасс) для префикса
+    cut = [0] * (n + 1)  # начало последней трассы префикса
+    best[0] = (0.0, 0, 0)
+
+    for i in range(n):
+        if best[i] is None:
+            continue
+        base_rope, base_clamps, base_routes = best[i]
+
+        route_rope = 0.0
+        route_clamps = 0
+        route_length = 0.0
+        in_segment = False  # предыдущий этап трассы - статический
+        for j in range(i, n):
+            stage = stages[j]
+            route_length += stage['length']
+            # Этап длиннее ограничения все равно должен куда-то попасть - один в трассе
+            if j > i and ((max_route_length and route_length > max_route_length + 1e-9)
+                          or (max_stages and j - i + 1 > max_stages)):
+                break
+
+            # Расход нарастает линейно: новый участок - постоянная часть, каждый этап - своя
+            if stage['category'] == 'Статика':
+                if not in_segment:
+                    route_rope += ROPE_PER_SEGMENT
+                    route_clamps += CLAMPS_PER_SEGMENT
+                route_rope += ROPE_PER_STAGE + stage['length']
+                route_clamps += CLAMPS_PER_STAGE
+                in_segment = True
+            else:
+                in_segment = False
+
+            cost = (round(base_rope + route_rope, 6), base_clamps + route_clamps, base_routes + 1)
+            if best[j + 1] is None or cost < best[j + 1]:
+                best[j + 1] = cost
+                cut[j + 1] = i
+
+    routes = []
+    end = n
+    while end > 0:
+        start = cut[end]
+        routes.append(list(range(start, end)))
+        end = start
+    routes.reverse()
+    return routes
+
+
+if __name__ == "__main__":
+    # Большой парк: сотни этапов с ограничением длины трассы
+    import random
+    import time
+
+    from safety_rope import route_breakdown
+
+    random.seed(3)
+    stages = [{'name': f"Этап {i}", 'length': round(random.uniform(3, 15), 2),
+               'category': 'Статика' if random.random() < 0.8 else 'Динамика'} for i in range(300)]
+
+    for max_route_length, max_stages in ((None, None), (120.0, None), (60.0, 8)):
+        started = time.perf_counter()
+        routes = plan_routes(stages, max_route_length, max_stages)
+        elapsed = time.perf_counter() - started
+        breakdown = route_breakdown([[stages[index] for index in route] for route in routes])
+        rope = sum(route['rope'] for route in breakdown)
+        clamps = sum(route['clamps'] for route in breakdown)
+        print(f"Этапов: {len(stages)}, ограничения ({max_route_length}, {max_stages}): "
+              f"трасс {len(routes)}, трос {rope:.2f}м, зажимов {clamps}, {elapsed * 1000:.1f} мс")
@@ -0,0 +1,197 @@
+# safety_rope.py - расчет страховочного троса по трассам веревочного парка
+#
+# Трос режется с бухты: каждый статический участок трассы - отдельный отрезок.
+# Отрезки выдаются как требования Requirement (длина в мм), поэтому раскладываются
+# по бухтам на складе тем же CuttingOptimizer, что и пиломатериалы, а остатки
+# бухт возвращаются на склад как обрезки.
+import math
+import sqlite3
+
+from domain import Requirement
+
+ROPE_MATERIAL = "Трос М12"
+CLAMP_MATERIAL = "Зажим М12"
+
+# Правило расхода на статический участок из N этапов общей длиной L:
+# трос 5 + 5N + L м, зажимы 6 + 6N
+ROPE_PER_SEGMENT = 5
+ROPE_PER_STAGE = 5
+CLAMPS_PER_SEGMENT = 6
+CLAMPS_PER_STAGE = 6
+
+
+def split_segments(route):
+    """
+    Разбивает трассу на участки подряд идущих этапов одного типа.
+
+    Динамические/Зип этапы разрывают трос, поэтому трос нужен только на
+    статических участках.
+
+    :param route: Этапы трассы по порядку [{'name', 'length', 'category'}, ...]
+    :return: [{'type': 'static'/'dynamic', 'stages': [...]}, ...]
+    """
+    segments = []
+    current_segment = None
+    for stage in route:
+        stage_type = 'static' if stage['category'] == 'Статика' else 'dynamic'
+        if current_segment is None or current_segment['type'] != stage_type:
+            current_segment = {'type': stage_type, 'stages': [stage]}
+            segments.append(current_segment)
+        else:
+            current_segment['stages'].append(stage)
+    return segments
+
+
+def segment_rope_length(stages):
+    """Длина троса на статический участок, м: 5 + 5N + L"""
+    return ROPE_PER_SEGMENT + ROPE_PER_STAGE * len(stages) + sum(stage['length'] for stage in stages)
+
+
+def segment_clamps(stages):
+    """Количество зажимов на статический участок: 6 + 6N"""
+    return CLAMPS_PER_SEGMENT + CLAMPS_PER_STAGE * len(stages)
+
+
+def route_breakdown(routes):
+    """
+    Расход троса по трассам и участкам - общие данные для предпросмотра и расчета.
+
+    :param routes: Трассы - списки этапов по порядку (пустые пропускаются)
+    :return: [{'stages': [...], 'segments': [...], 'rope': м, 'clamps': шт}, ...],
+        участок - {'type', 'stages', 'length': L, 'rope', 'clamps'}; у динамических
+        участков трос и зажимы равны 0
+    """
+    breakdown = []
+    for route in routes:
+        if not route:
+            continue
+        segments = []
+        for segment in split_segments(route):
+            static = segment['type'] == 'static'
+            segments.append({
+                'type': segment['type'],
+                'stages': segment['stages'],
+                'length': sum(stage['length'] for stage in segment['stages']),
+                'rope': segment_rope_length(segment['stages']) if static else 0.0,
+                'clamps': segment_clamps(segment['stages']) if static else 0
+            })
+        breakdown.append({
+            'stages': route,
+            'segments': segments,
+            'rope': sum(segment['rope'] for segment in segments),
+            'clamps': sum(segment['clamps'] for segment in segments)
+        })
+    return breakdown
+
+
+def rope_requirements(routes):
+    """
+    Отрезки троса по трассам.
+
+    Длина отрезка округляется вверх до целого сантиметра: так отрезок
+    гарантированно не короче расчетного.
+
+    :param routes: Трассы - списки этапов по порядку
+    :return: (отрезки [Requirement(длина в мм, описание), ...], количество зажимов)
+    """
+    pieces = []
+    clamps = 0
+    for route_index, route in enumerate(route_breakdown(routes), 1):
+        static_segments = [segment for segment in route['segments'] if segment['type'] == 'static']
+        for segment_index, segment in enumerate(static_segments, 1):
+            length_mm = math.ceil(round(segment['rope'] * 100, 6)) * 10
+            pieces.append(Requirement(length_mm, f"Страховочный трос: трасса {route_index}, участок {segment_index}"))
+        clamps += route['clamps']
+    return pieces, clamps
+
+
+class RopeService:
+    """
+    Данные для расчета страховочного троса по заказу.
+
+    Категории всех этапов заказа и материалы троса/зажимов читаются одним
+    запросом (WHERE id IN (...)), а если передан справочник в памяти - вовсе
+    без обращения к БД.
+    """
+
+    def __init__(self, db_path, catalog=None):
+        self.db_path = db_path
+        self.catalog = catalog
+
+    def load(self, stage_rows):
+        """
+        Этапы заказа с категориями и материалы троса и зажимов.
+
+        :param stage_rows: Строки этапов заказа [(id этапа, название, длина в м), ...]
+        :return: (этапы [{'id', 'name', 'length', 'category'}, ...],
+                  материалы {название: (id, цена)} - только найденные)
+        """
+        stage_ids = sorted({stage_id for stage_id, _, _ in stage_rows})
+        material_names = (ROPE_MATERIAL, CLAMP_MATERIAL)
+
+        if self.catalog is not None:
+            categories = self.catalog.stage_categories(stage_ids)
+            materials = self.catalog.materials_by_name(material_names)
+        else:
+            categories, materials = self._load_from_db(stage_ids, material_names)
+
+        stages = [{
+            'id': stage_id,
+            'name': name,
+            'length': length,
+            'category': categories.get(stage_id, "Статика")
+        } for stage_id, name, length in stage_rows]
+        return stages, materials
+
+    def _load_from_db(self, stage_ids, material_names):
+        """Один запрос на категории этапов и материалы"""
+        stage_marks = ", ".join("?" * len(stage_ids)) or "NULL"
+        name_marks = ", ".join("?" * len(material_names))
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute(f"""SELECT 'stage', id, category, NULL FROM stages WHERE id IN ({stage_marks})
+                           UNION ALL
+                           SELECT 'material', id, name, price FROM materials WHERE name IN ({name_marks})""",
+                       (*stage_ids, *material_names))
+        categories = {}
+        materials = {}
+        for kind, row_id, value, price in cursor.fetchall():
+            if kind == 'stage':
+                categories[row_id] = value or "Статика"
+            else:
+                materials[value] = (row_id, price)
+        conn.close()
+        return categories, materials
+
+
+if __name__ == "__main__":
+    # Планирование троса для большого парка: сотни участков против нескольких бухт
+    import random
+    import time
+
+    from cutting_optimizer import CuttingOptimizer
+    from domain import StockLot
+
+    random.seed(7)
+    routes = []
+    for _ in range(150):
+        route = []
+        for _ in range(random.randint(4, 12)):
+            category = 'Статика' if random.random() < 0.75 else 'Динамика'
+            route.append({'name': "Этап", 'length': round(random.uniform(3, 15), 2), 'category': category})
+        routes.append(route)
+
+    started = time.perf_counter()
+    pieces, clamps = rope_requirements(routes)
+    elapsed = time.perf_counter() - started
+    print(f"Трасс: {len(routes)}, отрезков троса: {len(pieces)}, зажимов: {clamps} ({elapsed * 1000:.1f} мс)")
+
+    total_m = sum(piece.value for piece in pieces) / 1000
+    reels = [StockLot(ROPE_MATERIAL, 500000, math.ceil(total_m / 500) + 1), StockLot(ROPE_MATERIAL, 137400, 1)]
+    for strategy, title in CuttingOptimizer.STRATEGIES.items():
+        started = time.perf_counter()
+        result = CuttingOptimizer._process_lumber(ROPE_MATERIAL, list(pieces), reels, strategy)
+        elapsed = time.perf_counter() - started
+        used = [board for board in result['plan'].boards if board.cuts]
+        print(f"{title}: {elapsed * 1000:.1f} мс, бухт начато {len(used)}, "
+              f"остатки {[CuttingOptimizer.format_m(lot.length) for lot in result['updated']]}")
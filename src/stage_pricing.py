@@ -0,0 +1,222 @@
+# stage_pricing.py - себестоимость этапа как функция длины
+#
+# Стоимость этапа длиной L - сумма позиций состава: штучные позиции дают
+# постоянную часть, а позиции "на метр" - ступеньки цена * ceil(количество * L).
+# Сумма ступенек - кусочно-постоянная функция, поэтому ее можно один раз
+# построить по составу (точки скачков + нарастающая стоимость) и дальше
+# оценивать любую длину двоичным поиском, не обращаясь к БД.
+import math
+import sqlite3
+from bisect import bisect_right
+
+from cost_cache import CostCache
+from cutting_optimizer import CuttingOptimizer
+
+try:
+    import numpy as np
+except ImportError:  # NumPy не обязателен: без него таблицы цен считаются поэлементно
+    np = None
+
+HORIZON_MM = 100000  # Кривая строится до 100 м и достраивается, если попросят длиннее
+
+
+class StagePriceCurve:
+    """
+    Кусочно-постоянная себестоимость одного этапа по длине в мм.
+
+    :ivar fixed: Постоянная часть (позиции на этап), руб
+    :ivar terms: Позиции на метр [(количество на метр, цена за штуку), ...]
+    """
+    __slots__ = ('fixed', 'terms', 'horizon', 'breakpoints', 'costs')
+
+    def __init__(self, fixed, terms, horizon=HORIZON_MM):
+        self.fixed = fixed
+        self.terms = [(qty, unit) for qty, unit in terms if qty > 0 and unit]
+        self._build(horizon)
+
+    @staticmethod
+    def _level(qty, length_mm):
+        """Количество штук позиции на длину - как в прежнем расчете: ceil(qty * L)"""
+        return math.ceil(qty * (length_mm / 1000))
+
+    def _build(self, horizon):
+        """Точки скачков до horizon мм и стоимость после каждой из них"""
+        jumps = {}
+        for qty, unit in self.terms:
+            level = 0
+            while True:
+                # Первая длина, на которой позиция требует больше level штук
+                position = int(level * 1000 / qty) + 1
+                while position > 1 and self._level(qty, position - 1) > level:
+                    position -= 1
+                while self._level(qty, position) <= level:
+                    position += 1
+                if position > horizon:
+                    break
+                reached = self._level(qty, position)
+                jumps[position] = jumps.get(position, 0.0) + unit * (reached - level)
+                level = reached
+
+        self.horizon = horizon
+        self.breakpoints = sorted(jumps)
+        self.costs = []
+        total = self.fixed
+        for position in self.breakpoints:
+            total += jumps[position]
+            self.costs.append(total)
+
+    def _ensure(self, length_mm):
+        if length_mm > self.horizon:
+            self._build(max(self.horizon * 2, length_mm))
+
+    def price(self, length_mm):
+        """Себестоимость этапа длиной length_mm, руб - O(log k)"""
+        self._ensure(length_mm)
+        index = bisect_right(self.breakpoints, length_mm)
+        return self.costs[index - 1] if index else self.fixed
+
+    def prices(self, lengths_mm):
+        """Себестоимость для набора длин (с NumPy - одним searchsorted)"""
+        lengths_mm = list(lengths_mm)
+        if not lengths_mm:
+            return []
+        self._ensure(max(lengths_mm))
+        if np is None:
+            return [self.price(length_mm) for length_mm in lengths_mm]
+        values = np.concatenate(([self.fixed], np.asarray(self.costs, dtype=np.float64)))
+        indexes = np.searchsorted(np.asarray(self.breakpoints, dtype=np.int64),
+                                  np.asarray(lengths_mm, dtype=np.int64), side='right')
+        return values[indexes].tolist()
+
+
+class StagePriceCache:
+    """
+    Кривые себестоимости этапов, построенные по составу из БД - единственный
+    расчет себестоимости этапа для заказов, вкладки этапов и общего пересчета.
+
+    Кривая строится при первом обращении к этапу и хранится в CostCache под
+    ключом ('stage_curve', id): с кэшем, привязанным к версии каталога, она
+    перестраивается после любой правки справочников. Без каталога кривые
+    сбрасываются вручную: invalidate(stage_id) - один этап, invalidate() - все.
+    """
+
+    def __init__(self, db_path, cache=None):
+        self.db_path = db_path
+        self.cache = cache if cache is not None else CostCache()
+
+    def invalidate(self, stage_id=None):
+        if stage_id is None:
+            self.cache.invalidate()
+        else:
+            self.cache.invalidate(('stage_curve', stage_id))
+
+    def curve(self, stage_id):
+        return self.cache.get(('stage_curve', stage_id), lambda: self._build_curves([stage_id])[stage_id])
+
+    def price(self, stage_id, length_mm):
+        """Себестоимость этапа длиной length_mm, руб"""
+        return self.curve(stage_id).price(length_mm)
+
+    def prices(self, stage_id, lengths_mm):
+        """Себестоимость этапа для набора длин, руб"""
+        return self.curve(stage_id).prices(lengths_mm)
+
+    def price_table(self, stage_id, start_mm, stop_mm, step_mm):
+        """Таблица "цена от длины" для менеджеров: [(длина в мм, руб), ...], stop включительно"""
+        lengths = list(range(start_mm, stop_mm + 1, step_mm))
+        return list(zip(lengths, self.prices(stage_id, lengths)))
+
+    def default_costs(self, stage_ids=None):
+        """
+        Себестоимость этапов по их длине по умолчанию (stages.default_length_m).
+
+        :param stage_ids: Этапы; None - все
+        :return: {id этапа: (длина в м, себестоимость)}
+        """
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        if stage_ids is None:
+            cursor.execute("SELECT id, default_length_m FROM stages")
+        else:
+            stage_ids = list(stage_ids)
+            cursor.execute(f"SELECT id, default_length_m FROM stages WHERE id IN ({', '.join('?' * len(stage_ids))})",
+                           stage_ids)
+        lengths = dict(cursor.fetchall())
+        conn.close()
+
+        curves = self.load_curves(lengths)
+        return {stage_id: (length_m, curves[stage_id].price(CuttingOptimizer.to_mm(length_m)))
+                for stage_id, length_m in lengths.items()}
+
+    def load_curves(self, stage_ids):
+        """
+        Кривые этапов одним запросом по соединенному составу всех этапов сразу.
+
+        :return: {id этапа: StagePriceCurve} - для каждого из stage_ids
+        """
+        curves = self._build_curves(stage_ids)
+        for stage_id, curve in curves.items():
+            self.cache.put(('stage_curve', stage_id), curve)
+        return curves
+
+    def _build_curves(self, stage_ids):
+        stage_ids = list(stage_ids)
+        if not stage_ids:
+            return {}
+        marks = ", ".join("?" * len(stage_ids))
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT sp.stage_id, sp.part, p.cost, sp.quantity
+            FROM stage_products sp
+            JOIN products p ON sp.product_id = p.id
+            WHERE sp.stage_id IN ({marks})
+            UNION ALL
+            SELECT sm.stage_id, sm.part,
+                   CASE WHEN m.type = 'Пиломатериал' AND sm.length_mm
+                        THEN m.price * sm.length_mm / 1000.0 ELSE m.price END,
+                   sm.quantity
+            FROM stage_materials sm
+            JOIN materials m ON sm.material_id = m.id
+            WHERE sm.stage_id IN ({marks})
+        """, stage_ids * 2)
+        rows = cursor.fetchall()
+        conn.close()
+
+        fixed = dict.fromkeys(stage_ids, 0.0)
+        terms = {stage_id: [] for stage_id in stage_ids}
+        for stage_id, part, unit_cost, qty in rows:
+            unit_cost = unit_cost or 0.0
+            if part == 'meter':
+                terms[stage_id].append((qty, unit_cost))
+            else:
+                fixed[stage_id] += unit_cost * math.ceil(qty)
+
+        return {stage_id: StagePriceCurve(fixed[stage_id], terms[stage_id]) for stage_id in stage_ids}
+
+
+if __name__ == "__main__":
+    # Прайс "цена от длины" по этапу с десятком позиций на метр
+    import random
+    import time
+
+    random.seed(5)
+    terms = [(round(random.uniform(0.1, 6), 2), round(random.uniform(10, 900), 2)) for _ in range(12)]
+    fixed = 4200.0
+
+    def direct(length_mm):
+        return fixed + sum(unit * math.ceil(qty * (length_mm / 1000)) for qty, unit in terms)
+
+    started = time.perf_counter()
+    curve = StagePriceCurve(fixed, terms)
+    print(f"Построение: {len(curve.breakpoints)} точек скачков, {(time.perf_counter() - started) * 1000:.1f} мс")
+
+    lengths = [random.randint(1000, 100000) for _ in range(100000)]
+    for title, compute in (("по позициям", lambda: [direct(length) for length in lengths]),
+                           ("по кривой", lambda: [curve.price(length) for length in lengths]),
+                           ("по кривой пачкой", lambda: curve.prices(lengths))):
+        started = time.perf_counter()
+        values = compute()
+        print(f"{title}: {(time.perf_counter() - started) * 1000:.1f} мс")
+
+    assert all(abs(a - b) < 1e-6 for a, b in zip(values, (direct(length) for length in lengths)))
@@ -0,0 +1,18 @@
+# Модули приложения лежат плоско в src и импортируются по имени, как в main.py
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from db_dump import load_dump  # noqa: E402
+
+
+@pytest.fixture
+def seed_db(tmp_path):
+    """Демонстрационная база, собранная из снимка data/dump во временной папке"""
+    db_path = str(tmp_path / 'database.db')
+    load_dump(os.path.join(ROOT, 'data', 'dump'), db_path)
+    return db_path
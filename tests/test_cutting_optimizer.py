@@ -0,0 +1,118 @@
+import random
+from collections import Counter
+from itertools import combinations
+
+import pytest
+
+from cutting_optimizer import CuttingOptimizer, np
+from domain import Board, Requirement, StockLot
+
+
+def make_boards(lengths):
+    return sorted((Board(length) for length in lengths), key=lambda board: board.current_length, reverse=True)
+
+
+def random_case(rng):
+    boards = [rng.choice([6000, 4500, 3000]) for _ in range(rng.randint(1, 4))]
+    boards += [rng.randrange(500, 3000, 10) for _ in range(rng.randint(0, 3))]
+    pieces = [Requirement(rng.choice([300, 450, 750, 900, 1200, 2050, 2700]), f"Изделие {rng.randint(0, 3)}")
+              for _ in range(rng.randint(0, 14))]
+    return boards, pieces
+
+
+def check_packing(boards, pieces, unplaced):
+    """Каждый кусок либо отпилен ровно один раз, либо не размещен; доски не перерасходованы"""
+    cut = Counter(Requirement(*cut) for board in boards for cut in board.cuts)
+    assert cut + Counter(unplaced) == Counter(pieces)
+    for board in boards:
+        assert board.current_length >= 0
+        assert board.original_length - board.current_length == sum(cut.length for cut in board.cuts)
+
+
+@pytest.mark.parametrize("packer", [CuttingOptimizer._pack_pieces, CuttingOptimizer._pack_exact])
+def test_packers_keep_every_piece(packer):
+    rng = random.Random(29)
+    for _ in range(200):
+        lengths, pieces = random_case(rng)
+        boards = make_boards(lengths)
+        check_packing(boards, pieces, packer(boards, list(pieces)))
+
+
+def test_exact_fills_first_board_optimally():
+    rng = random.Random(7)
+    for _ in range(200):
+        lengths, pieces = random_case(rng)
+        boards = make_boards(lengths)
+        CuttingOptimizer._pack_exact(boards, list(pieces))
+        # Первая доска - лучшая сумма подмножества кусков, не длиннее доски (перебор)
+        capacity = boards[0].original_length
+        best = max(sum(piece.value for piece in subset)
+                   for size in range(len(pieces) + 1) for subset in combinations(pieces, size)
+                   if sum(piece.value for piece in subset) <= capacity)
+        assert boards[0].original_length - boards[0].current_length == best
+
+
+def test_exact_beats_greedy_where_best_fit_wastes():
+    pieces = [Requirement(450, "А"), Requirement(350, "Б"), Requirement(300, "В"), Requirement(300, "Г")]
+
+    greedy = make_boards([1000])
+    greedy_unplaced = CuttingOptimizer._pack_pieces(greedy, list(pieces))
+    exact = make_boards([1000])
+    exact_unplaced = CuttingOptimizer._pack_exact(exact, list(pieces))
+
+    # Жадный берет 450 + 350 и остается с 200 мм, точный собирает 350 + 300 + 300
+    assert greedy[0].current_length == 200
+    assert exact[0].current_length == 50
+    assert exact_unplaced == [Requirement(450, "А")]
+    assert sorted(greedy_unplaced) == [Requirement(300, "В"), Requirement(300, "Г")]
+
+
+def test_exact_never_places_less_than_greedy_on_one_board():
+    rng = random.Random(11)
+    for _ in range(200):
+        _, pieces = random_case(rng)
+        length = rng.randrange(1000, 6001, 50)
+        greedy, exact = make_boards([length]), make_boards([length])
+        CuttingOptimizer._pack_pieces(greedy, list(pieces))
+        CuttingOptimizer._pack_exact(exact, list(pieces))
+        assert exact[0].current_length <= greedy[0].current_length
+
+
+def lumber_case(rng):
+    stock = [StockLot("Брус", rng.choice([6000, 4500, 3000]), rng.randint(1, 30)) for _ in range(3)]
+    stock += [StockLot("Брус", rng.randrange(500, 3000, 10), 1) for _ in range(rng.randint(0, 10))]
+    requirements = [Requirement(rng.choice([450, 750, 900, 1200, 2050, 2700, 5000]), f"Изделие {rng.randint(0, 5)}")
+                    for _ in range(rng.randint(0, 150))]
+    return stock, requirements
+
+
+@pytest.mark.skipif(np is None, reason="NumPy не установлен")
+def test_vector_matches_greedy():
+    rng = random.Random(30)
+    for _ in range(50):
+        stock, requirements = lumber_case(rng)
+        greedy = CuttingOptimizer._process_lumber("Брус", list(requirements), stock, CuttingOptimizer.STRATEGY_GREEDY)
+        vector = CuttingOptimizer._process_lumber("Брус", list(requirements), stock, CuttingOptimizer.STRATEGY_VECTOR)
+
+        assert vector['instructions'] == greedy['instructions']
+        assert Counter(vector['updated']) == Counter(greedy['updated'])
+        assert vector['missing'] == greedy['missing']
+        assert Counter(vector['plan'].unplaced) == Counter(greedy['plan'].unplaced)
+        # Нераспиленные доски векторного плана - сводкой, а не объектами Board
+        assert all(board.cuts for board in vector['plan'].boards)
+        spare = sum(quantity for _, quantity in vector['plan'].spare)
+        assert spare + len(vector['plan'].boards) == sum(lot.quantity for lot in stock)
+
+
+@pytest.mark.skipif(np is None, reason="NumPy не установлен")
+def test_warm_start_from_vector_plan_matches_greedy():
+    rng = random.Random(31)
+    for _ in range(30):
+        stock, requirements = lumber_case(rng)
+        changed = requirements[:len(requirements) // 2] + [Requirement(900, "Новое")] * 5
+        plans = {strategy: CuttingOptimizer._process_lumber("Брус", list(requirements), stock, strategy)['plan']
+                 for strategy in (CuttingOptimizer.STRATEGY_GREEDY, CuttingOptimizer.STRATEGY_VECTOR)}
+        repaired = {strategy: CuttingOptimizer._repair_lumber("Брус", list(changed), stock, plan)
+                    for strategy, plan in plans.items()}
+        assert Counter(repaired['vector']['updated']) == Counter(repaired['greedy']['updated'])
+        assert repaired['vector']['missing'] == repaired['greedy']['missing']
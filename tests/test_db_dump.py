@@ -0,0 +1,74 @@
+import filecmp
+import os
+import shutil
+import sqlite3
+
+import pytest
+
+from conftest import ROOT
+from db_dump import dump_database, load_dump
+from order_plan import load_plan, plan_terms, save_plan
+
+PLAN = {'materials': [{'name': "Брус", 'boards': [[2, 6000, 300, [[2850, "Скамья"], [2850, "Скамья"]]]]}],
+        'fasteners': [{'name': "Саморез", 'used': [[24, "Скамья"]]}],
+        'totals': [["Брус", "м", 11.4], ["Саморез", "шт", 24]]}
+
+
+def same_dump(first, second):
+    names = sorted(os.listdir(first))
+    _, mismatch, errors = filecmp.cmpfiles(first, second, names, shallow=False)
+    return sorted(os.listdir(second)) == names and not mismatch and not errors
+
+
+def test_seed_dump_is_reproduced(seed_db, tmp_path):
+    dump_dir = str(tmp_path / 'dump')
+    dump_database(seed_db, dump_dir)
+    assert same_dump(os.path.join(ROOT, 'data', 'dump'), dump_dir)
+
+
+def test_round_trip_keeps_plans_and_search(seed_db, tmp_path):
+    conn = sqlite3.connect(seed_db)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO orders (order_date, total_cost) VALUES ('2026-01-01 10:00:00', 100)")
+        order_id = cursor.lastrowid
+        save_plan(cursor, order_id, PLAN)
+        conn.commit()
+    finally:
+        conn.close()
+
+    first, second = str(tmp_path / 'dump1'), str(tmp_path / 'dump2')
+    restored = str(tmp_path / 'restored.db')
+    counts = dump_database(seed_db, first)
+    assert load_dump(first, restored) == counts
+    dump_database(restored, second)
+    assert same_dump(first, second)
+
+    conn = sqlite3.connect(restored)
+    try:
+        cursor = conn.cursor()
+        assert load_plan(cursor, order_id) == PLAN
+        # Производные данные пересчитаны: поисковый индекс хранит слова плана
+        cursor.execute("SELECT instructions FROM order_search WHERE rowid = ?", (order_id,))
+        assert cursor.fetchone()[0] == plan_terms(PLAN)
+    finally:
+        conn.close()
+
+
+def test_duplicate_keys_are_reported_and_db_kept(seed_db, tmp_path):
+    dump_dir = str(tmp_path / 'dump')
+    shutil.copytree(os.path.join(ROOT, 'data', 'dump'), dump_dir)
+    # Одна и та же запись, добавленная при слиянии веток двух мастерских
+    path = os.path.join(dump_dir, 'materials.jsonl')
+    with open(path, encoding='utf-8') as source:
+        lines = source.readlines()
+    with open(path, 'a', encoding='utf-8', newline='\n') as output:
+        output.write(lines[1])
+    with open(seed_db, 'rb') as source:
+        before = source.read()
+
+    with pytest.raises(ValueError, match="повторяются ключи"):
+        load_dump(dump_dir, seed_db)
+    with open(seed_db, 'rb') as source:
+        assert source.read() == before
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
@@ -0,0 +1,103 @@
+import random
+import sqlite3
+from collections import Counter
+
+from cutting_optimizer import CuttingOptimizer
+from domain import Requirement, StockLot
+from order_plan import (build_plan, iter_boards, load_plan, order_instructions, pack_plan, plan_terms,
+                        render_instructions, save_plan, stock_before_plans, unpack_plan)
+
+TYPES = {"Брус": "Пиломатериал", "Саморез": "Метиз"}
+
+
+def order_case(rng, stock):
+    """Требования случайного заказа и его план, раскроенный по stock"""
+    products = [f"Изделие {i}" for i in range(rng.randint(1, 6))]
+    requirements = {"Брус": [Requirement(rng.choice([450, 900, 1200, 2050]), rng.choice(products))
+                             for _ in range(rng.randint(1, 60))],
+                    "Саморез": [Requirement(rng.randint(1, 20), rng.choice(products)) for _ in range(3)]}
+    lumber = CuttingOptimizer._process_lumber("Брус", requirements["Брус"], [lot for lot in stock if lot.length])
+    plan = build_plan({'plan': {"Брус": lumber['plan']}}, requirements, TYPES)
+    return requirements, lumber, plan
+
+
+def stock_case(rng):
+    stock = [StockLot("Брус", 6000, rng.randint(5, 20)), StockLot("Брус", 4500, rng.randint(0, 5))]
+    stock += [StockLot("Брус", rng.randrange(500, 3000, 10), 1) for _ in range(rng.randint(0, 5))]
+    return stock + [StockLot("Саморез", 0, 1000)]
+
+
+def after_order(stock, requirements, lumber):
+    """Склад после подтверждения заказа - как его списывает optimize_cutting"""
+    used = sum(quantity for quantity, _ in requirements["Саморез"])
+    fasteners = sum(lot.quantity for lot in stock if lot.material == "Саморез")
+    return lumber['updated'] + [StockLot("Саморез", 0, fasteners - used)]
+
+
+def test_pack_unpack_round_trip():
+    rng = random.Random(45)
+    for _ in range(30):
+        _, _, plan = order_case(rng, stock_case(rng))
+        assert unpack_plan(pack_plan(plan)) == plan
+
+
+def test_plan_reproduces_boards_and_instructions():
+    rng = random.Random(46)
+    for _ in range(30):
+        _, lumber, plan = order_case(rng, stock_case(rng))
+        cut_boards = [board for board in lumber['plan'].boards if board.cuts]
+        boards = list(iter_boards(plan['materials'][0]))
+        assert [(board.original_length, board.current_length, board.cuts) for board in boards] \
+            == [(board.original_length, board.current_length, board.cuts) for board in cut_boards]
+        legacy = "".join(f"{i}. {text}\n\n" for i, text in enumerate(lumber['instructions'], 1))
+        assert render_instructions(plan) == ("Материал: Брус\n" + legacy).strip()
+
+
+def test_plan_terms_are_names_only():
+    rng = random.Random(47)
+    requirements, _, plan = order_case(rng, stock_case(rng))
+    terms = plan_terms(plan)
+    names = {"Брус", "Саморез"} | {product for reqs in requirements.values() for _, product in reqs}
+    assert all(name in terms for name in names)
+    # Названия без повторов, длин кусков и текста инструкций в индексе нет
+    assert len(terms) == len(" ".join(names))
+    assert "Отпилить" not in terms
+
+
+def test_stock_before_plans_restores_stock():
+    rng = random.Random(48)
+    for _ in range(30):
+        stock = stock_case(rng)
+        plans = []
+        current = stock
+        # Два заказа подряд: второй режет остатки первого
+        for _ in range(2):
+            requirements, lumber, plan = order_case(rng, current)
+            if lumber['missing']:
+                break
+            current = after_order(current, requirements, lumber)
+            plans.append(plan)
+        restored = Counter({(lot.material, lot.length): lot.quantity for lot in stock_before_plans(current, plans)})
+        expected = Counter()
+        for lot in stock:
+            expected[lot.material, lot.length] += lot.quantity
+        assert restored == +expected
+
+
+def test_saved_plan_is_loaded_and_searchable(seed_db):
+    rng = random.Random(49)
+    _, _, plan = order_case(rng, stock_case(rng))
+    conn = sqlite3.connect(seed_db)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO orders (order_date, total_cost) VALUES ('2026-01-01 10:00:00', 0)")
+        order_id = cursor.lastrowid
+        save_plan(cursor, order_id, plan)
+        conn.commit()
+
+        assert load_plan(cursor, order_id) == plan
+        assert order_instructions(cursor, order_id) == render_instructions(plan)
+        cursor.execute("SELECT rowid FROM order_search WHERE order_search MATCH ?", ('"Саморез"',))
+        assert order_id in {rowid for rowid, in cursor.fetchall()}
+    finally:
+        conn.close()
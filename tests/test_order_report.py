@@ -0,0 +1,47 @@
+import sqlite3
+
+from cutting_optimizer import CuttingOptimizer
+from domain import Requirement, StockLot
+from order_plan import build_plan, save_plan
+from order_report import TABLE_CHUNK, load_order_report, render_order_pdf, report_key
+
+
+def large_plan(pieces):
+    """План с разными схемами распила - таблица раскроя на несколько кусков по TABLE_CHUNK строк"""
+    requirements = {"Брус": [Requirement(450 + 10 * (i % 250), f"Изделие {i % 7}") for i in range(pieces)]}
+    lumber = CuttingOptimizer._process_lumber("Брус", requirements["Брус"], [StockLot("Брус", 6000, pieces)])
+    return build_plan({'plan': {"Брус": lumber['plan']}}, requirements, {"Брус": "Пиломатериал"})
+
+
+def test_legacy_order_keeps_text_instructions(seed_db, tmp_path):
+    report = load_order_report(seed_db, 1)
+    assert report['plan'] is None and report['instructions'].startswith("Материал:")
+    assert load_order_report(seed_db, 999999) is None
+
+    path = tmp_path / "legacy.pdf"
+    render_order_pdf(str(path), report)
+    assert path.read_bytes().startswith(b"%PDF")
+
+
+def test_planned_order_report(seed_db, tmp_path):
+    plan = large_plan(1500)
+    assert len(plan['materials'][0]['boards']) > TABLE_CHUNK
+    conn = sqlite3.connect(seed_db)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO orders (order_date, total_cost) VALUES ('2026-01-01 10:00:00', 100)")
+        order_id = cursor.lastrowid
+        save_plan(cursor, order_id, plan)
+        conn.commit()
+    finally:
+        conn.close()
+
+    report = load_order_report(seed_db, order_id)
+    assert report['plan'] == plan and report['instructions'] is None
+    # Ключ кэша зависит только от данных заказа
+    assert report_key(report) == report_key(load_order_report(seed_db, order_id))
+    assert report_key(report) != report_key(dict(report, total_cost=101))
+
+    path = tmp_path / "plan.pdf"
+    render_order_pdf(str(path), report)
+    assert path.read_bytes().startswith(b"%PDF")
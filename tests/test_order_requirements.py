@@ -0,0 +1,63 @@
+import math
+import sqlite3
+
+from domain import Requirement
+from order_requirements import LUMBER, expand_order_python, expand_order_sql
+from stage_pricing import StagePriceCache
+
+
+def query(db_path, sql, params=()):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+
+def expand_both(db_path, order, rope_pieces):
+    prices = StagePriceCache(db_path)
+    python_result = expand_order_python(db_path, order, rope_pieces,
+                                        lambda stage_id, length_m: prices.price(stage_id, round(length_m * 1000)))
+    return python_result, expand_order_sql(db_path, order, rope_pieces)
+
+
+def assert_same(python_result, sql_result):
+    (python_cost, python_requirements), (sql_cost, sql_requirements) = python_result, sql_result
+    assert math.isclose(python_cost, sql_cost, rel_tol=1e-9, abs_tol=1e-6)
+    assert ({material: sorted(reqs) for material, reqs in python_requirements.items()}
+            == {material: sorted(reqs) for material, reqs in sql_requirements.items()})
+
+
+def test_products_and_stages_expand_the_same(seed_db):
+    product_ids = [row[0] for row in query(seed_db, "SELECT id FROM products ORDER BY id")]
+    stage_ids = [row[0] for row in query(seed_db, "SELECT id FROM stages ORDER BY id")]
+    order = [("Изделие", product_id, 1 + index % 3) for index, product_id in enumerate(product_ids)]
+    # Дробные длины этапов: округление позиций "на метр" вверх должно совпасть
+    order += [("Этап", stage_id, 1, length_m) for stage_id in stage_ids for length_m in (0.5, 1.0, 7.35, 12.5)]
+
+    python_result, sql_result = expand_both(seed_db, order, {})
+    assert python_result[1], "в демонстрационной базе у заказа должны быть требования"
+    assert_same(python_result, sql_result)
+
+
+def test_rope_pieces_replace_material_quantity(seed_db):
+    material_id, name = query(seed_db, "SELECT id, name FROM materials WHERE type = ? ORDER BY id", (LUMBER,))[0]
+    pieces = [Requirement(12500, "Трасса 1"), Requirement(8000, "Трасса 2")]
+    order = [("Материал", material_id, 20.5)]
+
+    python_result, sql_result = expand_both(seed_db, order, {material_id: pieces})
+    assert_same(python_result, sql_result)
+    assert sorted(sql_result[1][name]) == sorted(pieces)
+
+
+def test_unknown_items_are_skipped(seed_db):
+    order = [("Изделие", 999999, 2), ("Материал", 999999, 1)]
+    python_result, sql_result = expand_both(seed_db, order, {})
+    assert_same(python_result, sql_result)
+    assert sql_result == (0.0, {})
+
+
+def test_empty_order(seed_db):
+    python_result, sql_result = expand_both(seed_db, [], {})
+    assert_same(python_result, sql_result)
+    assert sql_result[0] == 0.0
@@ -0,0 +1,69 @@
+import random
+from itertools import product
+
+from route_planner import plan_routes
+from safety_rope import route_breakdown
+
+
+def random_stages(rng, n):
+    return [{'name': f"Этап {i}", 'length': round(rng.uniform(3, 15), 2),
+             'category': rng.choice(['Статика', 'Статика', 'Статика', 'Динамика', 'Зип'])} for i in range(n)]
+
+
+def feasible(route, max_route_length, max_stages):
+    """Ограничения трассы; этап длиннее ограничения может стоять в трассе один"""
+    if len(route) == 1:
+        return True
+    if max_route_length and sum(stage['length'] for stage in route) > max_route_length + 1e-9:
+        return False
+    return not (max_stages and len(route) > max_stages)
+
+
+def cost(routes):
+    breakdown = route_breakdown(routes)
+    return (round(sum(route['rope'] for route in breakdown), 6),
+            sum(route['clamps'] for route in breakdown), len(routes))
+
+
+def brute_force(stages, max_route_length, max_stages):
+    """Лучшая стоимость перебором всех точек разреза"""
+    best = None
+    for cuts in product((False, True), repeat=len(stages) - 1):
+        routes, start = [], 0
+        for index, is_cut in enumerate(cuts, 1):
+            if is_cut:
+                routes.append(stages[start:index])
+                start = index
+        routes.append(stages[start:])
+        if all(feasible(route, max_route_length, max_stages) for route in routes):
+            best = cost(routes) if best is None else min(best, cost(routes))
+    return best
+
+
+def test_plan_matches_brute_force():
+    rng = random.Random(34)
+    for _ in range(300):
+        stages = random_stages(rng, rng.randint(1, 9))
+        max_route_length = rng.choice([None, 20.0, 35.0, 60.0])
+        max_stages = rng.choice([None, 1, 2, 3, 5])
+
+        routes = plan_routes(stages, max_route_length, max_stages)
+        # Трассы покрывают все этапы по порядку, каждая проходит по ограничениям
+        assert [index for route in routes for index in route] == list(range(len(stages)))
+        planned = [[stages[index] for index in route] for route in routes]
+        assert all(feasible(route, max_route_length, max_stages) for route in planned)
+        assert cost(planned) == brute_force(stages, max_route_length, max_stages)
+
+
+def test_without_limits_one_route():
+    rng = random.Random(35)
+    stages = random_stages(rng, 12)
+    assert plan_routes(stages) == [list(range(12))]
+    assert plan_routes([]) == []
+
+
+def test_stage_longer_than_limit_gets_own_route():
+    stages = [{'name': "А", 'length': 10.0, 'category': 'Статика'},
+              {'name': "Б", 'length': 50.0, 'category': 'Статика'},
+              {'name': "В", 'length': 10.0, 'category': 'Статика'}]
+    assert plan_routes(stages, max_route_length=25.0) == [[0], [1], [2]]
@@ -0,0 +1,47 @@
+import math
+import random
+
+from stage_pricing import StagePriceCurve
+
+
+def legacy_price(fixed, terms, length_mm):
+    """Прежний расчет: постоянная часть плюс цена * ceil(количество * длина в м) по позициям"""
+    return fixed + sum(unit * math.ceil(qty * (length_mm / 1000)) for qty, unit in terms)
+
+
+def random_terms(rng):
+    return [(round(rng.uniform(0.1, 6), 2), round(rng.uniform(10, 900), 2)) for _ in range(rng.randint(1, 8))]
+
+
+def test_curve_matches_legacy_formula():
+    rng = random.Random(36)
+    for _ in range(20):
+        fixed, terms = round(rng.uniform(0, 5000), 2), random_terms(rng)
+        curve = StagePriceCurve(fixed, terms, horizon=20000)
+        lengths = [rng.randint(0, 20000) for _ in range(300)]
+        # Точки скачков и соседние миллиметры - там ошибка округления заметнее всего
+        lengths += [point + shift for point in curve.breakpoints[:50] for shift in (-1, 0, 1)]
+        for length in lengths:
+            assert math.isclose(curve.price(length), legacy_price(fixed, terms, length), abs_tol=1e-6)
+
+
+def test_batch_prices_match_single():
+    rng = random.Random(37)
+    curve = StagePriceCurve(1200.0, random_terms(rng))
+    lengths = [rng.randint(0, 100000) for _ in range(500)]
+    assert curve.prices(lengths) == [curve.price(length) for length in lengths]
+    assert curve.prices([]) == []
+
+
+def test_curve_extends_past_horizon():
+    terms = [(2.5, 40.0), (0.3, 700.0)]
+    curve = StagePriceCurve(100.0, terms, horizon=5000)
+    for length in (4999, 5000, 5001, 12345, 250000):
+        assert math.isclose(curve.price(length), legacy_price(100.0, terms, length), abs_tol=1e-6)
+    assert curve.horizon >= 250000
+
+
+def test_zero_and_empty_terms_cost_only_fixed_part():
+    curve = StagePriceCurve(500.0, [(0, 100.0), (2.0, 0)])
+    assert curve.terms == []
+    assert curve.price(0) == curve.price(30000) == 500.0